@@ -2,16 +2,43 @@
 Pipeline for running tasks.
 """
 
+import asyncio
+import multiprocessing
+import os
+import queue
+import shutil
+import threading
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from functools import cached_property, partial
+from itertools import chain
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from pathlib import Path
 from textwrap import dedent
-from typing import Any, Type, cast
+from typing import Any, AsyncGenerator, Iterable, Iterator, Type, cast
 from uuid import uuid4
 
 import pandas as pd
 from smolagents import Model, ToolCallingAgent
 
 from medminer.task.base import Task
+from medminer.utils.data import Document, DocumentBatch, pack_documents
+from medminer.utils.manifest import SessionManifest
+from medminer.utils.models import DefaultModel
+from medminer.utils.schema import (
+    Column,
+    apply_arrow_schema,
+    apply_schema,
+    imported_pyarrow,
+    read_csv,
+    read_parquet,
+    read_parquet_table,
+    to_arrow,
+)
+from medminer.utils.store import get_result_store
+from medminer.utils.writer import ParquetSessionWriter, checkpoint, close_writers, get_writer
+
+SHARD_POLL_INTERVAL = 0.5
 
 
 class Pipeline(ABC):
@@ -24,44 +51,650 @@ class Pipeline(ABC):
             tasks: List of tasks to perform.
             model: Model to use for processing.
             kwargs: Dictionary containing both task and model settings.
+                `max_workers` sets the maximum number of documents processed in parallel.
+                `fan_out` runs all tasks on a document at the same time instead of one after another.
+                `pack_tokens` packs consecutive documents into batches of up to this many tokens, so an agent
+                run processes several short documents at once (see `pack_documents`). The data has to be
+                `Document` items, rows of patients that are not in the batch are dropped, and the streams yield
+                the index of the first document of a batch.
         """
-        if "session_id" not in kwargs:
-            kwargs["session_id"] = uuid4().hex
-        if "base_dir" not in kwargs:
-            kwargs["base_dir"] = Path(__file__).parent.parent / "result"
-
-        self.tasks = [task(model=model, **kwargs) for task in tasks]
+        self.task_types = tasks
         self.model = model
-        self.settings = kwargs
+        self._configure(kwargs)
+
+    def _configure(self, kwargs: dict[str, Any]) -> None:
+        """Set the pipeline settings from the keyword arguments and keep the rest as task settings.
+
+        Args:
+            kwargs: Dictionary containing both task and pipeline settings.
+        """
+        self.max_workers = max(1, int(kwargs.pop("max_workers", 1)))
+        self.fan_out = bool(kwargs.pop("fan_out", False))
+        self.pack_tokens = int(kwargs.pop("pack_tokens", 0) or 0)
+        self.settings = self._default_settings(kwargs)
+
+    @cached_property
+    def tasks(self) -> list[Task]:
+        """The task instances of the pipeline, built on first use."""
+        return self.build_tasks()
+
+    @staticmethod
+    def _default_settings(settings: dict[str, Any]) -> dict[str, Any]:
+        if "session_id" not in settings:
+            settings["session_id"] = uuid4().hex
+        if "base_dir" not in settings:
+            settings["base_dir"] = Path(__file__).parent.parent / "result"
+
+        return settings
+
+    @property
+    def session_dir(self) -> Path:
+        """The directory the results of the session are saved to."""
+        return cast(Path, self.settings.get("base_dir")) / str(self.settings.get("session_id"))
+
+    @property
+    def schemas(self) -> dict[str, list[Column]]:
+        """The column schema of the results of every task."""
+        return {task.name: task.columns for task in self.task_types}
+
+    @property
+    def output_format(self) -> str:
+        """The format of the result files, "csv" or "parquet"."""
+        return str(self.settings.get("output_format") or "csv").strip().lower()
+
+    @property
+    def result_session_id(self) -> str:
+        """The session the rows are stored under in the result store, the session of the parent of a shard."""
+        return str(self.settings.get("result_session_id") or self.settings.get("session_id"))
+
+    @cached_property
+    def manifest(self) -> SessionManifest:
+        """The manifest of the (task, document) pairs completed in the session."""
+        return SessionManifest(self.session_dir / "manifest.jsonl")
+
+    @staticmethod
+    def _document_key(document: str | Document) -> str:
+        """Get the text a document is recorded under in the manifest, the same with and without packing."""
+        return document.content if isinstance(document, Document) else document
+
+    def _items(self, data: Iterable[str | Document]) -> Iterator[tuple[int, str | DocumentBatch]]:
+        """Get the items the agents run on, the documents or, with `pack_tokens`, batches of documents.
+
+        Args:
+            data: Data to process.
+
+        Yields:
+            The index of the (first) document of an item in the data and the item.
+        """
+        if not self.pack_tokens:
+            yield from ((index, self._document_key(document)) for index, document in enumerate(data))
+            return
+
+        def documents() -> Iterator[Document]:
+            for document in data:
+                if not isinstance(document, Document):
+                    raise TypeError("Packing documents requires `Document` items with the ids of the patients.")
+
+                yield document
+
+        index = 0
+        for batch in pack_documents(documents(), self.pack_tokens):
+            yield index, batch
+            index += len(batch.documents)
+
+    def _remaining(
+        self, task_names: Iterable[str], item: str | DocumentBatch, resume: bool
+    ) -> str | DocumentBatch | None:
+        """Get the part of an item that is not completed yet by all tasks.
+
+        Args:
+            task_names: The names of the tasks.
+            item: The document or batch of documents.
+            resume: Skip the completed documents.
+
+        Returns:
+            The item, the batch of its documents that are not completed, or None if the item is completed.
+        """
+        if not resume:
+            return item
+
+        task_names = list(task_names)
+        if isinstance(item, DocumentBatch):
+            # a resumed run may pack the documents differently, so every document is checked on its own
+            documents = [
+                document
+                for document in item.documents
+                if not all(self.manifest.is_completed(task_name, document.content) for task_name in task_names)
+            ]
+            return DocumentBatch(documents) if documents else None
+
+        return None if all(self.manifest.is_completed(task_name, item) for task_name in task_names) else item
+
+    def _process(self, task: Task, item: str | DocumentBatch, resume: bool) -> list[dict] | None:
+        """Run a task on a document and record it in the manifest.
+
+        Args:
+            task: The task to run.
+            item: The document or batch of documents to process.
+            resume: Skip the task if it is already completed for the document.
+
+        Returns:
+            The rows saved by the task, or None if the task was skipped.
+        """
+        if (remaining := self._remaining([task.name], item, resume)) is None:
+            return None
+
+        if isinstance(remaining, DocumentBatch):
+            rows = task.process(remaining.content, remaining.patient_ids)
+        else:
+            rows = task.process(remaining)
+        self._complete(task, remaining, rows)
+
+        return rows
+
+    def _complete(self, task: Task, item: str | DocumentBatch, rows: list[dict]) -> None:
+        """Write the rows a task saved for a document and mark the task as completed once they are on disk.
+
+        The rows are written together with the completion, so the rows of a document are only on disk once it
+        is recorded as completed (and a resumed run doesn't process it again and write its rows twice).
+        The completion is recorded with the next flush of the writer of the task, so the rows of many
+        documents are written and synced as one batch instead of syncing the session files for every document.
+        The rows still buffered at the end of a run are written and recorded by the checkpoint of the run.
+        The documents of a batch are recorded one by one with the rows of their patient.
+
+        Args:
+            task: The completed task.
+            item: The document or batch of documents.
+            rows: The rows saved by the task.
+        """
+        if not isinstance(item, DocumentBatch):
+            callbacks = [partial(self._record, task, item, rows)]
+        else:
+            patient_rows: dict[str, list[dict]] = defaultdict(list)
+            for row in rows:
+                patient_rows[str(row.get("patient_id", "")).strip()].append(row)
+
+            callbacks = []
+            for document in item.documents:
+                # the rows of a patient with several documents in the batch are recorded with the first one
+                document_rows = patient_rows.pop(str(document.patient_id).strip(), [])
+                callbacks.append(partial(self._record, task, document.content, document_rows))
+
+        writer = get_writer(self.session_dir / f"{task.name}.{self.output_format}", self.output_format, task.columns)
+        if rows:
+            writer.write(dict.fromkeys(chain.from_iterable(rows)), rows, callbacks)
+            return
+
+        for callback in callbacks:
+            writer.defer(callback)
+
+    def _record(self, task: Task, item: str, rows: list[dict]) -> None:
+        """Record a completed task in the result store, if one is configured, and in the manifest.
+
+        Args:
+            task: The completed task.
+            item: The document.
+            rows: The rows saved by the task.
+        """
+        if store_path := self.settings.get("result_store_path"):
+            code_columns = [column.name for column in task.columns if column.code]
+            get_result_store(str(store_path)).add(
+                self.result_session_id, task.name, rows, code_columns, SessionManifest.hash(item)
+            )
+
+        self.manifest.complete(task.name, item)
+
+    def build_tasks(self) -> list[Task]:
+        """Build a new set of task instances.
+
+        Every task instance owns its agent, so each worker has to use its own set.
+
+        Returns:
+            List of task instances.
+        """
+        return [task(model=self.model, **self.settings) for task in self.task_types]
+
+    @abstractmethod
+    def run(self, data: Iterable[str | Document], resume: bool = False) -> dict[str, pd.DataFrame]:
+        """Run the pipeline.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Returns:
+            Processed data.
+        """
+        raise NotImplementedError("Subclasses must implement this method.")
+
+    async def arun(self, data: Iterable[str | Document], resume: bool = False) -> dict[str, pd.DataFrame]:
+        """Run the pipeline without blocking the event loop.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Returns:
+            Processed data.
+        """
+        return await asyncio.to_thread(self.run, data, resume)
 
     @abstractmethod
-    def run(self, data: list[str]) -> dict[str, pd.DataFrame]:
-        """Run the pipeline."""
+    def stream(self, data: Iterable[str | Document], resume: bool = False) -> Iterator[tuple[int, str, list[dict]]]:
+        """Run the pipeline and yield the results of every document as soon as it is done.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Yields:
+            The index of the document, the name of the task and the rows it saved.
+        """
         raise NotImplementedError("Subclasses must implement this method.")
 
+    async def astream(
+        self, data: Iterable[str | Document], resume: bool = False
+    ) -> AsyncGenerator[tuple[int, str, list[dict]], None]:
+        """Run the pipeline without blocking the event loop and yield the results of every document.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Yields:
+            The index of the document, the name of the task and the rows it saved.
+        """
+        results = self.stream(data, resume)
+        done = object()
+        while (result := await asyncio.to_thread(next, results, done)) is not done:
+            yield cast(tuple[int, str, list[dict]], result)
+
+    def _build_results(self, rows: dict[str, list[dict]], resume: bool) -> dict[str, pd.DataFrame]:
+        """Build the results of a run from the rows collected while it was running.
+
+        The rows of work skipped by a resumed run are only saved on disk,
+        so the results of a resumed run are loaded from the session directory.
+
+        Args:
+            rows: The rows saved by every task.
+            resume: Whether the run was resumed.
+
+        Returns:
+            Dictionary with the results for every task.
+        """
+        if resume:
+            return self.load_results()
+
+        close_writers(self.session_dir)
+        schemas = self.schemas
+        results = {}
+        for task_name, task_rows in rows.items():
+            if not task_rows:
+                continue
+
+            df = pd.DataFrame(task_rows)
+            if self.output_format == "parquet":
+                columns = schemas.get(task_name, [])
+                table = apply_arrow_schema(to_arrow(df, columns), columns)
+                results[task_name] = table.to_pandas(types_mapper=pd.ArrowDtype)
+            else:
+                results[task_name] = apply_schema(df, schemas.get(task_name, []))
+
+        return results
+
+    def load_results(self) -> dict[str, pd.DataFrame]:
+        """Load the results of the session.
+
+        The results of the parquet output format are Arrow backed data frames.
+
+        Returns:
+            Dictionary with the results for every task.
+        """
+        close_writers(self.session_dir)
+        schemas = self.schemas
+        results = {
+            file_path.stem: read_csv(file_path, schemas.get(file_path.stem, []))
+            for file_path in self.session_dir.glob("*.csv")
+        }
+        if imported_pyarrow:
+            results |= {
+                file_path.stem: read_parquet(file_path, schemas.get(file_path.stem, []))
+                for file_path in self.session_dir.glob("*.parquet")
+            }
+
+        return results
+
 
 class SingleAgentPipeline(Pipeline):
     """Pipeline for running tasks."""
 
-    def run(self, data: list[str]) -> dict[str, pd.DataFrame]:
+    def run(self, data: Iterable[str | Document], resume: bool = False) -> dict[str, pd.DataFrame]:
         """Run the pipeline.
 
         Args:
             data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
 
         Returns:
             Processed data.
         """
-        for task in self.tasks:
-            for item in data:
-                task.run(item)
+        rows: dict[str, list[dict]] = defaultdict(list)
+        for _, task_name, task_rows in self.stream(data, resume):
+            rows[task_name].extend(task_rows)
 
-        base_dir: Path = cast(Path, self.settings.get("base_dir"))
+        return self._build_results(rows, resume)
 
-        return {
-            task.name: pd.read_csv(file_path)
-            for file_path in (base_dir / str(self.settings.get("session_id"))).glob("*.csv")
-        }
+    def stream(self, data: Iterable[str | Document], resume: bool = False) -> Iterator[tuple[int, str, list[dict]]]:
+        """Run the pipeline and yield the results of every document as soon as it is done.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Yields:
+            The index of the document, the name of the task and the rows it saved.
+        """
+        try:
+            if self.max_workers > 1 or self.fan_out:
+                yield from self._stream_concurrent(data, resume)
+            else:
+                for index, item in self._items(data):
+                    for task in self.tasks:
+                        if (rows := self._process(task, item, resume)) is not None:
+                            yield index, task.name, rows
+        finally:
+            # the documents completed before an error are recorded as well
+            checkpoint(self.session_dir)
+
+    def _stream_concurrent(self, data: Iterable[str | Document], resume: bool) -> Iterator[tuple[int, str, list[dict]]]:
+        """Run all tasks on the documents with a bounded pool of workers.
+
+        Only a small multiple of `max_workers` documents is submitted at any time,
+        so the memory used does not grow with the size of the data. With `fan_out`,
+        the tasks of a document run at the same time and the document is done with the slowest task.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Yields:
+            The index of the document, the name of the task and the rows it saved.
+        """
+        local = threading.local()
+
+        def process(item: str | DocumentBatch) -> list[tuple[str, list[dict]]]:
+            if not hasattr(local, "tasks"):
+                local.tasks = self.build_tasks()
+
+            if self.fan_out:
+                futures = [(task.name, task_executor.submit(self._process, task, item, resume)) for task in local.tasks]
+                return [(task_name, rows) for task_name, future in futures if (rows := future.result()) is not None]
+
+            return [
+                (task.name, rows) for task in local.tasks if (rows := self._process(task, item, resume)) is not None
+            ]
+
+        def collect(return_when: str) -> Iterator[tuple[int, str, list[dict]]]:
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                index = pending.pop(future)
+                for task_name, rows in future.result():
+                    yield index, task_name, rows
+
+        pending: dict[Future, int] = {}
+        with (
+            ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="medminer") as executor,
+            ThreadPoolExecutor(
+                max_workers=self.max_workers * len(self.task_types), thread_name_prefix="medminer-task"
+            ) as task_executor,
+        ):
+            try:
+                for index, item in self._items(data):
+                    pending[executor.submit(process, item)] = index
+                    if len(pending) >= 2 * self.max_workers:
+                        yield from collect(FIRST_COMPLETED)
+
+                while pending:
+                    yield from collect(FIRST_COMPLETED)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class AsyncPipeline(SingleAgentPipeline):
+    """Pipeline for running tasks from an event loop, e.g. in the callbacks of the UI.
+
+    `arun` and `astream` run the pipeline with the worker pool of the `SingleAgentPipeline` in a worker thread,
+    so the event loop only waits for the results. At most `max_workers` documents are processed at the same time.
+    """
+
+
+def _run_shard(
+    tasks: list[Type[Task]],
+    model_settings: dict[str, str],
+    settings: dict[str, Any],
+    data: list[str | Document],
+    indices: list[int],
+    threads: int,
+    resume: bool,
+    results: "queue.Queue[tuple[int, str, list[dict]]]",
+) -> None:
+    """Run all tasks on a shard of the data inside a worker process.
+
+    Args:
+        tasks: List of tasks to perform.
+        model_settings: Settings used to load the model of the worker.
+        settings: Pipeline and task settings of the shard.
+        data: Data of the shard.
+        indices: The indices of the documents of the shard in the data.
+        threads: Number of threads the model may use for inference.
+        resume: Skip the tasks that are already completed for a document.
+        results: Queue the results of every document are sent back on.
+    """
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    pipe = SingleAgentPipeline(tasks, DefaultModel(**model_settings).model, **settings)
+    for index, task_name, rows in pipe.stream(data, resume):
+        results.put((indices[index], task_name, rows))
+
+
+class ShardedPipeline(Pipeline):
+    """Pipeline for running tasks on shards of the data in several processes.
+
+    Every worker process loads its own model, e.g. to use all cores for local inference.
+    The request and token budgets of a rate limited deployment are split evenly between the worker processes.
+    """
+
+    def __init__(self, tasks: list[Type[Task]], model_settings: dict[str, str], **kwargs: Any) -> None:
+        """Initialize the pipeline.
+
+        Args:
+            tasks: List of tasks to perform.
+            model_settings: Settings used to load the model in every worker process (see `DefaultModel`).
+            kwargs: Dictionary containing the task settings and the pipeline settings of every shard (see `Pipeline`).
+                `processes` sets the number of worker processes (default: number of cores).
+        """
+        self.task_types = tasks
+        self.model_settings = model_settings
+        self.processes = max(1, int(kwargs.pop("processes", os.cpu_count() or 1)))
+        self._configure(kwargs)
+
+    @cached_property
+    def model(self) -> Model:  # type: ignore[override]
+        """The model of this process, only loaded if the tasks are used outside of the worker processes."""
+        return DefaultModel(**self.model_settings).model
+
+    def _shard_model_settings(self, shards: int) -> dict[str, str]:
+        """Get the model settings of a worker process, with an equal share of the rate limits of the deployment.
+
+        Args:
+            shards: The number of worker processes.
+
+        Returns:
+            The model settings.
+        """
+        model_settings = dict(self.model_settings)
+        for key in ("oai_requests_per_minute", "oai_tokens_per_minute"):
+            if budget := model_settings.get(key, "") or os.getenv(key.upper(), ""):
+                model_settings[key] = str(float(budget) / shards)
+
+        return model_settings
+
+    def run(self, data: Iterable[str | Document], resume: bool = False) -> dict[str, pd.DataFrame]:
+        """Run the pipeline.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Returns:
+            Processed data.
+        """
+        for _ in self.stream(data, resume):
+            pass
+
+        return self.load_results()
+
+    def stream(self, data: Iterable[str | Document], resume: bool = False) -> Iterator[tuple[int, str, list[dict]]]:
+        """Run the pipeline and yield the results of every document as soon as a worker process is done with it.
+
+        The data is split into contiguous shards, one per process, so it is loaded into memory.
+        Every shard writes to its own directory, which is merged into the session directory once
+        all shards are done. Shards left behind by an interrupted run are merged before the run starts.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Yields:
+            The index of the document, the name of the task and the rows it saved.
+        """
+        shards_dir = self.session_dir / "shards"
+        self._merge_shards(shards_dir)
+
+        task_names = [task.name for task in self.task_types]
+        items = [
+            (index, item)
+            for index, item in enumerate(data)
+            if self._remaining(task_names, self._document_key(item), resume) is not None
+        ]
+        if not items:
+            return
+
+        shard_size = -(-len(items) // self.processes)
+        shards = [items[i : i + shard_size] for i in range(0, len(items), shard_size)]
+        threads = max(1, (os.cpu_count() or 1) // len(shards))
+
+        if resume and self.manifest.path.exists():
+            # every shard needs to know which tasks are completed for partially processed documents
+            for i in range(len(shards)):
+                (shards_dir / str(i)).mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(self.manifest.path, shards_dir / str(i) / self.manifest.path.name)
+
+        model_settings = self._shard_model_settings(len(shards))
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager, ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as executor:
+            results = manager.Queue()
+            futures = {
+                executor.submit(
+                    _run_shard,
+                    self.task_types,
+                    model_settings,
+                    self.settings
+                    | {
+                        "base_dir": shards_dir,
+                        "session_id": str(i),
+                        "result_session_id": self.result_session_id,
+                        "max_workers": self.max_workers,
+                        "fan_out": self.fan_out,
+                        "pack_tokens": self.pack_tokens,
+                    },
+                    [item for _, item in shard],
+                    [index for index, _ in shard],
+                    threads,
+                    resume,
+                    results,
+                )
+                for i, shard in enumerate(shards)
+            }
+            while futures:
+                try:
+                    yield results.get(timeout=SHARD_POLL_INTERVAL)
+                    continue
+                except queue.Empty:
+                    pass
+
+                for future in [future for future in futures if future.done()]:
+                    futures.remove(future)
+                    # raises the error of a failed shard
+                    future.result()
+
+            # a shard sends all its results before it is done
+            while not results.empty():
+                yield results.get()
+
+        self._merge_shards(shards_dir)
+
+    def _merge_shards(self, shards_dir: Path) -> None:
+        """Append the results and manifests of all shards to the session directory in shard order.
+
+        Args:
+            shards_dir: Directory containing one directory per shard.
+        """
+        if not shards_dir.exists():
+            return
+
+        # the shards checkpoint their results, but rows of this process may still be buffered
+        close_writers(self.session_dir)
+        shard_dirs = sorted((path for path in shards_dir.iterdir() if path.name.isdigit()), key=lambda p: int(p.name))
+        for task in self.task_types:
+            if self.output_format == "parquet":
+                self._merge_parquet_shards(task, shard_dirs)
+                continue
+
+            shard_files = [
+                file_path for shard_dir in shard_dirs if (file_path := shard_dir / f"{task.name}.csv").exists()
+            ]
+            if not shard_files:
+                continue
+
+            file_path = self.session_dir / f"{task.name}.csv"
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            # the rows are appended as they are, values that don't parse as their dtype (e.g. a dose of "1/2") are kept
+            df = pd.concat(
+                [pd.read_csv(shard_file, dtype=str, keep_default_na=False) for shard_file in shard_files],
+                ignore_index=True,
+            )
+            df.to_csv(file_path, mode="a", index=False, header=not file_path.exists())
+
+        for shard_dir in shard_dirs:
+            self.manifest.merge(SessionManifest(shard_dir / self.manifest.path.name))
+
+        shutil.rmtree(shards_dir, ignore_errors=True)
+
+    def _merge_parquet_shards(self, task: Type[Task], shard_dirs: list[Path]) -> None:
+        """Append the Parquet results of a task of all shards to the session directory in shard order.
+
+        Args:
+            task: The task.
+            shard_dirs: The directories of the shards in order.
+        """
+        tables = [
+            table
+            for shard_dir in shard_dirs
+            if (shard_path := shard_dir / f"{task.name}.parquet").exists()
+            and (table := read_parquet_table(shard_path)) is not None
+        ]
+        writer = cast(
+            ParquetSessionWriter, get_writer(self.session_dir / f"{task.name}.parquet", "parquet", task.columns)
+        )
+        for table in tables:
+            writer.write_part(table)
 
 
 class MultiAgentPipeline(Pipeline):
@@ -115,24 +748,57 @@ class MultiAgentPipeline(Pipeline):
 
         return f"{prompt}{'-' * 80}\n\n{task_prompt}{'-' * 80}\n\nData: \n{data}"
 
-    def run(self, data: list[str]) -> dict[str, pd.DataFrame]:
+    def run(self, data: Iterable[str | Document], resume: bool = False) -> dict[str, pd.DataFrame]:
         """Run the pipeline.
 
         Args:
             data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
 
         Returns:
             Processed data.
         """
-        manager_agent = ToolCallingAgent(tools=[], model=self.model, managed_agents=[task.agent for task in self.tasks])
-        for item in data:
-            manager_agent.run(
-                self.build_prompt(item),
-            )
+        rows: dict[str, list[dict]] = defaultdict(list)
+        for _, task_name, task_rows in self.stream(data, resume):
+            rows[task_name].extend(task_rows)
 
-        base_dir: Path = cast(Path, self.settings.get("base_dir"))
+        return self._build_results(rows, resume)
 
-        return {
-            file_path.stem: pd.read_csv(file_path)
-            for file_path in (base_dir / str(self.settings.get("session_id"))).glob("*.csv")
-        }
+    def stream(self, data: Iterable[str | Document], resume: bool = False) -> Iterator[tuple[int, str, list[dict]]]:
+        """Run the pipeline and yield the results of every document as soon as it is done.
+
+        Args:
+            data: Data to process.
+            resume: Skip the tasks that are already completed for a document in this session.
+
+        Yields:
+            The index of the document, the name of the task and the rows it saved.
+        """
+        manager_agent = ToolCallingAgent(tools=[], model=self.model, managed_agents=[task.agent for task in self.tasks])
+        try:
+            for index, item in self._items(data):
+                if (remaining := self._remaining([task.name for task in self.tasks], item, resume)) is None:
+                    continue
+
+                patient_ids = remaining.patient_ids if isinstance(remaining, DocumentBatch) else None
+                for task in self.tasks:
+                    task.collect_rows()
+                    task.restrict_patients(patient_ids)
+                    task.hold_rows(True)
+
+                try:
+                    manager_agent.run(
+                        self.build_prompt(remaining.content if isinstance(remaining, DocumentBatch) else remaining),
+                    )
+                finally:
+                    for task in self.tasks:
+                        task.restrict_patients(None)
+                        task.hold_rows(False)
+
+                for task in self.tasks:
+                    rows = task.collect_rows()
+                    self._complete(task, remaining, rows)
+                    yield index, task.name, rows
+        finally:
+            # the documents completed before an error are recorded as well
+            checkpoint(self.session_dir)
@@ -4,15 +4,17 @@ This module contains the base task and registry for the MedMiner project.
 
 import tempfile
 from abc import ABC
-from functools import cache
+from functools import cache, cached_property
 from pathlib import Path
 from textwrap import dedent, indent
-from typing import Any, Type, TypeVar
+from typing import Any, Iterable, Type, TypeVar
 from uuid import uuid4
 
 from smolagents import Model, MultiStepAgent, Tool, ToolCallingAgent
 
+from medminer.tools.csv import CSVTool
 from medminer.tools.settings import ToolSetting, ToolSettingMixin
+from medminer.utils.schema import Column
 
 
 class Task(ABC):
@@ -24,7 +26,8 @@ class Task(ABC):
     agent_type: Type[MultiStepAgent] = ToolCallingAgent
     tools: list[Tool | Type[Tool]] = []
     agent_params: dict[str, Any] = {}
-    skip_settings: list[str] = ["task_name", "session_id", "base_dir"]
+    columns: list[Column] = []
+    skip_settings: list[str] = ["task_name", "session_id", "base_dir", "columns"]
 
     def __init__(
         self,
@@ -39,6 +42,7 @@ class Task(ABC):
             kwargs: Additional arguments for the task.
         """
         kwargs["task_name"] = self.name
+        kwargs["columns"] = list(self.columns)
         if "session_id" not in kwargs:
             kwargs["session_id"] = uuid4().hex
         if "base_dir" not in kwargs:
@@ -102,17 +106,30 @@ class Task(ABC):
 
         return list(settings.values())
 
-    def _build_prompt(self, data: str) -> str:
+    def _build_prompt_prefix(self) -> str:
         return dedent(
             f"""\
             Task name: {self.name}
             Prompt: \n{indent(self.prompt, " " * 4 * 5)}
-
-            {"-" * 80}
-            Data: \n{indent(data, " " * 4 * 5)}
             """
         )
 
+    @cached_property
+    def prompt_prefix(self) -> str:
+        """
+        Get the static part of the prompt that is the same for every document.
+
+        The prefix is built once, so every prompt of the task starts with exactly the same text.
+        This is what makes the prompt cache of remote providers and the prefix cache of local models hit.
+
+        Returns:
+            The prompt prefix.
+        """
+        return self._build_prompt_prefix()
+
+    def _build_prompt(self, data: str) -> str:
+        return f"{self.prompt_prefix}\n{'-' * 80}\nData: \n{indent(data, ' ' * 4 * 2)}\n"
+
     def run(self, data: str) -> Any:
         """
         Run the task.
@@ -123,8 +140,72 @@ class Task(ABC):
         Returns:
             The result of the task.
         """
+        # drop rows of earlier runs nobody collected
+        self.collect_rows()
+
         return self.agent.run(self._build_prompt(data))
 
+    def process(self, data: str, patient_ids: Iterable[str] | None = None) -> list[dict]:
+        """
+        Run the task and return the rows it saved, without writing them to the result file.
+
+        Args:
+            data: The data to process.
+            patient_ids: The patients of the data, e.g. of a batch of documents. Rows of other patients are dropped.
+
+        Returns:
+            The rows saved while processing the data.
+        """
+        self.restrict_patients(patient_ids)
+        self.hold_rows(True)
+        try:
+            self.run(data)
+        finally:
+            self.restrict_patients(None)
+            self.hold_rows(False)
+
+        return self.collect_rows()
+
+    def restrict_patients(self, patient_ids: Iterable[str] | None) -> None:
+        """
+        Only let the tools of the task save rows of the given patients.
+
+        Args:
+            patient_ids: The patient ids, or None to allow all patients.
+        """
+        allowed = None if patient_ids is None else {str(patient_id).strip() for patient_id in patient_ids}
+        for tool in self.agent.tools.values():
+            if isinstance(tool, CSVTool):
+                tool.patient_ids = allowed
+
+    def hold_rows(self, hold: bool) -> None:
+        """
+        Keep the rows saved by the tools of the task until they are collected instead of writing them.
+
+        The pipelines write the rows of a document together with its completion, so the rows of a document
+        that was not completed (e.g. because the run crashed) are never on disk.
+
+        Args:
+            hold: Whether the rows are held.
+        """
+        for tool in self.agent.tools.values():
+            if isinstance(tool, CSVTool):
+                tool.write_rows = not hold
+
+    def collect_rows(self) -> list[dict]:
+        """
+        Collect the rows saved by the tools of the task since the last call.
+
+        Returns:
+            The saved rows.
+        """
+        rows = []
+        for tool in self.agent.tools.values():
+            if isinstance(tool, CSVTool):
+                rows.extend(tool.drain())
+
+        return rows
+
 
 T = TypeVar("T", bound=Task)
 
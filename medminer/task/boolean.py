@@ -3,6 +3,7 @@ from textwrap import dedent, indent
 from medminer.task import Task, register_task
 from medminer.tools import CSVTool, get_rxcui, get_va
 from medminer.tools.settings import ToolSetting
+from medminer.utils.schema import Column
 
 
 @register_task
@@ -46,6 +47,12 @@ class BooleanTask(Task):
         """
     )
     tools = [CSVTool, get_rxcui, get_va]
+    columns = [
+        Column("patient_id"),
+        Column("patient_filter", "boolean"),
+        Column("patient_information"),
+        Column("filter_reference"),
+    ]
 
     @classmethod
     def settings(cls) -> list[ToolSetting]:
@@ -53,15 +60,12 @@ class BooleanTask(Task):
         settings.append(ToolSetting(id="boolean_query", label="Filter Query", type=str))
         return settings
 
-    def _build_prompt(self, data: str) -> str:
+    def _build_prompt_prefix(self) -> str:
         return dedent(
             f"""\
             Task name: {self.name}
             Prompt: \n{indent(self.prompt, " " * 4 * 5)}
 
             Filter query: {self._settings.get("boolean_query", "")}
-
-            {"-" * 80}
-            Data: \n{indent(data, " " * 4 * 5)}
             """
         )
@@ -7,6 +7,7 @@ from textwrap import dedent
 from medminer.task import Task, register_task
 from medminer.tools.csv import CSVTool
 from medminer.tools.diagnosis import ICDDiagnosisTool, extract_diagnosis_data
+from medminer.utils.schema import Column
 
 
 @register_task
@@ -53,3 +54,12 @@ class HistoryTask(Task):
         """
     )
     tools = [CSVTool, extract_diagnosis_data, ICDDiagnosisTool]
+    columns = [
+        Column("patient_id"),
+        Column("diagnosis_reference"),
+        Column("diagnosis_translated"),
+        Column("diagnosis"),
+        Column("month", "Int64"),
+        Column("year", "Int64"),
+        Column("icd11_code", "category", code=True),
+    ]
@@ -6,6 +6,7 @@ from textwrap import dedent
 
 from medminer.task import Task, register_task
 from medminer.tools import CSVTool, extract_medication_data, get_atc, get_rxcui
+from medminer.utils.schema import Column
 
 
 @register_task
@@ -80,3 +81,21 @@ class MedicationTask(Task):
         """
     )
     tools = [CSVTool, extract_medication_data, get_rxcui, get_atc]
+    columns = [
+        Column("patient_id"),
+        Column("medication_reference"),
+        Column("medication_name"),
+        Column("medication_translated"),
+        Column("active_ingredient"),
+        Column("dose", "Float64"),
+        Column("unit", "category"),
+        Column("dosage_morning", "Float64"),
+        Column("dosage_noon", "Float64"),
+        Column("dosage_evening", "Float64"),
+        Column("dosage_night", "Float64"),
+        Column("dosage_information"),
+        Column("rxcui", "category", code=True),
+        Column("atc_id", "category", code=True),
+        Column("atc_name", "category"),
+        Column("atc_type", "category"),
+    ]
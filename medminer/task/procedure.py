@@ -5,9 +5,10 @@ This module contains the ProcedureTask class, which is responsible for extractin
 from textwrap import dedent
 
 from medminer.task import Task, register_task
-from medminer.tools import SNOMEDTool
+from medminer.tools import SNOMEDBatchTool
 from medminer.tools.csv import CSVTool
 from medminer.tools.procedure import extract_procedure_data
+from medminer.utils.schema import Column
 
 
 @register_task
@@ -27,12 +28,12 @@ class ProcedureTask(Task):
         After you extracted all relevant procedures go through each of the procedure_search_terms and search for the SNOMED CT ID and FSN.
         The SNOMED CT ID is a unique identifier for the procedure in the SNOMED CT database.
         The FSN is a fully specified name (FSN) of the procedure in SNOMED CT.
-        Use the `search_snomed_procedures` tool to find SNOMED CT concepts to finde the information by following these steps:
-        - supply the `procedure_search` term to the `term` parameter of the tool.
-        - supply synonyms (e.g. {"Cranial": "Head"}) for the words in the search term to the `synonyms` parameter of the tool. if there are no synonyms, write an empty dict.
-        - supply additional keywords (e.g. CT) to the `keywords` parameter of the tool. If there are no additional keywords, write an empty list.
-        If possible add synonyms for words in the search term and additional keywords to the tool call.
-        You will get back a list of dictionaries with the following keys: ids and fsn.
+        Use the `search_snomed_procedures_batch` tool to find SNOMED CT concepts for all procedures at once. Supply one search per procedure to the `items` parameter of the tool:
+        - supply the `procedure_search` term to the `term` key of the search.
+        - supply synonyms (e.g. {"Cranial": "Head"}) for the words in the search term to the `synonyms` key of the search. if there are no synonyms, write an empty dict.
+        - supply additional keywords (e.g. CT) to the `keywords` key of the search. If there are no additional keywords, write an empty list.
+        If possible add synonyms for words in the search term and additional keywords to the searches.
+        You will get back a dictionary that maps each search term to a list of dictionaries with the following keys: ids and fsn.
         Compare the extracted information with the returned descriptions from the snomed server and choose the returned concept that matches the searched term the closest.
         Make sure not do add or loose any detail. If there are no codes, write an empty string. This is the `snomed_id` and `snomed_fsn` columns.
 
@@ -73,4 +74,15 @@ class ProcedureTask(Task):
         - snomed_fsn: The fully specified name (FSN) of the procedure in SNOMED CT.
         """
     )
-    tools = [CSVTool, SNOMEDTool, extract_procedure_data]
+    tools = [CSVTool, SNOMEDBatchTool, extract_procedure_data]
+    columns = [
+        Column("patient_id"),
+        Column("procedure_reference"),
+        Column("procedure_corrected"),
+        Column("procedure_search"),
+        Column("year", "Int64"),
+        Column("month", "Int64"),
+        Column("day", "Int64"),
+        Column("snomed_id", "category", code=True),
+        Column("snomed_fsn", "category"),
+    ]
@@ -4,15 +4,23 @@ This module contains tools for the task agents in the MedMiner project.
 
 from medminer.tools.csv import CSVTool
 from medminer.tools.diagnosis import ICDDiagnosisTool
-from medminer.tools.medication import extract_medication_data, get_atc, get_rxcui, get_va
-from medminer.tools.procedure import SNOMEDTool
+from medminer.tools.medication import (
+    extract_medication_data,
+    get_atc,
+    get_rxclass,
+    get_rxcui,
+    get_va,
+)
+from medminer.tools.procedure import SNOMEDBatchTool, SNOMEDTool
 
 __all__ = [
     "extract_medication_data",
     "get_rxcui",
+    "get_rxclass",
     "get_atc",
     "get_va",
     "SNOMEDTool",
+    "SNOMEDBatchTool",
     "CSVTool",
     "ICDDiagnosisTool",
 ]
@@ -2,13 +2,17 @@
 This module contains tools for saving data to a csv file.
 """
 
-from csv import DictWriter
 from itertools import chain
 from pathlib import Path
+from typing import Any
 
 from smolagents import Tool
 
 from medminer.tools.settings import ToolSetting, ToolSettingMixin
+from medminer.utils.schema import Column, column_names, imported_pyarrow
+from medminer.utils.writer import get_writer
+
+OUTPUT_FORMATS = ("csv", "parquet")
 
 
 class CSVTool(ToolSettingMixin, Tool):
@@ -40,10 +44,46 @@ class CSVTool(ToolSettingMixin, Tool):
         ToolSetting(id="session_id", label="Session ID", type=str),
         ToolSetting(id="task_name", label="Task Name", type=str),
         ToolSetting(id="base_dir", label="Base Directory", type=Path),
+        ToolSetting(id="columns", label="Columns", type=list, required=False),
+        ToolSetting(id="output_format", label="Output Format (csv or parquet)", type=str, required=False),
+        ToolSetting(id="result_store_path", label="Result Store (SQLite file)", type=str, required=False),
     ]
     session_id: str
     task_name: str
     base_dir: Path
+    columns: list[Column] | None
+    output_format: str
+    result_store_path: str | None
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+
+        self.output_format = (self.output_format or "csv").strip().lower()
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown output format: {self.output_format}, expected one of {OUTPUT_FORMATS}")
+        if self.output_format == "parquet" and not imported_pyarrow:
+            raise ImportError("The parquet output format requires pyarrow, install it with `pip install pyarrow`.")
+
+        self._saved_rows: list[dict] = []
+        # the patients of the data the agent runs on, rows of other patients are dropped
+        self.patient_ids: set[str] | None = None
+        # the pipelines write the rows of a document together with its completion, see `Task.hold_rows`
+        self.write_rows = True
+
+    @property
+    def file_path(self) -> Path:
+        """The result file of the task, a directory of part files for the parquet format."""
+        return self.base_dir / self.session_id / f"{self.task_name}.{self.output_format}"
+
+    def drain(self) -> list[dict]:
+        """
+        Get the rows saved since the last call and forget them.
+
+        Returns:
+            The saved rows.
+        """
+        rows, self._saved_rows = self._saved_rows, []
+        return rows
 
     def forward(
         self,
@@ -73,23 +113,45 @@ class CSVTool(ToolSettingMixin, Tool):
             return "No data to save."
 
         # small hack to get all keys from all dictionaries to have all possible columns
-        fieldnames = dict.fromkeys(chain.from_iterable([d.keys() for d in data])).keys()
-        file_path = self.base_dir / self.session_id / f"{self.task_name}.csv"
-        if not file_path.parent.exists():
-            file_path.parent.mkdir(parents=True)
+        keys = list(dict.fromkeys(chain.from_iterable([d.keys() for d in data])))
 
         for row in data:
             for key, value in row.items():
                 if isinstance(value, str):
                     row[key] = value.replace("\n", ";").replace("\r", "")
 
-        with open(file_path, "a") as csvfile:
-            writer = DictWriter(csvfile, fieldnames=fieldnames)
-
-            if file_path.exists() and file_path.stat().st_size == 0:
-                writer.writeheader()
-
-            for row in data:
-                writer.writerow(row)
-
-        return f"Saved data for task {task_name} to {file_path}"
+        unknown: list[str] = []
+        if self.patient_ids is not None:
+            unknown = list(
+                dict.fromkeys(
+                    patient_id
+                    for row in data
+                    if (patient_id := str(row.get("patient_id", "")).strip()) not in self.patient_ids
+                )
+            )
+            data = [row for row in data if str(row.get("patient_id", "")).strip() in self.patient_ids]
+            if not data:
+                return f"No data saved, unknown patient ids: {', '.join(unknown)}. Use the IDs after `Patient:`."
+
+        ignored = []
+        fieldnames = keys
+        if self.columns:
+            # the columns of the task schema in their order, missing values are empty
+            fieldnames = column_names(self.columns)
+            ignored = [key for key in keys if key not in fieldnames]
+            data = [{column: row.get(column, "") for column in fieldnames} for row in data]
+
+        # the rows are buffered by the writer of the file and written to disk at the latest at the next checkpoint
+        file_path = self.file_path
+        if self.write_rows:
+            get_writer(file_path, self.output_format, self.columns or ()).write(fieldnames, data)
+
+        self._saved_rows.extend(data)
+
+        message = f"Saved data for task {task_name} to {file_path}"
+        if ignored:
+            message += f". Ignored unknown columns: {', '.join(ignored)}"
+        if unknown:
+            message += f". Dropped the rows of unknown patient ids: {', '.join(unknown)}, use the IDs after `Patient:`"
+
+        return message
@@ -2,13 +2,19 @@
 This module contains various tools for extracting and processing medical data.
 """
 
+import threading
 import time
-from typing import Any
 
 import httpx
 from smolagents import Tool, tool
 
 from medminer.tools.settings import ToolSetting, ToolSettingMixin, ToolUISetting
+from medminer.utils.http import fetch_unique, get_client
+from medminer.utils.icd11 import get_icd11_index
+
+ICD_TOKEN_URL = "https://icdaccessmanagement.who.int/"
+ICD_API_URL = "https://id.who.int/"
+ICD_RELEASE = "2022-02"
 
 
 @tool
@@ -42,6 +48,134 @@ def extract_diagnosis_data(
     return data
 
 
+class ICDTokenProvider:
+    """Process-wide access token of an ICD API client.
+
+    The token is fetched once under a lock, so concurrent tools do not request a token each,
+    and is refreshed in the background shortly before it expires, as long as it is used.
+    """
+
+    REFRESH_MARGIN = 60
+
+    def __init__(self, client_id: str, client_secret: str) -> None:
+        """Initialize the provider.
+
+        Args:
+            client_id: The client id of the ICD API.
+            client_secret: The client secret of the ICD API.
+        """
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._token: str | None = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self._used = False
+
+    def get_token(self) -> str:
+        """
+        Get a valid access token, fetching a new one if there is none.
+
+        Returns:
+            The access token.
+        """
+        with self._lock:
+            if self._token is None or time.time() >= self._expires_at:
+                self._store(*self._fetch())
+
+            self._used = True
+            return self._token  # type: ignore[return-value]
+
+    def close(self) -> None:
+        """Stop refreshing the token in the background."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _fetch(self) -> tuple[str, float]:
+        response = get_client(ICD_TOKEN_URL).post(
+            "connect/token",
+            data={
+                "client_id": self.client_id,
+                "client_secret": self.client_secret,
+                "scope": "icdapi_access",
+                "grant_type": "client_credentials",
+            },
+        )
+        response.raise_for_status()
+        response_data = response.json()
+
+        # a token is valid for 1 hour if the response doesn't say otherwise
+        return response_data["access_token"], float(response_data.get("expires_in", 3600))
+
+    def _store(self, token: str, expires_in: float) -> None:
+        self._token = token
+        self._expires_at = time.time() + expires_in
+
+        if self._timer is not None:
+            self._timer.cancel()
+
+        # a token that is only valid for a short time is refreshed after half of its lifetime
+        self._timer = threading.Timer(max(expires_in - self.REFRESH_MARGIN, expires_in / 2, 1), self._refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh(self) -> None:
+        timer = threading.current_thread()
+        with self._lock:
+            if timer is not self._timer:
+                # the provider was closed or the token was fetched on demand in the meantime
+                return
+
+            if not self._used:
+                # nobody used the token since the last refresh, it is fetched on demand once it is needed again
+                self._timer = None
+                return
+
+            self._used = False
+
+        # the current token stays valid while the new one is fetched, so the tools don't wait for the refresh
+        try:
+            token, expires_in = self._fetch()
+        except Exception:
+            with self._lock:
+                if timer is self._timer:
+                    # the token is fetched on demand once it expired
+                    self._timer = None
+            return
+
+        with self._lock:
+            if timer is self._timer:
+                self._store(token, expires_in)
+
+
+_token_providers: dict[str, ICDTokenProvider] = {}
+_token_providers_lock = threading.Lock()
+
+
+def get_token_provider(client_id: str, client_secret: str) -> ICDTokenProvider:
+    """
+    Get the token provider of an ICD API client.
+
+    Args:
+        client_id: The client id of the ICD API.
+        client_secret: The client secret of the ICD API.
+
+    Returns:
+        The token provider shared by all tools using the client.
+    """
+    with _token_providers_lock:
+        provider = _token_providers.get(client_id)
+        if provider is None or provider.client_secret != client_secret:
+            if provider is not None:
+                provider.close()
+
+            provider = _token_providers[client_id] = ICDTokenProvider(client_id, client_secret)
+
+    return provider
+
+
 class ICDDiagnosisTool(ToolSettingMixin, Tool):
     """A tool for looking up ICD-11 codes for a list of terms."""
 
@@ -57,47 +191,106 @@ class ICDDiagnosisTool(ToolSettingMixin, Tool):
     output_type = "array"
 
     settings = [
-        ToolSetting(id="icd_client_id", label="ICD Client ID", type=str),
+        ToolSetting(id="icd_client_id", label="ICD Client ID", type=str, required=False),
         ToolSetting(
-            id="icd_client_secret", label="ICD Client Secret", type=str, ui=ToolUISetting(params={"type": "password"})
+            id="icd_client_secret",
+            label="ICD Client Secret",
+            type=str,
+            ui=ToolUISetting(params={"type": "password"}),
+            required=False,
+        ),
+        ToolSetting(id="icd_release", label="ICD-11 Release (e.g. 2024-01)", type=str, required=False),
+        ToolSetting(
+            id="icd_index_path", label="ICD-11 Local Index (SimpleTabulation file or folder)", type=str, required=False
         ),
     ]
-    icd_client_id: str
-    icd_client_secret: str
+    icd_client_id: str | None
+    icd_client_secret: str | None
+    icd_release: str | None
+    icd_index_path: str | None
 
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
-        super().__init__(*args, **kwargs)
+    def _token_provider(self) -> ICDTokenProvider:
+        if not self.icd_client_id or not self.icd_client_secret:
+            raise ValueError("The ICD Client ID and Secret are required without a local ICD-11 index.")
 
-        self._token_cache = {"token": None, "expires_at": 0}
+        return get_token_provider(self.icd_client_id, self.icd_client_secret)
 
     def get_token(self) -> str:
         """
         Authenticate with the WHO ICD API and return an access token.
-        Caches the token for the period it is valid to reduce roundtrip time.
+        The token is shared by all tools with the same client id (see `ICDTokenProvider`).
+        """
+        return self._token_provider().get_token()
+
+    @property
+    def _search_path(self) -> str:
+        return f"icd/release/11/{self.icd_release or ICD_RELEASE}/mms/search"
+
+    @staticmethod
+    def _search_local(index_path: str, terms: list[str]) -> list[dict]:
         """
-        # Check if the cached token is still valid
-        if self._token_cache["token"] and time.time() < self._token_cache["expires_at"]:  # type: ignore[operator]
-            return self._token_cache["token"]  # type: ignore[return-value]
-
-        payload = {
-            "client_id": self.icd_client_id,
-            "client_secret": self.icd_client_secret,
-            "scope": "icdapi_access",
-            "grant_type": "client_credentials",
+        Lookup ICD-11 codes for a list of terms in the local index.
+
+        Args:
+            index_path: The path of the index (see `get_icd11_index`).
+            terms: A list of terms to search for.
+
+        Returns:
+            A list of dictionaries containing the ICD-11 codes and their title and scores.
+        """
+        index = get_icd11_index(index_path)
+        results = {
+            term: {"term": term, "candidates": index.search(term, threshold=0.3)} for term in dict.fromkeys(terms)
         }
-        base_url = "https://icdaccessmanagement.who.int/"
-        with httpx.Client(verify=True, base_url=base_url) as client:
-            response = client.post("connect/token", data=payload)
-            response.raise_for_status()
-            response_data = response.json()
-            token = response_data.get("access_token")
-            expires_in = response_data.get("expires_in", 3600)  # Default to 1 hour if not provided
 
-            # Cache the token and its expiry time
-            self._token_cache["token"] = token
-            self._token_cache["expires_at"] = time.time() + expires_in
+        return [results[term] for term in terms]
+
+    @staticmethod
+    def _search_headers(token: str) -> dict[str, str]:
+        return {
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/json",
+            "Accept-Language": "en",
+            "API-Version": "v2",
+        }
+
+    @staticmethod
+    def _parse_search(term: str, response: httpx.Response) -> dict:
+        """
+        Parse the candidates of an ICD-11 search response.
+
+        Args:
+            term: The term that was searched for.
+            response: The response of the search endpoint.
+
+        Returns:
+            A dictionary containing the term and its candidates.
+        """
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            print("💥 Token request failed:")
+            print("Status:", e.response.status_code)
+            print("Response:", e.response.text)
+            raise
+        data = response.json()
+        candidates = [
+            {
+                "code": candidate.get("theCode"),
+                "score": candidate.get("score"),
+                "title": candidate.get("title"),
+            }
+            for candidate in data.get("destinationEntities", [])
+        ]
+        # filter for score  > 0.3 # TODO: maybe make this a parameter
+        candidates = [c for c in candidates if c["score"] > 0.3]
+        # sort by score descending
+        candidates.sort(key=lambda x: x["score"], reverse=True)
 
-            return token  # type: ignore[no-any-return]
+        return {
+            "term": term,
+            "candidates": candidates,
+        }
 
     def forward(self, terms: list[str]) -> list[dict]:
         """
@@ -113,46 +306,17 @@ class ICDDiagnosisTool(ToolSettingMixin, Tool):
             >>> terms = ["Myocardial Infarction", "colon cancer"]
             >>> lookup_icd11(terms)
         """
-        token = self.get_token()
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Accept": "application/json",
-            "Accept-Language": "en",
-            "API-Version": "v2",
-        }
-        base_url = "https://id.who.int/"
-        with httpx.Client(verify=True, base_url=base_url) as client:
-            results = []
-            for term in terms:
-                params = {"q": term, "useFlexisearch": "true"}
-
-                response = client.get("icd/release/11/2022-02/mms/search", headers=headers, params=params)
-                try:
-                    response.raise_for_status()
-                except httpx.HTTPStatusError as e:
-                    print("💥 Token request failed:")
-                    print("Status:", e.response.status_code)
-                    print("Response:", e.response.text)
-                    raise
-                data = response.json()
-                candidates = [
-                    {
-                        "code": candidate.get("theCode"),
-                        "score": candidate.get("score"),
-                        "title": candidate.get("title"),
-                    }
-                    for candidate in data.get("destinationEntities", [])
-                ]
-                # filter for score  > 0.3 # TODO: maybe make this a parameter
-                candidates = [c for c in candidates if c["score"] > 0.3]
-                # sort by score descending
-                candidates.sort(key=lambda x: x["score"], reverse=True)
-
-                results.append(
-                    {
-                        "term": term,
-                        "candidates": candidates,
-                    }
-                )
-
-        return results
+        if self.icd_index_path:
+            return self._search_local(self.icd_index_path, terms)
+
+        headers = self._search_headers(self.get_token())
+        client = get_client(ICD_API_URL)
+
+        def search(term: str) -> dict:
+            params = {"q": term, "useFlexisearch": "true"}
+
+            response = client.get(self._search_path, headers=headers, params=params)
+            return self._parse_search(term, response)
+
+        results = fetch_unique(search, terms)
+        return [results[term] for term in terms]
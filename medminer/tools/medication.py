@@ -2,11 +2,203 @@
 This module contains various tools for extracting and processing medical data.
 """
 
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from threading import Lock
+from typing import Any, Iterable
 
 import httpx
 from smolagents import tool
 
+from medminer.utils.cache import get_response_cache
+from medminer.utils.http import fetch_unique, get_client
+from medminer.utils.rxnorm import get_rxnorm_store
+
+RXNAV_BASE_URL = "https://rxnav.nlm.nih.gov/REST/"
+APPROXIMATE_TERM_PATH = "approximateTerm.json"
+RXCLASS_PATH = "rxclass/class/byRxcui.json"
+
+# the classification systems of rxclass and the (lower case) field of a drug info that identifies them
+RXCLASS_SYSTEMS = {
+    "atc": ("relaSource", "atc"),
+    "va": ("relaSource", "va"),
+    "epc": ("classType", "epc"),
+    "meshpa": ("classType", "meshpa"),
+}
+RXCLASS_MEMO_SIZE = 4096
+
+_rxclass_memo: OrderedDict[str, dict[str, dict]] = OrderedDict()
+_rxclass_lock = Lock()
+
+
+def _local_get(endpoint: str, params: dict[str, str]) -> Any | None:
+    """
+    Answer a RxNav request from the local RxNorm store, if one is configured (see `get_rxnorm_store`).
+
+    Args:
+        endpoint: The endpoint relative to the base url.
+        params: The query parameters.
+
+    Returns:
+        The json response, or None if the request has to go to RxNav.
+    """
+    if (store := get_rxnorm_store()) is None:
+        return None
+
+    if endpoint == APPROXIMATE_TERM_PATH:
+        return store.approximate_term(params["term"])
+    if endpoint == RXCLASS_PATH:
+        return store.rxclass_by_rxcui(params["rxcui"])
+
+    return None
+
+
+def _rxnav_fetch(client: httpx.Client, endpoint: str, params: dict[str, str]) -> tuple[Any, bool]:
+    """
+    Get a RxNav response from the local RxNorm store, the persistent cache or the API.
+
+    Args:
+        client: The client of the RxNav API.
+        endpoint: The endpoint relative to the base url.
+        params: The query parameters.
+
+    Returns:
+        The json response, and whether it is a valid answer that can be reused,
+        i.e. it is not the error response of a failed request.
+    """
+    if (payload := _local_get(endpoint, params)) is not None:
+        return payload, True
+
+    cache = get_response_cache("rxnav")
+    if (payload := cache.get(endpoint, params)) is not None:
+        return payload, True
+
+    response = client.get(endpoint, params=params)
+    payload = response.json()
+    if response.is_success:
+        cache.set(endpoint, params, payload)
+
+    return payload, response.is_success
+
+
+def _rxnav_get(client: httpx.Client, endpoint: str, params: dict[str, str]) -> Any:
+    """
+    Get a RxNav response from the local RxNorm store, the persistent cache or the API.
+
+    Args:
+        client: The client of the RxNav API.
+        endpoint: The endpoint relative to the base url.
+        params: The query parameters.
+
+    Returns:
+        The json response.
+    """
+    return _rxnav_fetch(client, endpoint, params)[0]
+
+
+def _parse_rxcui_candidates(payload: dict) -> dict[str, list[str]]:
+    """
+    Collect the best ranked rxcuis and their sources from an approximateTerm response.
+
+    Args:
+        payload: The json response of the approximateTerm endpoint.
+
+    Returns:
+        A dictionary mapping the rxcuis to their supporting sources.
+    """
+    rxcuis = defaultdict(list)
+
+    for cand in payload.get("approximateGroup", {}).get("candidate", []):
+        if cand["rank"] != "1":
+            continue
+
+        rxcuis[cand["rxcui"]].append(cand["source"])
+
+    return dict(rxcuis)
+
+
+def _parse_rxclass(payload: dict) -> dict[str, dict]:
+    """
+    Get the first class concept of every classification system from a byRxcui response.
+
+    Args:
+        payload: The json response of the rxclass byRxcui endpoint.
+
+    Returns:
+        A dictionary mapping the classification systems (see `RXCLASS_SYSTEMS`) to their class concept.
+    """
+    classes: dict[str, dict] = {}
+
+    for cand in payload.get("rxclassDrugInfoList", {}).get("rxclassDrugInfo", []):
+        concept = cand.get("rxclassMinConceptItem", {})
+        for system, (field, name) in RXCLASS_SYSTEMS.items():
+            value = cand.get(field) if field == "relaSource" else concept.get(field)
+            if system not in classes and name in (value or "").lower():
+                classes[system] = concept
+
+    return classes
+
+
+def _resolve_rxclass(client: httpx.Client, rxcui: str) -> dict[str, dict]:
+    """
+    Get the class concepts of a rxcui, memoized per rxcui.
+
+    Only valid answers are memoized, the classes of a failed request are fetched again by the next call.
+
+    Args:
+        client: The client of the RxNav API.
+        rxcui: The rxcui.
+
+    Returns:
+        A dictionary mapping the classification systems to their class concept.
+    """
+    with _rxclass_lock:
+        if (classes := _rxclass_memo.get(rxcui)) is not None:
+            _rxclass_memo.move_to_end(rxcui)
+            return classes
+
+    payload, valid = _rxnav_fetch(client, RXCLASS_PATH, {"rxcui": rxcui})
+    classes = _parse_rxclass(payload)
+    if valid:
+        _memoize_rxclass(rxcui, classes)
+
+    return classes
+
+
+def _memoize_rxclass(rxcui: str, classes: dict[str, dict]) -> None:
+    with _rxclass_lock:
+        _rxclass_memo[rxcui] = classes
+        while len(_rxclass_memo) > RXCLASS_MEMO_SIZE:
+            _rxclass_memo.popitem(last=False)
+
+
+def _class_from_concept(concept: dict) -> dict:
+    return {
+        "class_id": concept.get("classId"),
+        "class_name": concept.get("className"),
+        "class_type": concept.get("classType"),
+    }
+
+
+def _atc_from_concept(concept: dict) -> dict:
+    if not concept:
+        return {}
+
+    return {
+        "atc_id": concept.get("classId"),
+        "atc_name": concept.get("className"),
+        "atc_type": concept.get("classType"),
+    }
+
+
+def _va_from_concept(concept: dict) -> dict:
+    if not concept:
+        return {}
+
+    return {
+        "va_id": concept.get("classId"),
+        "va_name": concept.get("className"),
+    }
+
 
 @tool
 def extract_medication_data(
@@ -61,31 +253,46 @@ def get_rxcui(medication_names: list[str]) -> dict:
     Returns:
         A dictionary containing the medication information (e.g. rxcui and supporting sources).
     """
-    data: dict[str, dict] = {}
+    client = get_client(RXNAV_BASE_URL)
 
-    base_url = "https://rxnav.nlm.nih.gov/REST/"
-    with httpx.Client(base_url=base_url) as client:
-        for medication_name in medication_names:
-            params = {
-                "term": medication_name,
-            }
+    def fetch(medication_name: str) -> dict:
+        params = {
+            "term": medication_name,
+        }
+        return _parse_rxcui_candidates(_rxnav_get(client, APPROXIMATE_TERM_PATH, params))
 
-            rxcuis = defaultdict(list)
+    return fetch_unique(fetch, medication_names)
 
-            for cand in (
-                client.get("approximateTerm.json", params=params)
-                .json()
-                .get("approximateGroup", {})
-                .get("candidate", [])
-            ):
-                if cand["rank"] != "1":
-                    continue
 
-                rxcuis[cand["rxcui"]].append(cand["source"])
+@tool
+def get_rxclass(
+    rxcuis: list[str],
+) -> dict:
+    """
+    Get the drug classes of a given list of rxcuis in all classification systems (ATC, VA, EPC and MeSH PA).
 
-            data[medication_name] = dict(rxcuis)
+    Example:
+        >>> get_rxclass(["1191"])
+        {
+            "1191": {
+                "atc": {"class_id": "B01AC", "class_name": "Platelet aggregation inhibitors", ...},
+                "va": {"class_id": "CN103", "class_name": "NON-OPIOID ANALGESICS", "class_type": "VA"},
+                ...
+            },
+        }
 
-    return data
+    Args:
+        rxcuis: A list of corrected rxcuis.
+
+    Returns:
+        A dictionary containing the classes of every rxcui by classification system.
+    """
+    client = get_client(RXNAV_BASE_URL)
+
+    def fetch(rxcui: str) -> dict:
+        return {system: _class_from_concept(concept) for system, concept in _resolve_rxclass(client, rxcui).items()}
+
+    return fetch_unique(fetch, rxcuis)
 
 
 @tool
@@ -101,45 +308,9 @@ def get_atc(
     Returns:
         A dictionary containing the medication information (e.g. ATC Code).
     """
-    data: dict[str, dict[str, str]] = {}
-
-    base_url = "https://rxnav.nlm.nih.gov/REST/"
-    with httpx.Client(base_url=base_url) as client:
-        for rxcui in rxcuis:
-            params = {
-                "rxcui": rxcui,
-            }
-            atc = next(
-                (
-                    cand
-                    for cand in (
-                        client.get("rxclass/class/byRxcui.json", params=params)
-                        .json()
-                        .get("rxclassDrugInfoList", {})
-                        .get("rxclassDrugInfo", [])
-                    )
-                    if "atc" in cand["relaSource"].lower()
-                ),
-                None,
-            )
-
-            if not atc:
-                data[rxcui] = {}
-                continue
-
-            concept = atc.get("rxclassMinConceptItem", {})
-
-            if not concept:
-                data[rxcui] = {}
-                continue
-
-            data[rxcui] = {
-                "atc_id": concept.get("classId"),
-                "atc_name": concept.get("className"),
-                "atc_type": concept.get("classType"),
-            }
+    client = get_client(RXNAV_BASE_URL)
 
-    return data
+    return fetch_unique(lambda rxcui: _atc_from_concept(_resolve_rxclass(client, rxcui).get("atc", {})), rxcuis)
 
 
 @tool
@@ -155,41 +326,35 @@ def get_va(
     Returns:
         A dictionary containing the medication information (e.g. VA Code).
     """
-    data: dict[str, dict[str, str]] = {}
-
-    base_url = "https://rxnav.nlm.nih.gov/REST/"
-    with httpx.Client(base_url=base_url) as client:
-        for rxcui in rxcuis:
-            params = {
-                "rxcui": rxcui,
-            }
-            atc = next(
-                (
-                    cand
-                    for cand in (
-                        client.get("rxclass/class/byRxcui.json", params=params)
-                        .json()
-                        .get("rxclassDrugInfoList", {})
-                        .get("rxclassDrugInfo", [])
-                    )
-                    if "va" in cand["relaSource"].lower()
-                ),
-                None,
-            )
-
-            if not atc:
-                data[rxcui] = {}
-                continue
-
-            concept = atc.get("rxclassMinConceptItem", {})
-
-            if not concept:
-                data[rxcui] = {}
-                continue
-
-            data[rxcui] = {
-                "va_id": concept.get("classId"),
-                "va_name": concept.get("className"),
-            }
+    client = get_client(RXNAV_BASE_URL)
 
-    return data
+    return fetch_unique(lambda rxcui: _va_from_concept(_resolve_rxclass(client, rxcui).get("va", {})), rxcuis)
+
+
+def warm_rxnav_cache(medication_names: Iterable[str]) -> dict[str, int]:
+    """
+    Pre-warm the RxNav cache with the rxcuis and classes of known medication names.
+
+    Example:
+        >>> warm_rxnav_cache(["Aspirin", "Paracetamol"])
+        {"hits": 0, "misses": 4, "entries": 4}
+
+    Args:
+        medication_names: The (corrected) medication names, e.g. of a previous run.
+
+    Returns:
+        The statistics of the cache.
+    """
+    client = get_client(RXNAV_BASE_URL)
+    candidates = fetch_unique(
+        lambda medication_name: _parse_rxcui_candidates(
+            _rxnav_get(client, APPROXIMATE_TERM_PATH, {"term": medication_name})
+        ),
+        medication_names,
+    )
+    fetch_unique(
+        lambda rxcui: _resolve_rxclass(client, rxcui),
+        (rxcui for rxcuis in candidates.values() for rxcui in rxcuis),
+    )
+
+    return get_response_cache("rxnav").stats
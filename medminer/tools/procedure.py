@@ -3,13 +3,22 @@ This module contains various tools for extracting and processing medical data.
 """
 from __future__ import annotations
 
-from itertools import combinations
-from typing import Iterator
+from itertools import combinations, islice
+from typing import Iterable, Iterator
 
-import httpx
 from smolagents import Tool, tool
 
 from medminer.tools.settings import ToolSetting, ToolSettingMixin
+from medminer.utils.http import fetch_unique, get_client, in_worker
+from medminer.utils.snomed import get_snomed_index
+
+PROCEDURE_ECL = "< 71388002|Procedure|"
+MAX_ECL_QUERIES = 8
+MAX_TERM_FILTERS = 10
+MAX_ECL_LENGTH = 2000
+DEFAULT_PARALLEL_QUERIES = 4
+
+TermFilter = tuple[str, ...]
 
 
 @tool
@@ -61,50 +70,134 @@ class SNOMEDTool(ToolSettingMixin, Tool):
     }
     output_type = "array"
     settings = [
-        ToolSetting(id="snowstorm_base_url", label="Base URL", type=str),
-        ToolSetting(id="snowstorm_edition", label="Edition", type=str),
+        ToolSetting(id="snowstorm_base_url", label="Base URL", type=str, required=False),
+        ToolSetting(id="snowstorm_edition", label="Edition", type=str, required=False),
+        ToolSetting(
+            id="snowstorm_parallel_queries", label="Parallel ECL queries (default 4)", type=int, required=False
+        ),
+        ToolSetting(id="snomed_rf2_path", label="SNOMED CT RF2 Snapshot (local)", type=str, required=False),
     ]
-    snowstorm_base_url: str
-    snowstorm_edition: str
+    snowstorm_base_url: str | None
+    snowstorm_edition: str | None
+    snowstorm_parallel_queries: int | None
+    snomed_rf2_path: str | None
 
-    def _build_ecl_queries(
+    def _build_term_filters(
         self,
         term: str,
         synonyms: dict[str, str],
         keywords: list[str],
-    ) -> Iterator[str]:
+    ) -> Iterator[list[TermFilter]]:
         """
-        Build the ECL query for SNOMED CT.
+        Build the term filters of the search cascade, from the most to the least specific.
+
+        A query is a list of term filters that must all match the same description,
+        a term filter is a tuple of alternative terms of which one must match.
+        The word combinations of a level are limited to the first `MAX_TERM_FILTERS`, other queries with more
+        filters are skipped and at most `MAX_ECL_QUERIES` are built.
 
         Args:
             term: The search term to query.
             synonyms: A dictionary of synonyms for the words in the search term.
             keywords: A list of keywords to search for.
 
+        Returns:
+            The term filters of the queries.
+        """
+        words = term.split(" ")
+
+        def cascade() -> Iterator[list[TermFilter]]:
+            yield [(term,)]
+
+            if synonyms:
+                yield [(word, synonyms[word]) if word in synonyms else (word,) for word in words]
+
+            if len(words) > 2:
+                for i in reversed(range(1, len(words) - 1)):
+                    # the number of combinations grows combinatorially, so each level keeps only the first ones
+                    word_combs = islice(combinations(words, i + 1), MAX_TERM_FILTERS)
+                    # TODO: Add synonyms to this
+                    yield [(" ".join(word_comp),) for word_comp in word_combs]
+
+            yield [tuple(words)]
+            yield [tuple(words + keywords)]
+
+        queries = (filters for filters in cascade() if len(filters) <= MAX_TERM_FILTERS)
+        return islice(queries, MAX_ECL_QUERIES)
+
+    @staticmethod
+    def _render_ecl(filters: list[TermFilter]) -> str:
+        """
+        Render the term filters of a query as ECL.
+
+        Args:
+            filters: The term filters of the query.
+
         Returns:
             The ECL query string.
         """
 
-        procedure_definition = "< 71388002|Procedure|"
+        def render(term_filter: TermFilter) -> str:
+            terms = [term.replace('"', "") for term in term_filter]
+            if len(terms) == 1:
+                return f'term = "{terms[0]}"'
 
-        yield f'{procedure_definition} {{{{ term = "{term}"}}}}'
+            return f"term = ({' '.join(f'"{term}"' for term in terms)})"
 
-        words = term.split(" ")
-        if synonyms:
-            syn_terms = [
-                f'term = ("{word}" "{synonyms[word]}")' if word in synonyms else f'term = "{word}"' for word in words
-            ]
-            yield f'{procedure_definition} {{{{ {', '.join(syn_terms)} }}}}'
-
-        if len(words) > 2:
-            for i in reversed(range(1, len(words) - 1)):
-                word_comps = [
-                    f'term = ("{" ".join(word_comp)}")' for word_comp in combinations(words, i + 1)
-                ]  # TODO: Add synonyms to this
-                yield f'{procedure_definition} {{{{ {", ".join(word_comps)} }}}}'
-
-        yield f'{procedure_definition} {{{{ term = ("{'" "'.join(words)}")}}}}'
-        yield f'{procedure_definition} {{{{ term = ("{'" "'.join(words + keywords)}")}}}}'
+        return f"{PROCEDURE_ECL} {{{{ {', '.join(render(term_filter) for term_filter in filters)} }}}}"
+
+    def _build_ecl_queries(
+        self,
+        term: str,
+        synonyms: dict[str, str],
+        keywords: list[str],
+    ) -> list[str]:
+        """
+        Build the ECL queries of the search cascade for SNOMED CT.
+
+        Args:
+            term: The search term to query.
+            synonyms: A dictionary of synonyms for the words in the search term.
+            keywords: A list of keywords to search for.
+
+        Returns:
+            The ECL query strings, without queries longer than `MAX_ECL_LENGTH`.
+        """
+        queries = (self._render_ecl(filters) for filters in self._build_term_filters(term, synonyms, keywords))
+        return list(dict.fromkeys(query for query in queries if len(query) <= MAX_ECL_LENGTH))
+
+    @property
+    def _snowstorm_base_url(self) -> str:
+        if not self.snowstorm_base_url or not self.snowstorm_edition:
+            raise ValueError("The Snowstorm Base URL and Edition are required without a local SNOMED CT snapshot.")
+
+        return self.snowstorm_base_url
+
+    def _search_local(self, rf2_path: str, term: str, synonyms: dict[str, str], keywords: list[str]) -> list[dict]:
+        """
+        Search the procedures matching the given term in the local SNOMED CT snapshot.
+
+        The term filters of the cascade are evaluated in-process, so there is no need to run them concurrently.
+
+        Args:
+            rf2_path: The path of the RF2 snapshot (see `get_snomed_index`).
+            term: The search term to query.
+            synonyms: A dictionary of synonyms for the words in the search term.
+            keywords: A list of keywords to search for.
+
+        Returns:
+            list of dictionaries containing procedure details.
+        """
+        index = get_snomed_index(rf2_path)
+        for filters in self._build_term_filters(term, synonyms, keywords):
+            if items := index.search(filters):
+                return self._filter_matches(items)
+
+        return []
+
+    @property
+    def _parallel_queries(self) -> int:
+        return max(self.snowstorm_parallel_queries or DEFAULT_PARALLEL_QUERIES, 1)
 
     def forward(
         self,
@@ -115,6 +208,10 @@ class SNOMEDTool(ToolSettingMixin, Tool):
         """
         Search SNOMED CT for procedures matching the given term.
 
+        The queries of the cascade are sent in rounds of `snowstorm_parallel_queries` concurrent requests,
+        and the result of the first query (in cascade order) with items is returned. Within a batch search,
+        the queries are sent one at a time.
+
         Args:
             term: The search term to query.
             synonyms: A dictionary of synonyms for the words in the search term.
@@ -123,34 +220,127 @@ class SNOMEDTool(ToolSettingMixin, Tool):
         Returns:
             list of dictionaries containing procedure details.
         """
-        limit = 100
-        params = {
+        if self.snomed_rf2_path:
+            return self._search_local(self.snomed_rf2_path, term, synonyms, keywords)
+
+        client = get_client(self._snowstorm_base_url)
+
+        def search(query: str) -> list[dict] | Exception:
+            try:
+                response = client.get(f"{self.snowstorm_edition}/concepts", params=self._search_params(query))
+                response.raise_for_status()
+                return response.json().get("items", [])  # type: ignore[no-any-return]
+            except Exception as e:
+                # a failing query only matters if no query before it has items
+                return e
+
+        queries = self._build_ecl_queries(term, synonyms, keywords)
+        # nested in a batch the queries run sequentially anyway, so the cascade stops at the first query with items
+        parallel_queries = 1 if in_worker() else self._parallel_queries
+        for i in range(0, len(queries), parallel_queries):
+            results = fetch_unique(search, queries[i : i + parallel_queries])
+            if items := self._first_items(results.values()):
+                return self._filter_matches(items)
+
+        return []
+
+    @staticmethod
+    def _first_items(results: Iterable[list[dict] | BaseException]) -> list[dict]:
+        """
+        Get the items of the first query with items.
+
+        Args:
+            results: The items or errors of the queries, in cascade order.
+
+        Returns:
+            The items, or an empty list if no query has items.
+
+        Raises:
+            Exception: The error of a failed query before the first query with items.
+        """
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+            if result:
+                return result
+
+        return []
+
+    @staticmethod
+    def _search_params(ecl: str) -> dict[str, str]:
+        return {
             "activeFilter": "true",  # Recommended filter by SNOMED CT
             "termActive": "true",  # Recommended filter by SNOMED CT
-            "ecl": f'< 71388002|Procedure| {{{{ term = "{term}"}}}}',
+            "ecl": ecl,
         }
-        with httpx.Client(base_url=self.snowstorm_base_url) as client:
-            for query in self._build_ecl_queries(term, synonyms, keywords):
-                params["ecl"] = query
-                response = client.get(f"{self.snowstorm_edition}/concepts", params=params)
-                response.raise_for_status()
-                items = response.json().get("items", [])
-
-                if items:
-                    break
-
-            filtered_matches = [
-                {
-                    "id": match["conceptId"],
-                    # "term": match["pt"]["term"],
-                    "fsn": match["fsn"]["term"],
-                }
-                for match in items
-                if match["definitionStatus"] in ["FULLY_DEFINED", "PRIMITIVE"]
-            ]
-            filtered_matches = sorted(
-                filtered_matches,
-                key=lambda x: len(x["fsn"]),
-            )
-
-            return filtered_matches[:limit]
+
+    @staticmethod
+    def _filter_matches(items: list[dict], limit: int = 100) -> list[dict]:
+        """
+        Keep the defined concepts of a search result, shortest FSN first.
+
+        Args:
+            items: The concepts returned by Snowstorm.
+            limit: The maximum number of concepts to return.
+
+        Returns:
+            list of dictionaries containing procedure details.
+        """
+        filtered_matches = [
+            {
+                "id": match["conceptId"],
+                # "term": match["pt"]["term"],
+                "fsn": match["fsn"]["term"],
+            }
+            for match in items
+            if match["definitionStatus"] in ["FULLY_DEFINED", "PRIMITIVE"]
+        ]
+        filtered_matches = sorted(
+            filtered_matches,
+            key=lambda x: len(x["fsn"]),
+        )
+
+        return filtered_matches[:limit]
+
+
+class SNOMEDBatchTool(SNOMEDTool):
+    """A tool for searching SNOMED CT concepts for many terms in one call."""
+
+    name = "search_snomed_procedures_batch"
+    description = "Search SNOMED CT for procedures matching each of the given search terms in one call."
+    inputs = {
+        "items": {
+            "type": "array",
+            "items": {"type": "object"},
+            "description": (
+                "A list of searches, one per procedure. Each search is a dictionary with the keys "
+                "'term' (the search term, written out text), "
+                "'synonyms' (a dictionary of synonyms for the words in the search term. e.g. {'Cranial': 'Head'}) and "
+                "'keywords' (a list of keywords to search for in addition to the search term e.g. ['CT', 'MRI'])."
+            ),
+        },
+    }
+    output_type = "object"
+
+    def forward(self, items: list[dict]) -> dict:  # type: ignore[override]
+        """
+        Search SNOMED CT for procedures matching each of the given search terms.
+
+        The terms are deduplicated and resolved concurrently.
+
+        Args:
+            items: A list of dictionaries with the search `term`, its `synonyms` and `keywords`.
+
+        Returns:
+            A dictionary mapping each search term to the list of matching procedure details.
+        """
+        searches: dict[str, dict] = {}
+        for item in items:
+            searches.setdefault(item["term"], item)
+
+        def search(term: str) -> list[dict]:
+            item = searches[term]
+            return super(SNOMEDBatchTool, self).forward(term, item.get("synonyms") or {}, item.get("keywords") or [])
+
+        return fetch_unique(search, [item["term"] for item in items])
@@ -18,6 +18,7 @@ class ToolSetting:
     label: str
     type: Type
     ui: ToolUISetting = field(default_factory=ToolUISetting)
+    required: bool = True
 
 
 class ToolSettingMixin:
@@ -30,7 +31,11 @@ class ToolSettingMixin:
 
         for setting in self.settings:
             if (value := kwargs.get(setting.id)) is None:
-                raise ValueError(f"Missing required setting: {setting.id}")
+                if setting.required:
+                    raise ValueError(f"Missing required setting: {setting.id}")
+
+                setattr(self, setting.id, None)
+                continue
 
             if not isinstance(value, setting.type):
                 raise TypeError(f"Expected {setting.type} for setting {setting.id}, got {type(value)}")
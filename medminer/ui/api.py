@@ -3,15 +3,23 @@ Callback API for Gradio UI.
 """
 
 
+import asyncio
+import os
 from enum import IntEnum
-from typing import Type
+from typing import Iterable, Type
 
 import gradio as gr
 import pandas as pd
 
-from medminer.pipe import MultiAgentPipeline, Pipeline, SingleAgentPipeline
+from medminer.pipe import AsyncPipeline, MultiAgentPipeline, Pipeline
 from medminer.task.base import TaskRegistry
 from medminer.utils.models import DefaultModel
+from medminer.utils.sql import iter_sql_documents
+
+
+def _max_workers() -> int:
+    # the number of documents of a request processed at the same time
+    return max(int(os.getenv("MEDMINER_MAX_WORKERS", "") or 4), 1)
 
 
 class AgentMode(IntEnum):
@@ -19,39 +27,79 @@ class AgentMode(IntEnum):
     MULTI = 1
 
 
-def _process(
-    data: list[str], model_settings: dict[str, str], task_settings: dict[str, str], tasks: list[str], agent: str
-) -> dict[str, pd.DataFrame]:
-    """Process the data with the specified tasks.
+def _build_pipeline(
+    model_settings: dict[str, str],
+    task_settings: dict[str, str],
+    tasks: list[str],
+    agent: str,
+    fan_out: bool = False,
+) -> Pipeline:
+    """Build the pipeline of a request.
+
+    Loading the model and building the agents of the tasks blocks, so it runs in a worker thread.
 
     Args:
-        data: List of data to process.
         model_settings: Model settings for the processing.
         task_settings: Task settings for the processing.
         tasks: List of tasks to perform on the files.
         agent: Agent mode (single or multi).
+        fan_out: Run all tasks on a document at the same time.
 
     Returns:
-        Dictionary containing the processed data.
+        The pipeline.
     """
-    if not data or not tasks:
-        return {}
-
     reg = TaskRegistry()
 
-    pipe_cls: Type[Pipeline] = SingleAgentPipeline if agent == AgentMode.SINGLE else MultiAgentPipeline
-    pipe = pipe_cls(
+    pipe_cls: Type[Pipeline] = AsyncPipeline if agent == AgentMode.SINGLE else MultiAgentPipeline
+    return pipe_cls(
         tasks=reg.filter(tasks),
         model=DefaultModel(**model_settings).model,
+        max_workers=_max_workers(),
+        fan_out=fan_out,
         **task_settings,
     )
 
-    dfs = pipe.run(data)
+
+def _read_files(files: list) -> list[str]:
+    data: list[str] = []
+    for file in files:
+        with open(file, "r") as f:
+            data.append(f.read())
+
+    return data
+
+
+async def _process(
+    data: Iterable[str],
+    model_settings: dict[str, str],
+    task_settings: dict[str, str],
+    tasks: list[str],
+    agent: str,
+    fan_out: bool = False,
+) -> dict[str, pd.DataFrame]:
+    """Process the data with the specified tasks.
+
+    Args:
+        data: Data to process, consumed as the pipeline goes.
+        model_settings: Model settings for the processing.
+        task_settings: Task settings for the processing.
+        tasks: List of tasks to perform on the files.
+        agent: Agent mode (single or multi).
+        fan_out: Run all tasks on a document at the same time.
+
+    Returns:
+        Dictionary containing the processed data.
+    """
+    if not data or not tasks:
+        return {}
+
+    pipe = await asyncio.to_thread(_build_pipeline, model_settings, task_settings, tasks, agent, fan_out)
+    dfs = await pipe.arun(data)
 
     return {task_name.capitalize(): df for task_name, df in dfs.items()}
 
 
-def process_txt_files(
+async def process_txt_files(
     request: gr.Request,
     files: list | None,
     model_settings: dict[str, str],
@@ -75,12 +123,9 @@ def process_txt_files(
     if files is None or not tasks:
         return {}
 
-    data: list[str] = []
-    for file in files:
-        with open(file, "r") as f:
-            data.append(f.read())
+    data = await asyncio.to_thread(_read_files, files)
 
-    return _process(
+    return await _process(
         data=data,
         model_settings=model_settings,
         task_settings=task_settings | {"session_id": str(request.session_hash)},
@@ -89,7 +134,7 @@ def process_txt_files(
     )
 
 
-def process_csv_file(
+async def process_csv_file(
     request: gr.Request,
     file: str | None,
     column: str | None,
@@ -115,10 +160,10 @@ def process_csv_file(
     if file is None or not column or not tasks:
         return {}
 
-    df = pd.read_csv(file)
+    df = await asyncio.to_thread(pd.read_csv, file)
     data: list[str] = df[column].tolist()
 
-    return _process(
+    return await _process(
         data=data,
         model_settings=model_settings,
         task_settings=task_settings | {"session_id": str(request.session_hash)},
@@ -127,19 +172,27 @@ def process_csv_file(
     )
 
 
-def process_sql(
+async def process_sql(
     request: gr.Request,
+    connection: str,
     sql: str,
+    id_column: str,
+    text_column: str,
     model_settings: dict[str, str],
     task_settings: dict[str, str],
     tasks: list[str],
     agent: str,
 ) -> dict[str, pd.DataFrame]:
-    """Process a SQL query with the specified tasks.
+    """Process the documents of a SQL query with the specified tasks.
+
+    The documents are streamed from the database in chunks while the pipeline runs.
 
     Args:
         request: Gradio request object.
-        sql: SQL query to process.
+        connection: URL of the database.
+        sql: SQL query returning the documents.
+        id_column: Name of the column with the patient ID.
+        text_column: Name of the column with the text.
         model_settings: Model settings for the processing.
         task_settings: Task settings for the processing.
         tasks: List of tasks to perform on the files.
@@ -148,15 +201,21 @@ def process_sql(
     Returns:
         Dictionary containing the processed data.
     """
-    if not sql or not tasks:
+    if not connection or not sql or not id_column or not text_column or not tasks:
         return {}
 
-    print(sql, model_settings, task_settings, tasks, agent)
+    documents = iter_sql_documents(connection, sql, id_column=id_column, text_column=text_column)
 
-    return {}
+    return await _process(
+        data=(document.content for document in documents),
+        model_settings=model_settings,
+        task_settings=task_settings | {"session_id": str(request.session_hash)},
+        tasks=tasks,
+        agent=agent,
+    )
 
 
-def process_text(
+async def process_text(
     request: gr.Request,
     text: str,
     model_settings: dict[str, str],
@@ -180,10 +239,12 @@ def process_text(
     if not text or not tasks:
         return {}
 
-    return _process(
+    return await _process(
         data=[text],
         model_settings=model_settings,
         task_settings=task_settings | {"session_id": str(request.session_hash)},
         tasks=tasks,
         agent=agent,
+        # a single document is done as soon as its slowest task is done
+        fan_out=True,
     )
@@ -44,6 +44,10 @@ with gr.Blocks(
 
         return os.getenv(name.upper(), "")
 
+    def set_init_number(name: str) -> int | None:
+        value = set_init_state(name)
+        return int(value) if value else None
+
     title = gr.Markdown(
         """
         # MedMiner
@@ -102,9 +106,18 @@ with gr.Blocks(
                         if setting.ui.dependent and not any(task in setting.ui.dependent for task in tasks):
                             continue
 
-                        _field = gr.Textbox(
-                            label=setting.label, **setting.ui.params, value=partial(set_init_state, setting.id)
-                        )
+                        _field: gr.Textbox | gr.Number
+                        if setting.type is int:
+                            _field = gr.Number(
+                                label=setting.label,
+                                precision=0,
+                                **setting.ui.params,
+                                value=partial(set_init_number, setting.id),
+                            )
+                        else:
+                            _field = gr.Textbox(
+                                label=setting.label, **setting.ui.params, value=partial(set_init_state, setting.id)
+                            )
                         gr.on(
                             [demo.load, tasks_input.change],
                             set_state,
@@ -134,7 +147,13 @@ with gr.Blocks(
 
                 with gr.Tab("SQL"):
                     gr.Markdown("Enter a SQL query to extract information from a database.")
+                    sql_connection_input = gr.Textbox(
+                        label="Database URL", placeholder="sqlite:///notes.sqlite or postgresql://user@host/db"
+                    )
                     sql_input = gr.Textbox(label="SQL Query", placeholder="SELECT patient_id, text FROM patient_notes")
+                    with gr.Row():
+                        sql_id_column_input = gr.Textbox(label="ID column", value="patient_id")
+                        sql_text_column_input = gr.Textbox(label="Text column", value="text")
                     process_sql_btn = gr.Button("Process SQL")
 
                 with gr.Tab("Text"):
@@ -166,7 +185,16 @@ with gr.Blocks(
         )
         process_sql_btn.click(
             process_sql,
-            inputs=[sql_input, model_settings, task_settings, tasks_state, agent_input],
+            inputs=[
+                sql_connection_input,
+                sql_input,
+                sql_id_column_input,
+                sql_text_column_input,
+                model_settings,
+                task_settings,
+                tasks_state,
+                agent_input,
+            ],
             outputs=[data_state],
         )
         process_text_btn.click(
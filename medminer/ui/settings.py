@@ -43,6 +43,14 @@ MODEL_TABS: list[ModelTabConfig] = [
             },
             {"params": {"label": "API Version", "placeholder": "2024-12-01-preview"}, "id": "oai_api_version"},
             {"params": {"label": "API Key", "placeholder": "<api-key>", "type": "password"}, "id": "oai_api_key"},
+            {
+                "params": {"label": "Requests per minute (optional)", "placeholder": "250"},
+                "id": "oai_requests_per_minute",
+            },
+            {
+                "params": {"label": "Tokens per minute (optional)", "placeholder": "250000"},
+                "id": "oai_tokens_per_minute",
+            },
         ],
     },
 ]
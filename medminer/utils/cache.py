@@ -0,0 +1,171 @@
+"""
+This module contains the persistent cache for the responses of external APIs.
+"""
+
+import json
+import os
+import threading
+import time
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+from medminer.utils.sqlite import ThreadLocalConnection
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "medminer"
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_MAX_ENTRIES = 100_000
+
+
+class ResponseCache:
+    """Persistent cache of json responses keyed by endpoint and parameters.
+
+    The cache is a SQLite database in WAL mode, so it can be shared by the threads and processes of a run
+    (e.g. the shards of a `ShardedPipeline`) and survives between runs.
+    Entries expire after `ttl` seconds, and the oldest entries are evicted once there are more than `max_entries`.
+    """
+
+    _EVICT_INTERVAL = 1000
+
+    def __init__(self, path: Path, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        """Initialize the cache.
+
+        Args:
+            path: Path of the database file.
+            ttl: The time in seconds after which an entry expires.
+            max_entries: The maximum number of entries.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connection = ThreadLocalConnection(path, ("journal_mode=WAL", "synchronous=NORMAL"), timeout=30)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_created_at ON responses (created_at)")
+
+    @staticmethod
+    def key(endpoint: str, params: dict[str, Any] | None = None) -> str:
+        """Build the key of a request.
+
+        Args:
+            endpoint: The endpoint of the request.
+            params: The query parameters of the request.
+
+        Returns:
+            The cache key.
+        """
+        return json.dumps([endpoint, params or {}], sort_keys=True)
+
+    def get(self, endpoint: str, params: dict[str, Any] | None = None) -> Any | None:
+        """Get a cached response.
+
+        Args:
+            endpoint: The endpoint of the request.
+            params: The query parameters of the request.
+
+        Returns:
+            The cached response, or None if there is no valid entry.
+        """
+        row = (
+            self._connection()
+            .execute(
+                "SELECT value FROM responses WHERE key = ? AND created_at > ?",
+                (self.key(endpoint, params), time.time() - self.ttl),
+            )
+            .fetchone()
+        )
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def set(self, endpoint: str, params: dict[str, Any] | None, value: Any) -> None:
+        """Cache a response.
+
+        Args:
+            endpoint: The endpoint of the request.
+            params: The query parameters of the request.
+            value: The json serializable response.
+        """
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at) VALUES (?, ?, ?)",
+                (self.key(endpoint, params), json.dumps(value), time.time()),
+            )
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % self._EVICT_INTERVAL == 0
+
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """Remove the expired entries and the oldest entries exceeding `max_entries`."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM responses WHERE created_at <= ?", (time.time() - self.ttl,))
+            conn.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM responses")
+
+    def __len__(self) -> int:
+        return int(self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0])
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Get the hit and miss counters and the number of entries of the cache."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+
+def get_cache_dir() -> Path:
+    """Get the cache directory, configured with `MEDMINER_CACHE_DIR`."""
+    return Path(os.getenv("MEDMINER_CACHE_DIR", "") or DEFAULT_CACHE_DIR)
+
+
+@cache
+def get_response_cache(name: str) -> ResponseCache:
+    """Get the process-wide cache of an API.
+
+    The cache directory can be configured with `MEDMINER_CACHE_DIR`, the time to live in seconds with
+    `MEDMINER_CACHE_TTL` and the maximum number of entries per API with `MEDMINER_CACHE_MAX_ENTRIES`.
+
+    Args:
+        name: The name of the API, e.g. "rxnav".
+
+    Returns:
+        The cache of the API.
+    """
+    return ResponseCache(
+        get_cache_dir() / f"{name}.sqlite",
+        ttl=float(os.getenv("MEDMINER_CACHE_TTL", "") or DEFAULT_TTL),
+        max_entries=int(os.getenv("MEDMINER_CACHE_MAX_ENTRIES", "") or DEFAULT_MAX_ENTRIES),
+    )
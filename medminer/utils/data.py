@@ -1,5 +1,9 @@
+"""
+This module contains utility functions for the MedMiner project.
+"""
 from dataclasses import dataclass
 from textwrap import dedent, indent
+from typing import Callable, Iterable, Iterator
 
 
 @dataclass
@@ -14,3 +18,76 @@ class Document:
             Patient: {self.patient_id}\n{indent(self.text, " " * 4 * 3)}
             """
         )
+
+
+@dataclass
+class DocumentBatch:
+    documents: list[Document]
+
+    @property
+    def patient_ids(self) -> list[str]:
+        return [document.patient_id for document in self.documents]
+
+    @property
+    def content(self) -> str:
+        if len(self.documents) == 1:
+            return self.documents[0].content
+
+        header = (
+            f"The data contains the documents of {len(self.documents)} patients. "
+            "Extract the information of every patient separately and use the ID after `Patient:` as patient_id."
+        )
+        return "\n".join([f"{header}\n", *(document.content for document in self.documents)])
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text with the rule of thumb of about 4 characters per token.
+
+    Args:
+        text: The text to estimate the tokens for.
+
+    Returns:
+        The estimated number of tokens.
+    """
+    return -(-len(text) // 4)
+
+
+def pack_documents(
+    documents: Iterable[Document],
+    max_tokens: int,
+    count_tokens: Callable[[str], int] = estimate_tokens,
+) -> Iterator[DocumentBatch]:
+    """
+    Pack consecutive documents into batches, so several patients are processed in one agent run.
+
+    A document that exceeds the budget on its own is put into a batch of its own.
+
+    Pipelines pack their documents with the `pack_tokens` setting.
+
+    Example:
+        >>> batches = list(pack_documents(docs, max_tokens=2000))
+        >>> pipe = SingleAgentPipeline(tasks, model, pack_tokens=2000)
+        >>> pipe.run(docs)
+
+    Args:
+        documents: The documents to pack.
+        max_tokens: The maximum number of tokens of the documents in a batch.
+        count_tokens: A function counting the tokens of a text, e.g. the length of the tokenized text.
+
+    Yields:
+        The batches of documents.
+    """
+    batch: list[Document] = []
+    batch_tokens = 0
+    for document in documents:
+        tokens = count_tokens(document.content)
+        if batch and batch_tokens + tokens > max_tokens:
+            yield DocumentBatch(batch)
+            batch, batch_tokens = [], 0
+
+        batch.append(document)
+        batch_tokens += tokens
+
+    if batch:
+        yield DocumentBatch(batch)
@@ -0,0 +1,135 @@
+"""
+This module contains the shared HTTP clients of the terminology tools.
+"""
+
+import atexit
+import importlib.util
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable, Iterable, TypeVar
+
+import httpx
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_clients: dict[str, httpx.Client] = {}
+_executor: ThreadPoolExecutor | None = None
+_worker = threading.local()
+_lock = threading.Lock()
+
+
+def _client_options() -> dict:
+    """
+    Get the options of the clients.
+
+    The options can be configured with `MEDMINER_HTTP_TIMEOUT` (seconds), `MEDMINER_HTTP_MAX_CONNECTIONS`
+    and `MEDMINER_HTTP_MAX_KEEPALIVE` (per host). HTTP/2 is used if `h2` is installed.
+
+    Returns:
+        The keyword arguments of the clients.
+    """
+    timeout = float(os.getenv("MEDMINER_HTTP_TIMEOUT", "") or 30)
+    max_connections = int(os.getenv("MEDMINER_HTTP_MAX_CONNECTIONS", "") or 32)
+    max_keepalive = int(os.getenv("MEDMINER_HTTP_MAX_KEEPALIVE", "") or max_connections)
+
+    return {
+        "verify": True,
+        "timeout": httpx.Timeout(timeout, connect=min(timeout, 10)),
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=60,
+        ),
+        "http2": importlib.util.find_spec("h2") is not None,
+    }
+
+
+def get_client(base_url: str) -> httpx.Client:
+    """
+    Get the shared client of a host.
+
+    The client keeps its connections alive for the life of the process, so only the first request to a host
+    pays for the TCP and TLS handshake. The client is thread-safe and must not be closed by the caller.
+
+    Args:
+        base_url: The base url of the API.
+
+    Returns:
+        The client.
+    """
+    with _lock:
+        if (client := _clients.get(base_url)) is None:
+            client = _clients[base_url] = httpx.Client(base_url=base_url, **_client_options())
+
+    return client
+
+
+def _concurrency() -> int:
+    return int(os.getenv("MEDMINER_HTTP_CONCURRENCY", "") or 8)
+
+
+def _init_worker() -> None:
+    _worker.active = True
+
+
+def in_worker() -> bool:
+    """Check if the current thread is a thread of the shared pool, where `fetch_unique` runs sequentially."""
+    return bool(getattr(_worker, "active", False))
+
+
+def fetch_unique(fetch: Callable[[K], V], keys: Iterable[K]) -> dict[K, V]:
+    """
+    Fetch the values of the unique keys concurrently.
+
+    The requests run on a shared thread pool of `MEDMINER_HTTP_CONCURRENCY` threads, so the number of
+    concurrent requests is bounded for the whole process. Nested calls from a fetch on the pool run
+    sequentially, as waiting for the pool from within the pool could deadlock.
+
+    Args:
+        fetch: The function fetching the value of a key.
+        keys: The keys, which may contain duplicates.
+
+    Returns:
+        The values by key, in the order of the first occurrence of the keys.
+
+    Raises:
+        Exception: The error of the first key (in order) that failed.
+    """
+    global _executor
+
+    unique = list(dict.fromkeys(keys))
+    if len(unique) <= 1 or in_worker():
+        return {key: fetch(key) for key in unique}
+
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_concurrency(), thread_name_prefix="medminer-http", initializer=_init_worker
+            )
+        executor = _executor
+
+    return dict(zip(unique, executor.map(fetch, unique)))
+
+
+def close_clients() -> None:
+    """Close the shared clients, e.g. at exit."""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+
+        _clients.clear()
+
+
+def _reset_clients() -> None:
+    # the connections of the parent must not be used by a forked child
+    global _lock, _executor
+    _lock = threading.Lock()
+    _executor = None
+    _clients.clear()
+
+
+atexit.register(close_clients)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_clients)
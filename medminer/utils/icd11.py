@@ -0,0 +1,184 @@
+"""
+This module contains the offline ICD-11 MMS search index built from the files of a linearization release.
+"""
+
+import csv
+import math
+import threading
+from collections import defaultdict
+from functools import cache
+from pathlib import Path
+from typing import Iterable
+
+from medminer.utils.text import normalize, similarity, trigrams
+
+
+class ICD11Index:
+    """Fuzzy token index over the titles, synonyms and index terms of the ICD-11 MMS linearization.
+
+    A term is scored against every indexed term sharing a (fuzzy) token with it, with an idf weighted
+    Dice coefficient of the tokens, so an exact match scores 1. The candidates have the same shape as those
+    of the `ICDDiagnosisTool` online search: the code, the best score of any of its terms and its title.
+    """
+
+    def __init__(self, terms: Iterable[tuple[str, str]], titles: dict[str, str]) -> None:
+        """Initialize the index.
+
+        Args:
+            terms: The (code, term) pairs to index, e.g. the titles, synonyms and index terms.
+            titles: The title of each code.
+        """
+        self.titles = titles
+        self._codes: list[str] = []
+        self._tokens: list[tuple[str, ...]] = []
+        self._postings: dict[str, list[int]] = defaultdict(list)
+
+        for code, term in terms:
+            tokens = tuple(dict.fromkeys(normalize(term).split()))
+            if not tokens or code not in titles:
+                continue
+
+            for token in tokens:
+                self._postings[token].append(len(self._codes))
+
+            self._codes.append(code)
+            self._tokens.append(tokens)
+
+        self._idf = {token: math.log(1 + len(self._codes) / len(ids)) for token, ids in self._postings.items()}
+        self._token_trigrams: dict[str, set[str]] = defaultdict(set)
+        for token in self._postings:
+            for trigram in trigrams(token):
+                self._token_trigrams[trigram].add(token)
+
+    @classmethod
+    def from_files(cls, tabulation: Path, term_files: Iterable[Path] = ()) -> "ICD11Index":
+        """Build the index from the simple tabulation of a release and optional synonym or index term files.
+
+        Args:
+            tabulation: The tab separated `SimpleTabulation` file with the `Code` and `Title` of every entity.
+            term_files: Tab separated files with additional terms of the codes in the columns `Code` and `Term`.
+
+        Returns:
+            The index.
+        """
+        titles: dict[str, str] = {}
+        with open(tabulation, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f, delimiter="\t"):
+                if code := (row.get("Code") or "").strip():
+                    # the depth of an entity is encoded as leading dashes
+                    titles[code] = (row.get("Title") or "").lstrip("- ").strip()
+
+        terms = list(titles.items())
+        for path in term_files:
+            with open(path, "r", encoding="utf-8-sig", newline="") as f:
+                terms.extend(
+                    (row["Code"].strip(), row["Term"]) for row in csv.DictReader(f, delimiter="\t") if row.get("Term")
+                )
+
+        return cls(terms, titles)
+
+    def _match_tokens(self, token: str, min_similarity: float = 0.8) -> dict[str, float]:
+        """
+        Get the indexed tokens matching a token, with their similarity.
+
+        Args:
+            token: The token of a search term.
+            min_similarity: The minimum similarity of a fuzzy match.
+
+        Returns:
+            The matching tokens, the token itself if it is indexed, otherwise the three most similar ones.
+        """
+        if token in self._postings:
+            return {token: 1.0}
+
+        candidates = set().union(*(self._token_trigrams.get(trigram, set()) for trigram in trigrams(token)))
+        scores = {candidate: similarity(token, candidate) for candidate in candidates}
+        # a word prefix (e.g. "diabet") matches like a small typo
+        scores |= {candidate: 0.9 for candidate in candidates if len(token) >= 4 and candidate.startswith(token)}
+        matches = sorted(
+            ((score, candidate) for candidate, score in scores.items() if score >= min_similarity), reverse=True
+        )
+
+        return {candidate: score for score, candidate in matches[:3]}
+
+    def search(self, term: str, threshold: float = 0.3, limit: int = 50) -> list[dict]:
+        """
+        Search the codes of a term.
+
+        Args:
+            term: The term to search for.
+            threshold: The minimum score of a candidate.
+            limit: The maximum number of candidates.
+
+        Returns:
+            The candidates with their code, score and title, sorted by score descending.
+        """
+        query = list(dict.fromkeys(normalize(term).split()))
+        if not query:
+            return []
+
+        max_idf = max(self._idf.values(), default=1.0)
+        matches = {token: self._match_tokens(token) for token in query}
+        # an unknown token weighs as much as its best match, or as much as the rarest token without one
+        weights = {
+            token: self._idf.get(token) or max((self._idf[match] for match in matches[token]), default=max_idf)
+            for token in query
+        }
+        query_weight = sum(weights.values())
+
+        candidates = {index for tokens in matches.values() for token in tokens for index in self._postings[token]}
+        scores: dict[str, float] = {}
+        for index in candidates:
+            tokens = self._tokens[index]
+            matched = 0.0
+            for token in query:
+                best = max(
+                    ((score, candidate) for candidate, score in matches[token].items() if candidate in tokens),
+                    default=None,
+                )
+                if best:
+                    matched += best[0] * (weights[token] + self._idf[best[1]])
+
+            score = round(matched / (query_weight + sum(self._idf[token] for token in tokens)), 4)
+            code = self._codes[index]
+            if score > scores.get(code, 0.0):
+                scores[code] = score
+
+        results: list[dict] = [
+            {"code": code, "score": score, "title": self.titles[code]}
+            for code, score in scores.items()
+            if score > threshold
+        ]
+        results.sort(key=lambda x: x["score"], reverse=True)
+
+        return results[:limit]
+
+
+_index_lock = threading.Lock()
+
+
+def get_icd11_index(path: str) -> ICD11Index:
+    """Get the index of an ICD-11 release, loaded once per process.
+
+    Args:
+        path: The `SimpleTabulation` file, or a folder with the `SimpleTabulation` file and additional
+            tab separated term files (`Code` and `Term` columns).
+
+    Returns:
+        The index.
+    """
+    with _index_lock:
+        return _load_icd11_index(Path(path))
+
+
+@cache
+def _load_icd11_index(path: Path) -> ICD11Index:
+    if path.is_file():
+        return ICD11Index.from_files(path)
+
+    files = sorted(file for file in path.iterdir() if file.suffix in (".txt", ".tsv"))
+    tabulation = next((file for file in files if "simpletabulation" in file.name.lower()), None)
+    if tabulation is None:
+        raise FileNotFoundError(f"No SimpleTabulation file found in {path}")
+
+    return ICD11Index.from_files(tabulation, [file for file in files if file != tabulation])
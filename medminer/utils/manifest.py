@@ -0,0 +1,109 @@
+"""
+This module contains the session manifest to checkpoint and resume pipeline runs.
+"""
+
+import json
+from hashlib import sha256
+from pathlib import Path
+from threading import Lock
+
+
+class SessionManifest:
+    """Record of the (task, document) pairs that are completed in a session.
+
+    The manifest is an append-only json lines file, so a crash can lose at most the record
+    that was written at that moment.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Initialize the manifest and load the records of earlier runs.
+
+        Args:
+            path: Path of the manifest file.
+        """
+        self.path = path
+        self._lock = Lock()
+        self._completed: set[tuple[str, str]] = set()
+
+        if not path.exists():
+            return
+
+        with open(path, "rb+") as f:
+            end = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # the last record is incomplete if the run was killed while writing it, it is cut off
+                    # so the next record starts on a line of its own
+                    f.truncate(end)
+                    break
+
+                end += len(line)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+                self._completed.add((record["task"], record["document"]))
+
+    @staticmethod
+    def hash(document: str) -> str:
+        """Hash a document.
+
+        Args:
+            document: The document to hash.
+
+        Returns:
+            The hex digest of the document.
+        """
+        return sha256(document.encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+    def is_completed(self, task_name: str, document: str) -> bool:
+        """Check if a task is completed for a document.
+
+        Args:
+            task_name: The name of the task.
+            document: The document.
+
+        Returns:
+            True if the task is completed for the document, false otherwise.
+        """
+        return (task_name, self.hash(document)) in self._completed
+
+    def complete(self, task_name: str, document: str) -> None:
+        """Record that a task is completed for a document.
+
+        Args:
+            task_name: The name of the task.
+            document: The document.
+        """
+        key = (task_name, self.hash(document))
+        with self._lock:
+            if key in self._completed:
+                return
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"task": key[0], "document": key[1]}) + "\n")
+
+            self._completed.add(key)
+
+    def merge(self, other: "SessionManifest") -> None:
+        """Add the records of another manifest.
+
+        Args:
+            other: The manifest to merge.
+        """
+        with self._lock:
+            new = other._completed - self._completed
+            if not new:
+                return
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a") as f:
+                for task_name, document_hash in sorted(new):
+                    f.write(json.dumps({"task": task_name, "document": document_hash}) + "\n")
+
+            self._completed |= new
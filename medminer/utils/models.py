@@ -2,9 +2,14 @@
 The utility DefaultModel class for initializing models based on provided parameters.
 """
 
+import copy
 import os
+import random
+import threading
+import time
+from typing import Any
 
-from smolagents import Model
+from smolagents import ChatMessage, Model
 
 try:
     import torch  # noqa: F401
@@ -16,12 +21,14 @@ try:
         AutoTokenizer,  # noqa: F401
     )
 
+    from transformers import DynamicCache
+
     impoted_hf_transformer = True
 except ImportError:
     impoted_hf_transformer = False
 
 try:
-    import openai  # noqa: F401
+    import openai
     from smolagents import AzureOpenAIServerModel
 
     imported_azure_openai = True
@@ -29,6 +36,376 @@ except ImportError:
     imported_azure_openai = False
 
 
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Check if an error was caused by the rate limit of the model provider.
+
+    Args:
+        error: The raised error.
+
+    Returns:
+        True if the provider rejected the request because of its rate limit, false otherwise.
+    """
+    if imported_azure_openai and isinstance(error, openai.RateLimitError):
+        return True
+
+    response = getattr(error, "response", None)
+    return 429 in (getattr(error, "status_code", None), getattr(response, "status_code", None))
+
+
+def _retry_after(error: BaseException) -> float | None:
+    """Get the delay the provider asked for in the `retry-after` header of a rate limit error."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if (retry_after := headers.get("retry-after")) is None:
+        return None
+
+    try:
+        return float(retry_after)
+    except ValueError:
+        return None
+
+
+class _TokenBucket:
+    """Token bucket refilling a budget per minute.
+
+    The bucket holds at most a sixth of the budget, so the budget can't be spent in a single burst
+    (providers like Azure OpenAI also enforce the quota on windows of a few seconds).
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, per_minute / 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float) -> None:
+        """Wait until the amount is available and take it from the bucket."""
+        amount = min(amount, self.capacity)
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+
+                wait = (amount - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """Give back (or take) the difference between the estimated and the actual amount."""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Request and token budgets and the AIMD controlled number of calls in flight of a model deployment.
+
+    The number of calls in flight grows additively after every call that succeeds within the latency target
+    and is halved whenever the provider answers with a rate limit error. A limiter is shared by all models
+    calling the same deployment in a process, see `get_rate_limiter`.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_concurrency: int = 16,
+        latency_target: float | None = None,
+    ) -> None:
+        """Initialize the limiter.
+
+        Args:
+            requests_per_minute: The maximum number of requests per minute.
+            tokens_per_minute: The maximum number of prompt and completion tokens per minute.
+            max_concurrency: The maximum number of calls in flight.
+            latency_target: Calls slower than this many seconds reduce the number of calls in flight.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max(1, max_concurrency)
+        self.latency_target = latency_target
+
+        self._requests = _TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._limit = float(max(1, self.max_concurrency // 2))
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def concurrency(self) -> int:
+        """The current number of calls allowed in flight."""
+        return int(self._limit)
+
+    def acquire(self, tokens: int) -> None:
+        """Wait until a call with an estimated number of tokens is allowed.
+
+        Args:
+            tokens: The estimated number of prompt and completion tokens of the call.
+        """
+        with self._condition:
+            while self._in_flight >= int(self._limit):
+                self._condition.wait()
+
+            self._in_flight += 1
+
+        if self._requests:
+            self._requests.take(1)
+        if self._tokens:
+            self._tokens.take(tokens)
+
+    def release(self, latency: float | None, rate_limited: bool = False) -> None:
+        """Release a call and adjust the number of calls in flight.
+
+        Args:
+            latency: The duration of the call in seconds, None if it failed.
+            rate_limited: Whether the call was rejected by the rate limit of the provider.
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if rate_limited:
+                self._limit = max(1.0, self._limit / 2)
+            elif latency is not None and self.latency_target and latency > self.latency_target:
+                self._limit = max(1.0, self._limit * 0.9)
+            elif latency is not None:
+                self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+
+            self._condition.notify_all()
+
+    def adjust_tokens(self, amount: float) -> None:
+        """Give back (or take) the difference between the estimated and the actual number of tokens of a call.
+
+        Args:
+            amount: The number of tokens.
+        """
+        if self._tokens:
+            self._tokens.adjust(amount)
+
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    deployment: str, requests_per_minute: float | None = None, tokens_per_minute: float | None = None
+) -> RateLimiter:
+    """
+    Get the rate limiter of a model deployment.
+
+    Args:
+        deployment: The deployment, e.g. the endpoint and id of the model.
+        requests_per_minute: The maximum number of requests per minute of the deployment.
+        tokens_per_minute: The maximum number of tokens per minute of the deployment.
+
+    Returns:
+        The limiter shared by all models calling the deployment, so they stay within its budgets together.
+    """
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(deployment)
+        if limiter is None or (limiter.requests_per_minute, limiter.tokens_per_minute) != (
+            requests_per_minute,
+            tokens_per_minute,
+        ):
+            limiter = _rate_limiters[deployment] = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    return limiter
+
+
+class RateLimitedModel(Model):
+    """Model wrapper that keeps the calls to a model within the request and token budgets of the provider.
+
+    The calls go through a `RateLimiter`. A call rejected by the rate limit of the provider is retried
+    with exponential backoff.
+    """
+
+    def __init__(
+        self,
+        model: Model,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        max_concurrency: int = 16,
+        latency_target: float | None = None,
+        max_retries: int = 6,
+        limiter: RateLimiter | None = None,
+    ) -> None:
+        """Initialize the model wrapper.
+
+        Args:
+            model: The model to wrap.
+            requests_per_minute: The maximum number of requests per minute.
+            tokens_per_minute: The maximum number of prompt and completion tokens per minute.
+            max_concurrency: The maximum number of calls in flight.
+            latency_target: Calls slower than this many seconds reduce the number of calls in flight.
+            max_retries: The maximum number of retries of a call rejected by the rate limit.
+            limiter: A limiter shared with other models, which replaces the budgets and limits above.
+        """
+        super().__init__(
+            flatten_messages_as_text=model.flatten_messages_as_text,
+            tool_name_key=model.tool_name_key,
+            tool_arguments_key=model.tool_arguments_key,
+            model_id=model.model_id,
+        )
+        self.model = model
+        self.max_retries = max_retries
+        self.limiter = limiter or RateLimiter(requests_per_minute, tokens_per_minute, max_concurrency, latency_target)
+
+    @property
+    def concurrency(self) -> int:
+        """The current number of calls allowed in flight."""
+        return self.limiter.concurrency
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for attributes the wrapper doesn't have, e.g. the tokenizer of a local model
+        if (model := self.__dict__.get("model")) is None:
+            raise AttributeError(name)
+
+        return getattr(model, name)
+
+    @staticmethod
+    def _estimate_tokens(messages: list[Any]) -> int:
+        # about 4 characters per token for the prompt plus some room for the completion
+        return len(str([getattr(message, "content", message) for message in messages])) // 4 + 512
+
+    def generate(
+        self,
+        messages: list[ChatMessage],
+        stop_sequences: list[str] | None = None,
+        response_format: dict[str, str] | None = None,
+        tools_to_call_from: list | None = None,
+        **kwargs: Any,
+    ) -> ChatMessage:
+        """Generate the response of the wrapped model within the rate limits.
+
+        Args:
+            messages: The messages to process.
+            stop_sequences: Sequences that stop the generation.
+            response_format: The response format of the model.
+            tools_to_call_from: Tools the model can call.
+            kwargs: Additional arguments of the wrapped model.
+
+        Returns:
+            The response of the model.
+        """
+        estimated_tokens = self._estimate_tokens(messages)
+        attempt = 0
+        while True:
+            self.limiter.acquire(estimated_tokens)
+            start = time.monotonic()
+            try:
+                message = self.model.generate(
+                    messages,
+                    stop_sequences=stop_sequences,
+                    response_format=response_format,
+                    tools_to_call_from=tools_to_call_from,
+                    **kwargs,
+                )
+            except Exception as e:
+                rate_limited = is_rate_limit_error(e)
+                self.limiter.release(None, rate_limited=rate_limited)
+                if not rate_limited or attempt >= self.max_retries:
+                    raise
+
+                # back off exponentially with jitter, so the waiting calls don't retry at the same time
+                delay = _retry_after(e) or min(60.0, 2.0**attempt)
+                time.sleep(delay * random.uniform(1, 1.25))
+                attempt += 1
+                continue
+
+            self.limiter.release(time.monotonic() - start)
+            if usage := getattr(message, "token_usage", None):
+                self.limiter.adjust_tokens(estimated_tokens - usage.input_tokens - usage.output_tokens)
+
+            return message
+
+
+if impoted_hf_transformer:
+
+    class PrefixCachingTransformersModel(TransformersModel):
+        """TransformersModel that reuses the KV cache of prompt prefixes across calls.
+
+        The prompts of a task share a long static prefix (system prompt, tools and task prompt) and differ only
+        in the document at the end. The KV cache of a prompt is kept, and a later prompt sharing a long enough
+        prefix with it starts from a copy of that cache, so only the new tokens have to be encoded.
+        A cached prompt is cropped to the prefix it shares with the next one, so it converges to the static prefix.
+        """
+
+        def __init__(
+            self, *args: Any, min_prefix_tokens: int = 64, max_cached_prefixes: int = 4, **kwargs: Any
+        ) -> None:
+            """Initialize the model.
+
+            Args:
+                args: Arguments of the `TransformersModel`.
+                min_prefix_tokens: The minimum number of shared tokens to reuse a cache.
+                max_cached_prefixes: The maximum number of cached prefixes, e.g. one per task.
+                kwargs: Keyword arguments of the `TransformersModel`.
+            """
+            super().__init__(*args, **kwargs)
+            self.min_prefix_tokens = min_prefix_tokens
+            self.max_cached_prefixes = max_cached_prefixes
+            self._prefixes: list[tuple[torch.Tensor, DynamicCache]] = []
+            self._prefix_lock = threading.Lock()
+
+        def _prepare_completion_args(self, *args: Any, **kwargs: Any) -> dict[str, Any]:
+            completion_args: dict[str, Any] = super()._prepare_completion_args(*args, **kwargs)
+            completion_args["past_key_values"] = self._prefix_cache(completion_args["inputs"])
+            return completion_args
+
+        def generate(self, *args: Any, **kwargs: Any) -> ChatMessage:
+            message = super().generate(*args, **kwargs)
+            # the memory of the agent keeps the raw completion arguments, which must not hold on to the cache
+            if isinstance(message.raw, dict):
+                message.raw.get("completion_kwargs", {}).pop("past_key_values", None)
+            return message
+
+        def _prefix_cache(self, input_ids: torch.Tensor) -> DynamicCache:
+            """Get a cache for the longest cached prefix of the prompt.
+
+            Args:
+                input_ids: The tokenized prompt.
+
+            Returns:
+                A copy of the cache, which the generation is free to extend.
+            """
+            ids = input_ids[0, :-1]  # the last token has to be encoded by the generation itself
+
+            with self._prefix_lock:
+                best, best_length = None, 0
+                for i, (prefix_ids, _) in enumerate(self._prefixes):
+                    length = min(len(prefix_ids), len(ids))
+                    mismatches = (prefix_ids[:length] != ids[:length]).nonzero()
+                    shared = int(mismatches[0]) if len(mismatches) else length
+                    if shared > best_length:
+                        best, best_length = i, shared
+
+                # a prefix sharing only a small part (e.g. the system prompt of another task) is not cropped
+                if best is not None and best_length >= max(self.min_prefix_tokens, len(self._prefixes[best][0]) // 2):
+                    prefix_ids, cache = self._prefixes.pop(best)
+                    if best_length < len(prefix_ids):
+                        cache.crop(best_length - len(prefix_ids))
+                        prefix_ids = prefix_ids[:best_length]
+
+                    self._prefixes.insert(0, (prefix_ids, cache))
+                    return copy.deepcopy(cache)
+
+            with torch.no_grad():
+                cache = DynamicCache()
+                self.model(input_ids[:, :-1], past_key_values=cache, use_cache=True)
+
+            with self._prefix_lock:
+                self._prefixes.insert(0, (ids, cache))
+                del self._prefixes[self.max_cached_prefixes :]
+
+            return copy.deepcopy(cache)
+
+
 class DefaultModel:
     """Default model class.
     This class is used to initialize the model based on the provided parameters.
@@ -45,7 +422,7 @@ class DefaultModel:
         self._model = None
 
         if impoted_hf_transformer and (model_id := kwargs.get("hf_model_id", "") or os.getenv("HF_MODEL_ID", "")):
-            self._model = TransformersModel(
+            self._model = PrefixCachingTransformersModel(
                 model_id=model_id,
             )
         elif (
@@ -62,6 +439,17 @@ class DefaultModel:
                 api_version=api_version,
             )
 
+            requests_per_minute = kwargs.get("oai_requests_per_minute", "") or os.getenv("OAI_REQUESTS_PER_MINUTE", "")
+            tokens_per_minute = kwargs.get("oai_tokens_per_minute", "") or os.getenv("OAI_TOKENS_PER_MINUTE", "")
+            if requests_per_minute or tokens_per_minute:
+                # the models of all sessions calling the deployment share its budgets
+                limiter = get_rate_limiter(
+                    f"{azure_endpoint}|{model_id}",
+                    requests_per_minute=float(requests_per_minute) if requests_per_minute else None,
+                    tokens_per_minute=float(tokens_per_minute) if tokens_per_minute else None,
+                )
+                self._model = RateLimitedModel(self._model, limiter=limiter)
+
     @property
     def model(self) -> Model:
         """Get the model.
@@ -0,0 +1,327 @@
+"""
+This module contains the offline RxNorm backend built from the RRF files of a RxNorm release.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from functools import cache, lru_cache
+from pathlib import Path
+from typing import Iterator
+
+from medminer.utils.cache import get_cache_dir
+from medminer.utils.sqlite import ThreadLocalConnection
+from medminer.utils.text import edit_distance, normalize, trigrams
+
+# the relations between rxcuis that are followed to find the ingredients and products of a drug
+RXNREL_RELAS = {
+    "has_ingredient",
+    "ingredient_of",
+    "has_precise_ingredient",
+    "precise_ingredient_of",
+    "has_ingredients",
+    "ingredients_of",
+    "consists_of",
+    "constitutes",
+    "has_tradename",
+    "tradename_of",
+    "isa",
+    "inverse_isa",
+    "form_of",
+    "has_form",
+}
+VA_CLASS_PATTERN = re.compile(r"^\[(?P<id>[^\]]+)\]\s*(?P<name>.*)$")
+
+_SCHEMA = """
+CREATE TABLE strings (id INTEGER PRIMARY KEY, norm TEXT NOT NULL UNIQUE);
+CREATE TABLE atoms (string_id INTEGER NOT NULL, rxcui TEXT NOT NULL, rxaui TEXT NOT NULL, sab TEXT NOT NULL);
+CREATE TABLE trigrams (trigram TEXT NOT NULL, string_id INTEGER NOT NULL, PRIMARY KEY (trigram, string_id))
+    WITHOUT ROWID;
+CREATE TABLE trigram_counts (trigram TEXT PRIMARY KEY, n INTEGER NOT NULL) WITHOUT ROWID;
+CREATE TABLE relations (rxcui1 TEXT NOT NULL, rxcui2 TEXT NOT NULL, PRIMARY KEY (rxcui1, rxcui2)) WITHOUT ROWID;
+CREATE TABLE atc (rxcui TEXT NOT NULL, code TEXT NOT NULL);
+CREATE TABLE atc_names (code TEXT PRIMARY KEY, name TEXT NOT NULL) WITHOUT ROWID;
+CREATE TABLE va (rxcui TEXT NOT NULL, class_id TEXT NOT NULL, class_name TEXT NOT NULL);
+"""
+_INDEXES = """
+CREATE INDEX atoms_string_id ON atoms (string_id);
+CREATE INDEX atc_rxcui ON atc (rxcui);
+CREATE INDEX va_rxcui ON va (rxcui);
+"""
+
+
+def _read_rrf(path: Path) -> Iterator[list[str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield line.rstrip("\n").split("|")
+
+
+def _find_rrf(rrf_dir: Path, name: str) -> Path:
+    # the files are in the `rrf` folder of a release, but may also be copied without it
+    for path in (rrf_dir / "rrf" / name, rrf_dir / name):
+        if path.exists():
+            return path
+
+    raise FileNotFoundError(f"{name} not found in {rrf_dir}")
+
+
+class RxNormStore:
+    """Local RxNorm store answering `approximateTerm` and `rxclass/class/byRxcui` like RxNav.
+
+    The store is a SQLite database built once from the RXNCONSO, RXNREL and RXNSAT files of a RxNorm release.
+    Terms are matched by their normalized string first; otherwise the strings sharing the rarest trigrams
+    of the term are ranked by edit distance. ATC classes come from the `ATC` atoms of the ingredients,
+    VA classes from the `VA_CLASS_NAME` attributes of the products, both following the RxNorm relations.
+    The responses have the same shape as those of RxNav, but only contain the ATC and VA classes.
+    """
+
+    def __init__(self, path: Path, max_candidates: int = 100, max_depth: int = 3) -> None:
+        """Initialize the store.
+
+        Args:
+            path: Path of the database built with `RxNormStore.build`.
+            max_candidates: The maximum number of strings ranked by edit distance.
+            max_depth: The maximum number of relations followed to find the classes of a rxcui.
+        """
+        self.path = path
+        self.max_candidates = max_candidates
+        self.max_depth = max_depth
+        self._connection = ThreadLocalConnection(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+        # the corpus mentions the same drugs over and over again
+        self.approximate_term = lru_cache(maxsize=16384)(self._approximate_term)
+        self.rxclass_by_rxcui = lru_cache(maxsize=16384)(self._rxclass_by_rxcui)
+
+    @classmethod
+    def build(cls, rrf_dir: Path, path: Path) -> "RxNormStore":
+        """Build the store from the RRF files of a RxNorm release.
+
+        Args:
+            rrf_dir: The folder of the release (or its `rrf` folder).
+            path: Path of the database to build.
+
+        Returns:
+            The store.
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.unlink(missing_ok=True)
+
+        conn = sqlite3.connect(tmp_path)
+        conn.executescript("PRAGMA journal_mode=OFF; PRAGMA synchronous=OFF;" + _SCHEMA)
+
+        strings: dict[str, int] = {}
+        trigram_counts: Counter[str] = Counter()
+        atoms, atc, atc_names = [], [], {}
+        for row in _read_rrf(_find_rrf(rrf_dir, "RXNCONSO.RRF")):
+            rxcui, lat, rxaui, sab, tty, code, string, suppress = (
+                row[0],
+                row[1],
+                row[7],
+                row[11],
+                row[12],
+                row[13],
+                row[14],
+                row[16],
+            )
+            if lat != "ENG" or suppress not in ("N", ""):
+                continue
+
+            if sab == "ATC":
+                if tty == "IN":
+                    atc.append((rxcui, code))
+                elif code not in atc_names or tty == "PT":
+                    atc_names[code] = string
+
+            if not (norm := normalize(string)):
+                continue
+
+            if (string_id := strings.get(norm)) is None:
+                string_id = strings[norm] = len(strings) + 1
+                conn.execute("INSERT INTO strings VALUES (?, ?)", (string_id, norm))
+                norm_trigrams = trigrams(norm)
+                trigram_counts.update(norm_trigrams)
+                conn.executemany(
+                    "INSERT INTO trigrams VALUES (?, ?)", ((trigram, string_id) for trigram in norm_trigrams)
+                )
+
+            atoms.append((string_id, rxcui, rxaui, sab))
+
+        conn.executemany("INSERT INTO atoms VALUES (?, ?, ?, ?)", atoms)
+        conn.executemany("INSERT INTO trigram_counts VALUES (?, ?)", trigram_counts.items())
+        conn.executemany("INSERT INTO atc VALUES (?, ?)", atc)
+        conn.executemany("INSERT INTO atc_names VALUES (?, ?)", atc_names.items())
+
+        conn.executemany(
+            "INSERT OR IGNORE INTO relations VALUES (?, ?)",
+            (
+                pair
+                for row in _read_rrf(_find_rrf(rrf_dir, "RXNREL.RRF"))
+                if row[0] and row[4] and row[7] in RXNREL_RELAS
+                for pair in ((row[0], row[4]), (row[4], row[0]))
+            ),
+        )
+
+        conn.executemany(
+            "INSERT INTO va VALUES (?, ?, ?)",
+            (
+                (row[0], match["id"], match["name"])
+                for row in _read_rrf(_find_rrf(rrf_dir, "RXNSAT.RRF"))
+                if row[8] == "VA_CLASS_NAME" and (match := VA_CLASS_PATTERN.match(row[10]))
+            ),
+        )
+
+        conn.executescript(_INDEXES)
+        conn.commit()
+        conn.close()
+        tmp_path.replace(path)
+
+        return cls(path)
+
+    def _approximate_term(self, term: str) -> dict:
+        """
+        Find the concepts of a term, in the shape of the RxNav `approximateTerm` response.
+
+        Args:
+            term: The term to search for.
+
+        Returns:
+            The candidates with their rank (1 is the best), score, rxcui, rxaui and source.
+        """
+        conn = self._connection()
+        norm = normalize(term)
+        if not norm:
+            return {"approximateGroup": {"inputTerm": term, "candidate": []}}
+
+        scored: list[tuple[float, int]] = []
+        exact = conn.execute("SELECT id FROM strings WHERE norm = ?", (norm,)).fetchone()
+        if exact:
+            scored.append((100.0, exact[0]))
+        else:
+            query_trigrams = list(trigrams(norm))
+            counts = dict(
+                conn.execute(
+                    f"SELECT trigram, n FROM trigram_counts WHERE trigram IN ({', '.join('?' * len(query_trigrams))})",
+                    query_trigrams,
+                ).fetchall()
+            )
+            # the rarest trigrams are the most selective, frequent ones like "ine" only add noise
+            rare = sorted(counts, key=counts.__getitem__)[: max(3, len(query_trigrams) // 2)]
+            if rare:
+                candidates = conn.execute(
+                    f"""
+                    SELECT s.id, s.norm FROM trigrams t JOIN strings s ON s.id = t.string_id
+                    WHERE t.trigram IN ({", ".join("?" * len(rare))})
+                    GROUP BY s.id ORDER BY COUNT(*) DESC, LENGTH(s.norm) LIMIT ?
+                    """,
+                    [*rare, self.max_candidates],
+                ).fetchall()
+                scored = [
+                    (round(100 * (1 - edit_distance(norm, other) / max(len(norm), len(other))), 2), string_id)
+                    for string_id, other in candidates
+                ]
+                scored = sorted([candidate for candidate in scored if candidate[0] > 0], reverse=True)[:20]
+
+        ranks = {score: rank for rank, score in enumerate(sorted({score for score, _ in scored}, reverse=True), 1)}
+        candidates = []
+        for score, string_id in scored:
+            for rxcui, rxaui, sab in conn.execute(
+                "SELECT rxcui, rxaui, sab FROM atoms WHERE string_id = ? ORDER BY sab != 'RXNORM', rxcui", (string_id,)
+            ):
+                candidates.append(
+                    {"rxcui": rxcui, "rxaui": rxaui, "score": str(score), "rank": str(ranks[score]), "source": sab}
+                )
+
+        return {"approximateGroup": {"inputTerm": term, "candidate": candidates}}
+
+    def _rxclass_by_rxcui(self, rxcui: str) -> dict:
+        """
+        Find the ATC and VA classes of a rxcui, in the shape of the RxNav `rxclass/class/byRxcui` response.
+
+        The classes of the rxcui itself are preferred, otherwise those of the closest related rxcuis.
+
+        Args:
+            rxcui: The rxcui.
+
+        Returns:
+            The drug infos with the class concepts.
+        """
+        conn = self._connection()
+        infos: list[dict] = []
+        missing = {"ATC", "VA"}
+        frontier, seen = [rxcui], {rxcui}
+        for _ in range(self.max_depth + 1):
+            if not frontier or not missing:
+                break
+
+            placeholders = ", ".join("?" * len(frontier))
+            if "ATC" in missing:
+                rows = conn.execute(
+                    f"""
+                    SELECT a.rxcui, n.code, n.name FROM atc a
+                    JOIN atc_names n ON n.code = CASE WHEN LENGTH(a.code) = 7 THEN SUBSTR(a.code, 1, 5) ELSE a.code END
+                    WHERE a.rxcui IN ({placeholders}) ORDER BY n.code
+                    """,
+                    frontier,
+                ).fetchall()
+                infos.extend(self._drug_info(cui, code, name, "ATC1-4", "ATC") for cui, code, name in rows)
+                if rows:
+                    missing.discard("ATC")
+
+            if "VA" in missing:
+                rows = conn.execute(
+                    f"SELECT rxcui, class_id, class_name FROM va WHERE rxcui IN ({placeholders}) ORDER BY class_id",
+                    frontier,
+                ).fetchall()
+                infos.extend(self._drug_info(cui, code, name, "VA", "VA") for cui, code, name in rows)
+                if rows:
+                    missing.discard("VA")
+
+            related = conn.execute(
+                f"SELECT rxcui2 FROM relations WHERE rxcui1 IN ({placeholders})",
+                frontier,
+            ).fetchall()
+            # an ingredient is related to thousands of products, which are not all needed to find its classes
+            frontier = [related_rxcui for (related_rxcui,) in related if related_rxcui not in seen][:500]
+            seen.update(frontier)
+
+        return {"rxclassDrugInfoList": {"rxclassDrugInfo": infos}} if infos else {}
+
+    @staticmethod
+    def _drug_info(rxcui: str, class_id: str, class_name: str, class_type: str, rela_source: str) -> dict:
+        return {
+            "minConcept": {"rxcui": rxcui},
+            "rxclassMinConceptItem": {"classId": class_id, "className": class_name, "classType": class_type},
+            "relaSource": rela_source,
+        }
+
+
+_store_lock = threading.Lock()
+
+
+def get_rxnorm_store() -> RxNormStore | None:
+    """Get the local RxNorm store, if `MEDMINER_RXNORM_DIR` points to the RRF files of a RxNorm release.
+
+    The store is built into the cache directory on first use and rebuilt when the RRF files are newer.
+
+    Returns:
+        The store, or None if no release is configured.
+    """
+    # the tools call this from several threads at once, but the store must only be built once
+    with _store_lock:
+        return _load_rxnorm_store()
+
+
+@cache
+def _load_rxnorm_store() -> RxNormStore | None:
+    if not (rrf_dir := os.getenv("MEDMINER_RXNORM_DIR", "")):
+        return None
+
+    path = get_cache_dir() / "rxnorm.sqlite"
+    conso = _find_rrf(Path(rrf_dir), "RXNCONSO.RRF")
+    if not path.exists() or path.stat().st_mtime < conso.stat().st_mtime:
+        return RxNormStore.build(Path(rrf_dir), path)
+
+    return RxNormStore(path)
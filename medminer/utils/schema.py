@@ -0,0 +1,259 @@
+"""
+This module contains the column schemas of the task results.
+"""
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Hashable, Sequence, cast
+
+import pandas as pd
+from pandas.api.types import pandas_dtype
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    imported_pyarrow = True
+except ImportError:
+    imported_pyarrow = False
+
+NUMERIC_DTYPES = ("Int64", "Float64")
+BOOLEAN_VALUES = {"true": True, "false": False, "1": True, "0": False}
+
+
+@dataclass(frozen=True)
+class Column:
+    """A column of the results of a task.
+
+    The dtype is a pandas extension dtype: "string", "category" (for codes with few distinct values,
+    e.g. ATC or ICD-11 codes), "Int64", "Float64" or "boolean". Missing values are `pd.NA` for all of them.
+    The values of code columns (terminology codes like RXCUI, ATC, ICD-11 or SNOMED CT ids) are indexed
+    by the result store.
+    """
+
+    name: str
+    dtype: str = "string"
+    code: bool = False
+
+
+def column_names(columns: Sequence[Column]) -> list[str]:
+    """
+    Get the names of the columns of a schema in order.
+
+    Args:
+        columns: The columns of the schema.
+
+    Returns:
+        The column names.
+    """
+    return [column.name for column in columns]
+
+
+def _convert(series: pd.Series, dtype: str) -> pd.Series:
+    if dtype == "string" and str(series.dtype) == dtype:
+        # already parsed by `read_csv`
+        return series
+
+    # empty strings are the missing values of the csv files and the rows saved by the agents
+    values = series.astype("string").str.strip()
+    values = values.where(values != "")
+    if dtype in NUMERIC_DTYPES:
+        numbers = pd.to_numeric(values, errors="coerce")
+        if dtype == "Int64":
+            # e.g. a month of "7.0" is 7, but a dose of "0.5" is not an integer
+            numbers = numbers.where(numbers.round() == numbers)
+
+        return cast(pd.Series, numbers.astype(pandas_dtype(dtype)))
+
+    if dtype == "boolean":
+        return cast(pd.Series, values.str.lower().map(BOOLEAN_VALUES).astype("boolean"))
+
+    return cast(pd.Series, values.astype(pandas_dtype(dtype)))
+
+
+def apply_schema(df: pd.DataFrame, columns: Sequence[Column]) -> pd.DataFrame:
+    """
+    Order the columns of a data frame as in a schema and convert them to their dtypes.
+
+    Missing columns of the schema are added, other columns are kept after them. Values that can't be
+    converted to the dtype of their column (e.g. a dose of "1/2") are missing.
+
+    Args:
+        df: The data frame.
+        columns: The columns of the schema.
+
+    Returns:
+        The converted data frame.
+    """
+    if not columns:
+        return df
+
+    names = column_names(columns)
+    df = df.reindex(columns=names + [name for name in df.columns if name not in names])
+    for column in columns:
+        df[column.name] = _convert(df[column.name], column.dtype)
+
+    return df
+
+
+def read_csv(path: Path, columns: Sequence[Column] = ()) -> pd.DataFrame:
+    """
+    Read a result file with the dtypes of a schema.
+
+    The columns of the schema are parsed as strings right away, so their dtypes are never inferred.
+
+    Args:
+        path: Path of the csv file.
+        columns: The columns of the schema.
+
+    Returns:
+        The results.
+    """
+    dtypes: dict[Hashable, str] = {column.name: "string" for column in columns}
+    return apply_schema(pd.read_csv(path, dtype=dtypes), columns)
+
+
+def arrow_schema(columns: Sequence[Column]) -> "pa.Schema":
+    """
+    Get the Arrow schema the results of a schema are stored with.
+
+    The values are stored as the strings the agents saved, so values that can't be converted to the dtype
+    of their column (e.g. a dose of "1/2") are kept. They are converted when the results are read.
+
+    Args:
+        columns: The columns of the schema.
+
+    Returns:
+        The Arrow schema, with dictionary encoded categorical columns.
+    """
+    return pa.schema(
+        [
+            (column.name, pa.dictionary(pa.int32(), pa.string()) if column.dtype == "category" else pa.string())
+            for column in columns
+        ]
+    )
+
+
+def to_arrow(df: pd.DataFrame, columns: Sequence[Column]) -> "pa.Table":
+    """
+    Convert the rows of a data frame to an Arrow table of their values with the columns of a schema.
+
+    Args:
+        df: The data frame.
+        columns: The columns of the schema, other columns are dropped. Without a schema, all columns are strings.
+
+    Returns:
+        The table in the Arrow schema of the stored results (see `arrow_schema`).
+    """
+    if not columns:
+        columns = [Column(str(name)) for name in df.columns]
+
+    df = df.reindex(columns=column_names(columns))
+    for column in columns:
+        values = df[column.name].astype("string")
+        df[column.name] = values.astype("category") if column.dtype == "category" else values
+
+    return pa.Table.from_pandas(df, schema=arrow_schema(columns), preserve_index=False)
+
+
+def apply_arrow_schema(table: "pa.Table", columns: Sequence[Column]) -> "pa.Table":
+    """
+    Convert the stored values of a table to the dtypes of a schema.
+
+    Values that can't be converted to the dtype of their column are missing, like with `apply_schema`.
+
+    Args:
+        table: The table in the Arrow schema of the stored results.
+        columns: The columns of the schema.
+
+    Returns:
+        The converted table.
+    """
+    types = {
+        "Int64": pa.int64(),
+        "Float64": pa.float64(),
+        "boolean": pa.bool_(),
+    }
+    for column in columns:
+        if column.dtype not in types or column.name not in table.column_names:
+            continue
+
+        values = _convert(table.column(column.name).to_pandas(), column.dtype)
+        table = table.set_column(
+            table.column_names.index(column.name),
+            column.name,
+            pa.array(values, type=types[column.dtype], from_pandas=True),
+        )
+
+    return table
+
+
+def read_arrow_stream(path: Path, memory_map: bool = True) -> "pa.Table | None":
+    """
+    Read the record batches of an Arrow IPC stream file.
+
+    A stream that was not closed (e.g. by a crashed process) is read up to its last complete batch.
+
+    Args:
+        path: Path of the stream file.
+        memory_map: Map the file into memory instead of reading it, so the table doesn't copy it.
+
+    Returns:
+        The table, or None if the file doesn't contain a schema yet.
+    """
+    source = pa.memory_map(str(path)) if memory_map else pa.OSFile(str(path))
+    try:
+        reader = pa.ipc.open_stream(source)
+    except (pa.ArrowInvalid, OSError):
+        return None
+
+    batches = []
+    try:
+        for batch in reader:
+            batches.append(batch)
+    except (pa.ArrowInvalid, OSError):
+        pass
+
+    return pa.Table.from_batches(batches, schema=reader.schema)
+
+
+def read_parquet_table(path: Path) -> "pa.Table | None":
+    """
+    Read a Parquet result dataset as an Arrow table.
+
+    The dataset is a directory with the Parquet part files and the Arrow stream files of the rows that
+    are not rolled into a part yet. The files are memory mapped.
+
+    Args:
+        path: Path of the dataset directory.
+
+    Returns:
+        The table in the order the rows were written, or None if the dataset is empty.
+    """
+    tables = [pq.read_table(file_path, memory_map=True) for file_path in sorted(path.glob("part-*.parquet"))]
+    for file_path in sorted(path.glob("stage-*.arrows")):
+        if (table := read_arrow_stream(file_path)) is not None:
+            tables.append(table)
+
+    if not tables:
+        return None
+
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+def read_parquet(path: Path, columns: Sequence[Column] = ()) -> pd.DataFrame:
+    """
+    Read a Parquet result dataset as an Arrow backed data frame with the dtypes of a schema.
+
+    Args:
+        path: Path of the dataset directory.
+        columns: The columns of the schema.
+
+    Returns:
+        The results, the columns keep the Arrow memory of the files instead of copying it into numpy arrays.
+    """
+    table = read_parquet_table(path)
+    if table is None:
+        return pd.DataFrame()
+
+    return cast(pd.DataFrame, apply_arrow_schema(table, columns).to_pandas(types_mapper=pd.ArrowDtype))
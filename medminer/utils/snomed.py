@@ -0,0 +1,180 @@
+"""
+This module contains the offline SNOMED CT backend built from the files of a RF2 snapshot release.
+"""
+
+import csv
+import sys
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from functools import cache
+from pathlib import Path
+from typing import Iterable, Iterator
+
+from medminer.utils.text import normalize
+
+PROCEDURE_ID = "71388002"
+IS_A_ID = "116680003"
+FSN_TYPE_ID = "900000000000003001"
+FULLY_DEFINED_ID = "900000000000073002"
+
+
+def _read_rf2(path: Path) -> Iterator[dict[str, str]]:
+    # descriptions may contain quotes, the files are not quoted
+    csv.field_size_limit(sys.maxsize)
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        yield from csv.DictReader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+
+def _find_rf2(rf2_dir: Path, prefix: str) -> Path:
+    # the files of a release are in `Snapshot/Terminology` and named e.g. `sct2_Concept_Snapshot_INT_20240101.txt`
+    paths = sorted(rf2_dir.rglob(f"{prefix}*.txt"))
+    if not paths:
+        raise FileNotFoundError(f"No {prefix} file found in {rf2_dir}")
+
+    return paths[0]
+
+
+class SNOMEDIndex:
+    """In-process index of the descriptions of the SNOMED CT concepts below a root concept.
+
+    The descendants of the root are computed once from the active IS-A relationships of the snapshot,
+    and the words of their active descriptions are indexed. Term filters are evaluated like the
+    description filters of Snowstorm: every word of a term has to be the prefix of a word of the description,
+    in any order. The concepts are returned in the shape of the Snowstorm `concepts` endpoint.
+    """
+
+    def __init__(self, rf2_dir: Path, root_id: str = PROCEDURE_ID) -> None:
+        """Load the index from a RF2 snapshot.
+
+        Args:
+            rf2_dir: The folder of the snapshot (or the release).
+            root_id: The concept whose descendants (excluding itself) are indexed.
+        """
+        children: dict[str, list[str]] = defaultdict(list)
+        for row in _read_rf2(_find_rf2(rf2_dir, "sct2_Relationship_Snapshot")):
+            if row["active"] == "1" and row["typeId"] == IS_A_ID:
+                children[row["destinationId"]].append(row["sourceId"])
+
+        self.descendants: set[str] = set()
+        stack = list(children[root_id])
+        while stack:
+            concept_id = stack.pop()
+            if concept_id not in self.descendants:
+                self.descendants.add(concept_id)
+                stack.extend(children[concept_id])
+
+        self._definition_status: dict[str, str] = {}
+        for row in _read_rf2(_find_rf2(rf2_dir, "sct2_Concept_Snapshot")):
+            if row["id"] in self.descendants:
+                if row["active"] == "1":
+                    self._definition_status[row["id"]] = (
+                        "FULLY_DEFINED" if row["definitionStatusId"] == FULLY_DEFINED_ID else "PRIMITIVE"
+                    )
+                else:
+                    self.descendants.discard(row["id"])
+
+        self._fsn: dict[str, str] = {}
+        self._concepts: list[str] = []
+        self._words: list[set[str]] = []
+        postings: dict[str, list[int]] = defaultdict(list)
+        for row in _read_rf2(_find_rf2(rf2_dir, "sct2_Description_Snapshot")):
+            concept_id = row["conceptId"]
+            if row["active"] != "1" or concept_id not in self._definition_status:
+                continue
+
+            if row["typeId"] == FSN_TYPE_ID:
+                self._fsn[concept_id] = row["term"]
+
+            words = set(normalize(row["term"]).split())
+            for word in words:
+                postings[word].append(len(self._concepts))
+
+            self._concepts.append(concept_id)
+            self._words.append(words)
+
+        self._vocabulary = sorted(postings)
+        self._postings = {word: frozenset(ids) for word, ids in postings.items()}
+
+    def _prefix_matches(self, prefix: str) -> set[int]:
+        """
+        Get the descriptions with a word starting with a prefix.
+
+        Args:
+            prefix: The (normalized) prefix.
+
+        Returns:
+            The indices of the descriptions.
+        """
+        matches: set[int] = set()
+        for i in range(bisect_left(self._vocabulary, prefix), len(self._vocabulary)):
+            if not self._vocabulary[i].startswith(prefix):
+                break
+
+            matches |= self._postings[self._vocabulary[i]]
+
+        return matches
+
+    def _term_matches(self, term: str) -> set[int]:
+        words = sorted(set(normalize(term).split()), key=len, reverse=True)
+        if not words:
+            return set()
+
+        # the longest word is usually the most selective
+        matches = self._prefix_matches(words[0])
+        for word in words[1:]:
+            if not matches:
+                break
+
+            matches = {i for i in matches if any(w.startswith(word) for w in self._words[i])}
+
+        return matches
+
+    def search(self, filters: Iterable[tuple[str, ...]], limit: int = 1000) -> list[dict]:
+        """
+        Search the concepts with a description matching all term filters.
+
+        Args:
+            filters: The term filters, each a tuple of alternative terms of which one has to match.
+            limit: The maximum number of concepts.
+
+        Returns:
+            The concepts with their id, FSN and definition status.
+        """
+        matches: set[int] | None = None
+        for term_filter in filters:
+            filter_matches = set().union(*(self._term_matches(term) for term in term_filter))
+            matches = filter_matches if matches is None else matches & filter_matches
+            if not matches:
+                return []
+
+        concept_ids = sorted({self._concepts[i] for i in matches or ()})[:limit]
+        return [
+            {
+                "conceptId": concept_id,
+                "fsn": {"term": self._fsn.get(concept_id, "")},
+                "definitionStatus": self._definition_status[concept_id],
+            }
+            for concept_id in concept_ids
+        ]
+
+
+_index_lock = threading.Lock()
+
+
+def get_snomed_index(path: str) -> SNOMEDIndex:
+    """Get the procedure index of a RF2 snapshot, loaded once per process.
+
+    Args:
+        path: The folder of the RF2 snapshot.
+
+    Returns:
+        The index.
+    """
+    with _index_lock:
+        return _load_snomed_index(Path(path))
+
+
+@cache
+def _load_snomed_index(path: Path) -> SNOMEDIndex:
+    return SNOMEDIndex(path)
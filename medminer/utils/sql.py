@@ -0,0 +1,131 @@
+"""
+This module contains the SQL input source, which streams the documents of a query from a database.
+"""
+
+import sqlite3
+from typing import Any, Iterable, Iterator, Mapping, Sequence
+
+from medminer.utils.data import Document
+
+try:
+    from sqlalchemy import create_engine, text
+
+    imported_sqlalchemy = True
+except ImportError:
+    imported_sqlalchemy = False
+
+DEFAULT_CHUNK_SIZE = 1000
+SQLITE_URL_PREFIX = "sqlite:///"
+
+
+def _column_index(columns: Sequence[str], column: str) -> int:
+    try:
+        return list(columns).index(column)
+    except ValueError:
+        raise ValueError(f"Column {column} not found in the query result, columns: {', '.join(columns)}") from None
+
+
+def _documents(
+    chunks: Iterable[Sequence[Sequence[Any]]], columns: Sequence[str], id_column: str, text_column: str
+) -> Iterator[Document]:
+    id_index = _column_index(columns, id_column)
+    text_index = _column_index(columns, text_column)
+    for chunk in chunks:
+        for row in chunk:
+            if row[text_index] is None or not str(row[text_index]).strip():
+                continue
+
+            yield Document(patient_id=str(row[id_index]), text=str(row[text_index]))
+
+
+def _dbapi_documents(
+    connection: Any,
+    query: str,
+    params: Sequence[Any] | Mapping[str, Any] | None,
+    chunk_size: int,
+    id_column: str,
+    text_column: str,
+) -> Iterator[Document]:
+    try:
+        # a named cursor is a server-side cursor in e.g. psycopg, the rows stay on the server until fetched
+        cursor = connection.cursor(name="medminer_documents")
+    except TypeError:
+        cursor = connection.cursor()
+
+    def chunks(rows: Sequence[Sequence[Any]]) -> Iterator[Sequence[Sequence[Any]]]:
+        while rows:
+            yield rows
+            rows = cursor.fetchmany(chunk_size)
+
+    try:
+        cursor.arraysize = chunk_size
+        cursor.execute(query, params or ())
+        # the description of a server-side cursor is only available after the first fetch
+        rows = cursor.fetchmany(chunk_size)
+        if rows:
+            columns = [description[0] for description in cursor.description]
+            yield from _documents(chunks(rows), columns, id_column, text_column)
+    finally:
+        cursor.close()
+
+
+def iter_sql_documents(
+    connection: Any,
+    query: str,
+    id_column: str = "patient_id",
+    text_column: str = "text",
+    params: Sequence[Any] | Mapping[str, Any] | None = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[Document]:
+    """
+    Stream the documents of a query from a database.
+
+    The rows are fetched in chunks of `chunk_size` with a server-side cursor where the database supports it,
+    so the result of the query is never loaded into memory at once. Rows without text are skipped.
+    The connection is opened on the first document. The documents may be fetched by different threads one
+    after another (e.g. by the `AsyncPipeline`), so a DB-API connection must allow that, for `sqlite3`
+    with `check_same_thread=False`.
+
+    Example:
+        >>> documents = iter_sql_documents("sqlite:///notes.sqlite", "SELECT id, note FROM notes", "id", "note")
+        >>> pipe.run(document.content for document in documents)
+
+    Args:
+        connection: A DB-API connection, or a database URL. URLs are opened with SQLAlchemy (an optional
+            dependency), `sqlite:///` URLs without it as well.
+        query: The query of the documents.
+        id_column: The column with the id of the patient of a document.
+        text_column: The column with the text of a document.
+        params: The parameters of the query, in the style of the driver for DB-API connections
+            and as a mapping of named parameters (`:name`) for URLs opened with SQLAlchemy.
+        chunk_size: The number of rows fetched at once.
+
+    Yields:
+        The documents.
+    """
+    if not isinstance(connection, str):
+        yield from _dbapi_documents(connection, query, params, chunk_size, id_column, text_column)
+        return
+
+    if imported_sqlalchemy:
+        engine = create_engine(connection)
+        try:
+            with engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+                    text(query), dict(params or {})
+                )
+                yield from _documents(result.partitions(chunk_size), list(result.keys()), id_column, text_column)
+        finally:
+            engine.dispose()
+
+        return
+
+    if not connection.startswith(SQLITE_URL_PREFIX):
+        raise ImportError("Database URLs require sqlalchemy, install it with `pip install sqlalchemy`.")
+
+    # the async pipeline fetches every document in a worker thread, the generator is never used concurrently
+    sqlite_connection = sqlite3.connect(connection.removeprefix(SQLITE_URL_PREFIX), check_same_thread=False)
+    try:
+        yield from iter_sql_documents(sqlite_connection, query, id_column, text_column, params, chunk_size)
+    finally:
+        sqlite_connection.close()
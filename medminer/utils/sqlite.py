@@ -0,0 +1,45 @@
+"""
+This module contains the SQLite connection helper of the embedded databases (response cache, RxNorm and result store).
+"""
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Sequence
+
+
+class ThreadLocalConnection:
+    """Lazily opened SQLite connection per thread.
+
+    SQLite connections must not be shared between threads, so every thread calling the connection
+    gets its own, opened on its first call and kept for the life of the thread.
+    """
+
+    def __init__(self, database: Path | str, pragmas: Sequence[str] = (), **kwargs: Any) -> None:
+        """Initialize the connection.
+
+        Args:
+            database: Path or URI of the database.
+            pragmas: The pragmas run on every new connection, e.g. "journal_mode=WAL".
+            kwargs: The arguments of `sqlite3.connect`.
+        """
+        self.database = database
+        self.pragmas = list(pragmas)
+        self.kwargs = kwargs
+        self._local = threading.local()
+
+    def __call__(self) -> sqlite3.Connection:
+        """Get the connection of the current thread.
+
+        Returns:
+            The connection.
+        """
+        conn: sqlite3.Connection | None = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.database, **self.kwargs)
+            for pragma in self.pragmas:
+                conn.execute(f"PRAGMA {pragma}")
+
+            self._local.conn = conn
+
+        return conn
@@ -0,0 +1,233 @@
+"""
+This module contains the embedded result store, which keeps the rows of all tasks and sessions in one database.
+"""
+
+import json
+import threading
+import time
+from functools import cache
+from pathlib import Path
+from typing import Any, Iterable
+
+import pandas as pd
+
+from medminer.utils.sqlite import ThreadLocalConnection
+
+
+class ResultStore:
+    """SQLite database of the rows saved by the tasks of all sessions.
+
+    Every row is stored with its session, task and patient id, and the values of the code columns of the task
+    schema are indexed, so looking up e.g. all patients with an ATC code of a class across sessions is an
+    indexed query instead of a scan of the result files. Like the response cache, the database is in WAL mode,
+    so it can be shared by the threads and processes of a run. The rows of a document replace the rows stored
+    for it before, so a document processed again by a resumed run is not stored twice.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Initialize the store.
+
+        Args:
+            path: Path of the database file.
+        """
+        self.path = path
+        self._connection = ThreadLocalConnection(
+            path, ("journal_mode=WAL", "synchronous=NORMAL", "foreign_keys=ON"), timeout=30
+        )
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    id INTEGER PRIMARY KEY,
+                    session_id TEXT NOT NULL,
+                    task TEXT NOT NULL,
+                    patient_id TEXT,
+                    document TEXT,
+                    created_at REAL NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS results_session ON results (session_id, task);
+                CREATE INDEX IF NOT EXISTS results_patient ON results (patient_id, task);
+                CREATE INDEX IF NOT EXISTS results_created_at ON results (created_at);
+                CREATE TABLE IF NOT EXISTS codes (
+                    result_id INTEGER NOT NULL REFERENCES results (id) ON DELETE CASCADE,
+                    code_column TEXT NOT NULL,
+                    code TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS codes_code ON codes (code);
+                CREATE INDEX IF NOT EXISTS codes_column_code ON codes (code_column, code);
+                CREATE INDEX IF NOT EXISTS codes_result ON codes (result_id);
+                """
+            )
+            if "document" not in [row[1] for row in conn.execute("PRAGMA table_info(results)")]:
+                # stores created before the rows were keyed by their document
+                conn.execute("ALTER TABLE results ADD COLUMN document TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS results_document ON results (session_id, task, document)")
+
+    def add(
+        self,
+        session_id: str,
+        task: str,
+        rows: Iterable[dict],
+        code_columns: Iterable[str] = (),
+        document: str | None = None,
+    ) -> None:
+        """Store the rows saved by a task.
+
+        Args:
+            session_id: The session of the rows.
+            task: The name of the task.
+            rows: The rows.
+            code_columns: The columns whose values are indexed as codes.
+            document: The hash of the document the rows were extracted from. The rows replace the rows
+                stored for the document before.
+        """
+        code_columns = list(code_columns)
+        created_at = time.time()
+        with self._connection() as conn:
+            if document is not None:
+                conn.execute(
+                    "DELETE FROM results WHERE session_id = ? AND task = ? AND document = ?",
+                    (session_id, task, document),
+                )
+
+            for row in rows:
+                patient_id = row.get("patient_id")
+                cursor = conn.execute(
+                    "INSERT INTO results (session_id, task, patient_id, document, created_at, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        session_id,
+                        task,
+                        None if patient_id in (None, "") else str(patient_id),
+                        document,
+                        created_at,
+                        json.dumps(row, default=str),
+                    ),
+                )
+                conn.executemany(
+                    "INSERT INTO codes (result_id, code_column, code) VALUES (?, ?, ?)",
+                    [
+                        (cursor.lastrowid, column, code)
+                        for column in code_columns
+                        if (code := str(row.get(column) or "").strip())
+                    ],
+                )
+
+    def query(
+        self,
+        task: str | None = None,
+        session_id: str | None = None,
+        patient_id: str | None = None,
+        code: str | None = None,
+        code_column: str | None = None,
+        prefix: bool = False,
+        since: float | None = None,
+        until: float | None = None,
+        limit: int | None = None,
+    ) -> pd.DataFrame:
+        """Query the stored rows.
+
+        Example:
+            >>> store = get_result_store("results.sqlite")
+            >>> # all patients given antibacterials (ATC J01) in the last 30 days
+            >>> store.query(task="medication", code="J01", code_column="atc_id", prefix=True,
+            ...             since=time.time() - 30 * 24 * 60 * 60)
+
+        Args:
+            task: Only rows of this task.
+            session_id: Only rows of this session.
+            patient_id: Only rows of this patient.
+            code: Only rows with this code in a code column.
+            code_column: Only match the code in this column, e.g. "atc_id".
+            prefix: Match all codes starting with `code`, e.g. the codes of an ATC class.
+            since: Only rows stored at or after this unix timestamp.
+            until: Only rows stored before this unix timestamp.
+            limit: The maximum number of rows.
+
+        Returns:
+            The rows in the order they were stored, with their `session_id`, `task` and `created_at`.
+        """
+        conditions: list[str] = []
+        params: list[Any] = []
+        for column, value in (("task", task), ("session_id", session_id), ("patient_id", patient_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at < ?")
+            params.append(until)
+
+        if code:
+            # a prefix is matched as a range of the index, e.g. "J01" <= code < "J02"
+            code_conditions = ["code >= ? AND code < ?" if prefix else "code = ?"]
+            params.extend([code, code[:-1] + chr(ord(code[-1]) + 1)] if prefix else [code])
+            if code_column is not None:
+                code_conditions.append("code_column = ?")
+                params.append(code_column)
+
+            conditions.append(f"id IN (SELECT result_id FROM codes WHERE {' AND '.join(code_conditions)})")
+
+        sql = "SELECT session_id, task, created_at, data FROM results"
+        if conditions:
+            sql += f" WHERE {' AND '.join(conditions)}"
+        sql += " ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        rows = self._connection().execute(sql, params).fetchall()
+        return pd.DataFrame(
+            [
+                {"session_id": row_session_id, "task": row_task, "created_at": created_at} | json.loads(data)
+                for row_session_id, row_task, created_at, data in rows
+            ]
+        )
+
+    def sessions(self) -> list[str]:
+        """Get the ids of the stored sessions, oldest first."""
+        rows = (
+            self._connection()
+            .execute("SELECT session_id FROM results GROUP BY session_id ORDER BY MIN(created_at)")
+            .fetchall()
+        )
+        return [row[0] for row in rows]
+
+    def delete_session(self, session_id: str) -> None:
+        """Remove the rows of a session.
+
+        Args:
+            session_id: The session.
+        """
+        with self._connection() as conn:
+            conn.execute("DELETE FROM results WHERE session_id = ?", (session_id,))
+
+    def __len__(self) -> int:
+        return int(self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0])
+
+
+_store_lock = threading.Lock()
+
+
+def get_result_store(path: str) -> ResultStore:
+    """Get the result store of a database file, opened once per process.
+
+    Args:
+        path: Path of the database file.
+
+    Returns:
+        The store.
+    """
+    with _store_lock:
+        return _load_result_store(Path(path).expanduser().resolve())
+
+
+@cache
+def _load_result_store(path: Path) -> ResultStore:
+    return ResultStore(path)
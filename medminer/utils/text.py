@@ -0,0 +1,73 @@
+"""
+This module contains the text matching utilities of the local terminology backends.
+"""
+
+import re
+
+
+def normalize(term: str) -> str:
+    """
+    Normalize a term for matching: lower case words (and decimal numbers) separated by single spaces.
+
+    Args:
+        term: The term to normalize.
+
+    Returns:
+        The normalized term.
+    """
+    return " ".join(re.findall(r"[^\W_]+(?:\.[0-9]+)?", term.lower()))
+
+
+def trigrams(norm: str) -> set[str]:
+    """
+    Get the trigrams of a normalized term, padded at the start and end.
+
+    Args:
+        norm: The normalized term.
+
+    Returns:
+        The trigrams of the term.
+    """
+    padded = f"  {norm} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a: str, b: str) -> int:
+    """
+    Get the Levenshtein distance of two strings.
+
+    Args:
+        a: The first string.
+        b: The second string.
+
+    Returns:
+        The number of insertions, deletions and substitutions to turn `a` into `b`.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+
+    return previous[-1]
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Get the similarity of two strings based on their edit distance.
+
+    Args:
+        a: The first string.
+        b: The second string.
+
+    Returns:
+        The similarity between 0 (nothing in common) and 1 (equal).
+    """
+    if not a and not b:
+        return 1.0
+
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
@@ -0,0 +1,369 @@
+"""
+This module contains the buffered writers of the session result files.
+"""
+
+import atexit
+import os
+import threading
+import time
+from csv import DictWriter, reader
+from itertools import chain
+from pathlib import Path
+from typing import Any, BinaryIO, Callable, Iterable, Sequence
+
+import pandas as pd
+
+from medminer.utils.schema import Column, imported_pyarrow, read_arrow_stream, to_arrow
+
+if imported_pyarrow:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on windows
+    fcntl = None  # type: ignore[assignment]
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_FLUSH_INTERVAL = 5.0
+DEFAULT_PARQUET_COMPRESSION = "zstd"
+DEFAULT_PARQUET_ROW_GROUP_SIZE = 128 * 1024
+DEFAULT_PARQUET_ROWS_PER_FILE = 1_000_000
+
+
+class SessionWriter:
+    """Long-lived, buffered writer of a result file of a session.
+
+    Rows are buffered and appended to the file in batches, when the buffer reaches `batch_size` rows,
+    `flush_interval` seconds after the first buffered row, or at a checkpoint. The rows of one `write`
+    call stay together, and the file is locked while writing, so neither threads nor processes interleave rows.
+    Work that depends on the rows being on disk (e.g. marking a document as completed) is deferred to the
+    next flush, which syncs the file once for the whole batch.
+    """
+
+    def __init__(
+        self, path: Path, batch_size: int = DEFAULT_BATCH_SIZE, flush_interval: float = DEFAULT_FLUSH_INTERVAL
+    ) -> None:
+        """Initialize the writer.
+
+        Args:
+            path: Path of the csv file.
+            batch_size: The number of buffered rows that triggers a flush.
+            flush_interval: The maximum time in seconds a row stays in the buffer.
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: list[tuple[list[str], list[dict]]] = []
+        self._buffered_rows = 0
+        self._lock = threading.Lock()
+        self._timer: threading.Timer | None = None
+        self._header: list[str] | None = None
+        self._callbacks: list[Callable[[], None]] = []
+        self._synced = True
+
+    def write(self, fieldnames: Iterable[str], rows: list[dict], callbacks: Iterable[Callable[[], None]] = ()) -> None:
+        """Buffer rows to append to the file.
+
+        Args:
+            fieldnames: The columns of the rows. A new file gets the columns of all rows buffered before
+                the first flush, the rows are written in the columns of the file and other columns are dropped.
+            rows: The rows to append.
+            callbacks: Functions called once the rows are written to disk, like the functions passed to `defer`.
+        """
+        with self._lock:
+            self._buffer.append((list(fieldnames), rows))
+            self._buffered_rows += len(rows)
+            self._callbacks.extend(callbacks)
+
+            if self._buffered_rows >= self.batch_size:
+                self._flush()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def defer(self, callback: Callable[[], None]) -> None:
+        """Call a function once the rows buffered so far are written to disk.
+
+        Args:
+            callback: The function, called right away if no rows are buffered.
+        """
+        with self._lock:
+            if self._buffer:
+                self._callbacks.append(callback)
+                return
+
+            if not self._synced:
+                self._sync()
+                self._synced = True
+
+        callback()
+
+    def flush(self, fsync: bool = False) -> None:
+        """Append the buffered rows to the file.
+
+        Args:
+            fsync: Also make sure the file is written to disk, e.g. before a document is marked as completed.
+        """
+        with self._lock:
+            self._flush(fsync)
+
+    def _flush(self, fsync: bool = False) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if not self._buffer:
+            return
+
+        # the deferred calls rely on their rows being on disk
+        fsync = fsync or bool(self._callbacks)
+        self._write(fsync)
+        self._buffer = []
+        self._buffered_rows = 0
+        self._synced = fsync
+
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def _sync(self) -> None:
+        if self.path.exists():
+            with open(self.path, "rb") as f:
+                os.fsync(f.fileno())
+
+    def _write(self, fsync: bool) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, "a+", newline="") as csvfile:
+            if fcntl is not None:
+                # other processes (e.g. a second run resuming the session) may append to the same file
+                fcntl.flock(csvfile, fcntl.LOCK_EX)
+
+            # the size is read after locking, another process may have written the header in the meantime
+            write_header = os.fstat(csvfile.fileno()).st_size == 0
+            if write_header:
+                # the header of a new file has the columns of all buffered rows
+                self._header = list(dict.fromkeys(chain.from_iterable(fieldnames for fieldnames, _ in self._buffer)))
+            elif self._header is None:
+                csvfile.seek(0)
+                self._header = next(reader(csvfile), [])
+                csvfile.seek(0, os.SEEK_END)
+
+            # every row is written in the columns of the header, so later rows can't be misaligned
+            writer = DictWriter(csvfile, fieldnames=self._header, restval="", extrasaction="ignore")
+            if write_header:
+                writer.writeheader()
+
+            for _, rows in self._buffer:
+                writer.writerows(rows)
+
+            csvfile.flush()
+            if fsync:
+                os.fsync(csvfile.fileno())
+
+    def close(self) -> None:
+        """Write the buffered rows to disk, e.g. at the end of a run."""
+        self.flush(fsync=True)
+
+
+class ParquetSessionWriter(SessionWriter):
+    """Buffered writer of a Parquet result dataset of a session.
+
+    The dataset is a directory of Parquet part files. The flushed rows are appended as Arrow record batches
+    to a stream file of the writer, which can be synced at every checkpoint, and the stream is rolled into a
+    compressed Parquet part once it has `rows_per_file` rows or the writer is closed.
+    Every process writes its own stream and parts, so the files don't need to be locked.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        columns: Sequence[Column] = (),
+        compression: str = DEFAULT_PARQUET_COMPRESSION,
+        row_group_size: int = DEFAULT_PARQUET_ROW_GROUP_SIZE,
+        rows_per_file: int = DEFAULT_PARQUET_ROWS_PER_FILE,
+        **kwargs: Any,
+    ) -> None:
+        """Initialize the writer.
+
+        Args:
+            path: Path of the dataset directory.
+            columns: The columns of the task schema. Without a schema, the columns of the rows buffered before
+                the first flush are strings.
+            compression: The compression codec of the Parquet files, e.g. "zstd", "snappy" or "none".
+            row_group_size: The maximum number of rows of a row group of the Parquet files.
+            rows_per_file: The number of rows that rolls the stream into a Parquet file.
+            kwargs: The arguments of the `SessionWriter`.
+        """
+        if not imported_pyarrow:
+            raise ImportError("The parquet output format requires pyarrow, install it with `pip install pyarrow`.")
+
+        super().__init__(path, **kwargs)
+        self.columns = list(columns)
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.rows_per_file = rows_per_file
+        self._stream: tuple[Path, BinaryIO, pa.ipc.RecordBatchStreamWriter] | None = None
+        self._streamed_rows = 0
+
+    def _write(self, fsync: bool) -> None:
+        if not self.columns:
+            fieldnames = dict.fromkeys(chain.from_iterable(fieldnames for fieldnames, _ in self._buffer))
+            self.columns = [Column(name) for name in fieldnames]
+
+        table = to_arrow(pd.DataFrame([row for _, rows in self._buffer for row in rows]), self.columns)
+        if self._stream is None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            stream_path = self.path / f"stage-{time.time_ns()}-{os.getpid()}.arrows"
+            stream_file = open(stream_path, "wb")
+            self._stream = (stream_path, stream_file, pa.ipc.new_stream(stream_file, table.schema))
+
+        _, sink, stream = self._stream
+        stream.write_table(table)
+        sink.flush()
+        if fsync:
+            os.fsync(sink.fileno())
+
+        self._streamed_rows += table.num_rows
+        if self._streamed_rows >= self.rows_per_file:
+            self._roll()
+
+    def _sync(self) -> None:
+        if self._stream is not None:
+            os.fsync(self._stream[1].fileno())
+
+    def _roll(self) -> None:
+        if self._stream is None:
+            return
+
+        stream_path, sink, stream = self._stream
+        stream.close()
+        sink.close()
+        self._stream = None
+        self._streamed_rows = 0
+
+        table = read_arrow_stream(stream_path, memory_map=False)
+        if table is not None and table.num_rows:
+            self.write_part(table)
+
+        # a crash before the stream is removed would read its rows twice, the part is complete at this point
+        stream_path.unlink()
+
+    def write_part(self, table: "pa.Table") -> None:
+        """Write a table as a new Parquet part file of the dataset.
+
+        Args:
+            table: The rows of the part.
+        """
+        self.path.mkdir(parents=True, exist_ok=True)
+        part_path = self.path / f"part-{time.time_ns()}-{os.getpid()}.parquet"
+        tmp_path = part_path.with_suffix(".tmp")
+        pq.write_table(
+            table,
+            tmp_path,
+            compression=self.compression,
+            row_group_size=self.row_group_size,
+        )
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+
+        os.replace(tmp_path, part_path)
+
+    def close(self) -> None:
+        """Write the buffered rows and roll the stream into a Parquet part file."""
+        with self._lock:
+            self._flush(fsync=True)
+            self._roll()
+
+
+_writers: dict[Path, SessionWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path: Path, output_format: str = "csv", columns: Sequence[Column] = ()) -> SessionWriter:
+    """Get the writer of a file, shared by all tools of the process writing it.
+
+    The batch size can be configured with `MEDMINER_WRITER_BATCH_SIZE` and the flush interval in seconds with
+    `MEDMINER_WRITER_FLUSH_INTERVAL`. The Parquet files are configured with `MEDMINER_PARQUET_COMPRESSION`,
+    `MEDMINER_PARQUET_ROW_GROUP_SIZE` and `MEDMINER_PARQUET_ROWS_PER_FILE`.
+
+    Args:
+        path: Path of the csv file or the Parquet dataset directory.
+        output_format: The format of the results, "csv" or "parquet".
+        columns: The columns of the task schema, used for the columns of the Parquet files.
+
+    Returns:
+        The writer.
+    """
+    path = path.resolve()
+    with _writers_lock:
+        if (writer := _writers.get(path)) is None:
+            options: dict[str, Any] = {
+                "batch_size": int(os.getenv("MEDMINER_WRITER_BATCH_SIZE", "") or DEFAULT_BATCH_SIZE),
+                "flush_interval": float(os.getenv("MEDMINER_WRITER_FLUSH_INTERVAL", "") or DEFAULT_FLUSH_INTERVAL),
+            }
+            if output_format == "parquet":
+                writer = ParquetSessionWriter(
+                    path,
+                    columns,
+                    compression=os.getenv("MEDMINER_PARQUET_COMPRESSION", "") or DEFAULT_PARQUET_COMPRESSION,
+                    row_group_size=int(
+                        os.getenv("MEDMINER_PARQUET_ROW_GROUP_SIZE", "") or DEFAULT_PARQUET_ROW_GROUP_SIZE
+                    ),
+                    rows_per_file=int(os.getenv("MEDMINER_PARQUET_ROWS_PER_FILE", "") or DEFAULT_PARQUET_ROWS_PER_FILE),
+                    **options,
+                )
+            else:
+                writer = SessionWriter(path, **options)
+
+            _writers[path] = writer
+
+    return writer
+
+
+def _session_writers(directory: Path | None, remove: bool = False) -> list[SessionWriter]:
+    if directory is not None:
+        directory = directory.resolve()
+
+    with _writers_lock:
+        writers = [writer for writer in _writers.values() if directory is None or writer.path.is_relative_to(directory)]
+        if remove:
+            for writer in writers:
+                del _writers[writer.path]
+
+    return writers
+
+
+def checkpoint(directory: Path | None = None) -> None:
+    """Flush the buffered rows of the writers to disk.
+
+    Args:
+        directory: Only flush the writers of the files in this directory, e.g. the session directory.
+    """
+    for writer in _session_writers(directory):
+        writer.flush(fsync=True)
+
+
+def close_writers(directory: Path | None = None) -> None:
+    """Write the buffered rows of the writers to disk and complete their files, e.g. at the end of a run.
+
+    The closed writers are released, a later write to their files gets a new writer.
+
+    Args:
+        directory: Only close the writers of the files in this directory, e.g. the session directory.
+    """
+    for writer in _session_writers(directory, remove=True):
+        writer.close()
+
+
+def _reset_writers() -> None:
+    # the buffered rows of the parent are written by the parent, a forked child starts without writers
+    global _writers_lock
+    _writers.clear()
+    _writers_lock = threading.Lock()
+
+
+atexit.register(close_writers)
+if hasattr(os, "register_at_fork"):  # not available on windows
+    os.register_at_fork(after_in_child=_reset_writers)
@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+from typing import Callable
+
+import httpx
+import pytest
+
+from medminer.tools.diagnosis import ICD_TOKEN_URL, ICDTokenProvider
+from medminer.utils import http
+
+
+def token_server(monkeypatch: pytest.MonkeyPatch, respond: Callable[[int], httpx.Response]) -> list[int]:
+    requests: list[int] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(len(requests) + 1)
+        return respond(len(requests))
+
+    client = httpx.Client(base_url=ICD_TOKEN_URL, transport=httpx.MockTransport(handler))
+    monkeypatch.setitem(http._clients, ICD_TOKEN_URL, client)
+    return requests
+
+
+def token(number: int, expires_in: float = 2) -> httpx.Response:
+    return httpx.Response(200, json={"access_token": f"token {number}", "expires_in": expires_in})
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_token_is_fetched_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    requests = token_server(monkeypatch, lambda number: token(number, expires_in=3600))
+    provider = ICDTokenProvider("client", "secret")
+
+    assert provider.get_token() == "token 1"
+    assert provider.get_token() == "token 1"
+    assert requests == [1]
+
+    provider.close()
+
+
+def test_refresh_does_not_block_get_token(monkeypatch: pytest.MonkeyPatch) -> None:
+    refreshing, release = threading.Event(), threading.Event()
+
+    def respond(number: int) -> httpx.Response:
+        if number == 2:
+            refreshing.set()
+            release.wait(5)
+
+        return token(number)
+
+    token_server(monkeypatch, respond)
+    provider = ICDTokenProvider("client", "secret")
+    assert provider.get_token() == "token 1"
+
+    # the token is refreshed after half of its lifetime of 2 seconds
+    assert refreshing.wait(5)
+    start = time.monotonic()
+    assert provider.get_token() == "token 1"
+    assert time.monotonic() - start < 0.5
+
+    release.set()
+    wait_for(lambda: provider.get_token() == "token 2")
+    provider.close()
+
+
+def test_invalid_refresh_response_stops_the_timer(monkeypatch: pytest.MonkeyPatch) -> None:
+    def respond(number: int) -> httpx.Response:
+        return token(number) if number == 1 else httpx.Response(200, content=json.dumps({"error": "invalid"}))
+
+    requests = token_server(monkeypatch, respond)
+    provider = ICDTokenProvider("client", "secret")
+    provider.get_token()
+
+    wait_for(lambda: len(requests) == 2 and provider._timer is None)
+    assert provider.get_token() == "token 1"
+
+
+def test_unused_token_is_not_refreshed(monkeypatch: pytest.MonkeyPatch) -> None:
+    requests = token_server(monkeypatch, token)
+    provider = ICDTokenProvider("client", "secret")
+    provider.get_token()
+
+    # the first refresh is due to the use above, the token is not used after it
+    wait_for(lambda: len(requests) == 2)
+    wait_for(lambda: provider._timer is None)
+    assert requests == [1, 2]
@@ -0,0 +1,72 @@
+from pathlib import Path
+
+import pytest
+
+from medminer.utils.icd11 import ICD11Index
+
+TITLES = {
+    "5A11": "Type 2 diabetes mellitus",
+    "5A10": "Type 1 diabetes mellitus",
+    "BA00": "Essential hypertension",
+    "CA40.0": "Bacterial pneumonia",
+}
+
+
+@pytest.fixture
+def index() -> ICD11Index:
+    terms = list(TITLES.items()) + [("5A11", "adult onset diabetes"), ("XX00", "unknown code")]
+    return ICD11Index(terms, TITLES)
+
+
+def test_exact_match(index: ICD11Index) -> None:
+    results = index.search("Essential Hypertension")
+
+    assert results[0] == {"code": "BA00", "score": 1.0, "title": "Essential hypertension"}
+
+
+def test_sorted_by_score(index: ICD11Index) -> None:
+    results = index.search("type 2 diabetes")
+
+    assert [result["code"] for result in results][:2] == ["5A11", "5A10"]
+    assert [result["score"] for result in results] == sorted((result["score"] for result in results), reverse=True)
+
+
+def test_synonym(index: ICD11Index) -> None:
+    results = index.search("adult onset diabetes")
+
+    assert results[0]["code"] == "5A11"
+    assert results[0]["score"] == 1.0
+    assert results[0]["title"] == "Type 2 diabetes mellitus"
+
+
+def test_typo_and_prefix(index: ICD11Index) -> None:
+    assert index.search("hypertenison")[0]["code"] == "BA00"
+    assert index.search("pneumo")[0]["code"] == "CA40.0"
+
+
+def test_threshold(index: ICD11Index) -> None:
+    scores = {result["code"]: result["score"] for result in index.search("diabetes", threshold=0.0)}
+
+    assert all(score > 0.0 for score in scores.values())
+    assert {"5A10", "5A11"} <= set(scores)
+    assert index.search("diabetes", threshold=max(scores.values())) == []
+    assert index.search("diabetes", threshold=0.0, limit=1) == index.search("diabetes", threshold=0.0)[:1]
+
+
+def test_no_match(index: ICD11Index) -> None:
+    assert index.search("fracture of femur") == []
+    assert index.search("  ") == []
+    # terms of codes without a title are not indexed
+    assert index.search("unknown code") == []
+
+
+def test_from_files(tmp_path: Path) -> None:
+    tabulation = tmp_path / "SimpleTabulation.txt"
+    tabulation.write_text("Code\tTitle\n\t- Endocrine diseases\n5A11\t- - Type 2 diabetes mellitus\n")
+    synonyms = tmp_path / "synonyms.txt"
+    synonyms.write_text("Code\tTerm\n5A11\tT2DM\n5A11\t\n")
+
+    index = ICD11Index.from_files(tabulation, [synonyms])
+
+    assert index.titles == {"5A11": "Type 2 diabetes mellitus"}
+    assert index.search("t2dm")[0]["code"] == "5A11"
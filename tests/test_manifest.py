@@ -0,0 +1,59 @@
+from pathlib import Path
+
+from medminer.utils.manifest import SessionManifest
+
+
+def test_reload(tmp_path: Path) -> None:
+    path = tmp_path / "manifest.jsonl"
+    manifest = SessionManifest(path)
+    manifest.complete("medication", "document 1")
+    manifest.complete("medication", "document 1")
+    manifest.complete("diagnosis", "document 1")
+
+    reloaded = SessionManifest(path)
+
+    assert len(reloaded) == 2
+    assert reloaded.is_completed("medication", "document 1")
+    assert reloaded.is_completed("diagnosis", "document 1")
+    assert not reloaded.is_completed("medication", "document 2")
+    assert len(path.read_text().splitlines()) == 2
+
+
+def test_truncated_last_line(tmp_path: Path) -> None:
+    path = tmp_path / "manifest.jsonl"
+    SessionManifest(path).complete("medication", "document 1")
+    with open(path, "a") as f:
+        f.write('{"task": "medication", "docu')
+
+    manifest = SessionManifest(path)
+    manifest.complete("medication", "document 2")
+
+    reloaded = SessionManifest(path)
+    assert len(reloaded) == 2
+    assert reloaded.is_completed("medication", "document 1")
+    assert reloaded.is_completed("medication", "document 2")
+
+
+def test_missing_file(tmp_path: Path) -> None:
+    manifest = SessionManifest(tmp_path / "session" / "manifest.jsonl")
+
+    assert len(manifest) == 0
+
+    manifest.complete("medication", "document 1")
+    assert (tmp_path / "session" / "manifest.jsonl").exists()
+
+
+def test_merge(tmp_path: Path) -> None:
+    manifest = SessionManifest(tmp_path / "manifest.jsonl")
+    manifest.complete("medication", "document 1")
+    shard = SessionManifest(tmp_path / "shard" / "manifest.jsonl")
+    shard.complete("medication", "document 1")
+    shard.complete("medication", "document 2")
+
+    manifest.merge(shard)
+    manifest.merge(shard)
+
+    reloaded = SessionManifest(tmp_path / "manifest.jsonl")
+    assert len(reloaded) == 2
+    assert reloaded.is_completed("medication", "document 2")
+    assert len((tmp_path / "manifest.jsonl").read_text().splitlines()) == 2
@@ -0,0 +1,125 @@
+from typing import Any
+
+import pytest
+from smolagents import ChatMessage, Model
+from smolagents.models import MessageRole
+
+from medminer.utils import models
+from medminer.utils.models import RateLimitedModel, RateLimiter, get_rate_limiter, is_rate_limit_error
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FakeModel(Model):
+    """Model rejecting the first calls with a rate limit error."""
+
+    def __init__(self, rate_limited_calls: int = 0, error: Exception | None = None) -> None:
+        super().__init__(model_id="fake")
+        self.rate_limited_calls = rate_limited_calls
+        self.error = error
+        self.calls = 0
+
+    def generate(self, messages: list[ChatMessage], **kwargs: Any) -> ChatMessage:
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        if self.calls <= self.rate_limited_calls:
+            raise RateLimitError("Too many requests")
+
+        return ChatMessage(role=MessageRole.ASSISTANT, content="ok")
+
+
+@pytest.fixture
+def sleeps(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    sleeps: list[float] = []
+    monkeypatch.setattr(models.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def messages() -> list[ChatMessage]:
+    return [ChatMessage(role=MessageRole.USER, content="Hello")]
+
+
+def test_retries_rate_limited_calls(sleeps: list[float]) -> None:
+    model = FakeModel(rate_limited_calls=2)
+    limited = RateLimitedModel(model, max_concurrency=16)
+
+    assert limited.generate(messages()).content == "ok"
+    assert model.calls == 3
+    # exponential backoff with jitter
+    assert len(sleeps) == 2
+    assert 1 <= sleeps[0] <= 1.25
+    assert 2 <= sleeps[1] <= 2.5
+
+
+def test_rate_limit_halves_concurrency(sleeps: list[float]) -> None:
+    limited = RateLimitedModel(FakeModel(rate_limited_calls=2), max_concurrency=16)
+    assert limited.concurrency == 8
+
+    limited.generate(messages())
+
+    # halved twice, then increased by 1 / 2 after the successful call
+    assert limited.concurrency == 2
+
+
+def test_success_increases_concurrency(sleeps: list[float]) -> None:
+    limited = RateLimitedModel(FakeModel(), max_concurrency=4)
+    assert limited.concurrency == 2
+
+    for _ in range(10):
+        limited.generate(messages())
+
+    assert limited.concurrency == 4
+
+
+def test_gives_up_after_max_retries(sleeps: list[float]) -> None:
+    model = FakeModel(rate_limited_calls=10)
+
+    with pytest.raises(RateLimitError):
+        RateLimitedModel(model, max_retries=2).generate(messages())
+
+    assert model.calls == 3
+
+
+def test_other_errors_are_not_retried(sleeps: list[float]) -> None:
+    model = FakeModel(error=ValueError("Invalid request 429"))
+
+    with pytest.raises(ValueError):
+        RateLimitedModel(model).generate(messages())
+
+    assert model.calls == 1
+    assert sleeps == []
+
+
+def test_is_rate_limit_error() -> None:
+    class Response:
+        status_code = 429
+
+    error = Exception("Too many requests")
+    error.response = Response()  # type: ignore[attr-defined]
+
+    assert is_rate_limit_error(RateLimitError())
+    assert is_rate_limit_error(error)
+    assert not is_rate_limit_error(Exception("id 4290 not found"))
+
+
+def test_rate_limiter_is_shared_per_deployment() -> None:
+    limiter = get_rate_limiter("https://a.openai.azure.com|gpt-4o", requests_per_minute=60)
+
+    assert get_rate_limiter("https://a.openai.azure.com|gpt-4o", requests_per_minute=60) is limiter
+    assert get_rate_limiter("https://b.openai.azure.com|gpt-4o", requests_per_minute=60) is not limiter
+    # changed budgets replace the limiter
+    assert get_rate_limiter("https://a.openai.azure.com|gpt-4o", requests_per_minute=30) is not limiter
+
+
+def test_models_share_the_limiter(sleeps: list[float]) -> None:
+    limiter = RateLimiter(max_concurrency=16)
+    first = RateLimitedModel(FakeModel(rate_limited_calls=1), limiter=limiter)
+    second = RateLimitedModel(FakeModel(), limiter=limiter)
+
+    first.generate(messages())
+
+    # the rate limit seen by one model also slows down the other
+    assert second.concurrency == first.concurrency < 8
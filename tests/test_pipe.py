@@ -0,0 +1,153 @@
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+import pytest
+from smolagents import Model
+
+from medminer.pipe import AsyncPipeline, ShardedPipeline, SingleAgentPipeline
+from medminer.task.base import Task
+from medminer.tools.csv import CSVTool
+from medminer.utils.data import Document
+from medminer.utils.schema import Column
+
+
+class NoteTask(Task):
+    name = "note"
+    verbose_name = "Note"
+    prompt = "Extract the notes."
+    tools = [CSVTool]
+    columns = [Column("patient_id"), Column("dose", "Float64")]
+
+
+@pytest.fixture
+def processed(monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    processed: list[str] = []
+
+    def process(self: Task, data: str, patient_ids: Iterable[str] | None = None) -> list[dict]:
+        processed.append(data)
+        return []
+
+    monkeypatch.setattr(Task, "process", process)
+    return processed
+
+
+def pipeline(tmp_path: Path, **kwargs: int) -> SingleAgentPipeline:
+    return SingleAgentPipeline([NoteTask], Model(model_id="stub"), base_dir=tmp_path, session_id="session", **kwargs)
+
+
+def test_resume_skips_completed_documents(tmp_path: Path, processed: list[str]) -> None:
+    pipeline(tmp_path).run(["a", "b"])
+    assert processed == ["a", "b"]
+
+    processed.clear()
+    pipeline(tmp_path).run(["a", "b", "c"], resume=True)
+    assert processed == ["c"]
+
+
+def test_without_resume_processes_all_documents(tmp_path: Path, processed: list[str]) -> None:
+    pipeline(tmp_path).run(["a", "b"])
+
+    processed.clear()
+    pipeline(tmp_path).run(["a", "b"])
+    assert processed == ["a", "b"]
+
+
+def test_resume_packed_documents(tmp_path: Path, processed: list[str]) -> None:
+    documents = [Document(patient_id=str(i), text=f"note {i}") for i in range(3)]
+    pipeline(tmp_path, pack_tokens=10_000).run(documents[:2])
+    assert len(processed) == 1
+
+    processed.clear()
+    pipeline(tmp_path, pack_tokens=10_000).run(documents, resume=True)
+    assert processed == [documents[2].content]
+
+
+def test_packed_rows_of_padded_patient_ids(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    documents = [Document(patient_id=" 1", text="note 1"), Document(patient_id="2 ", text="note 2")]
+    recorded: dict[str, list[dict]] = {}
+
+    def run(self: Task, data: str) -> None:
+        self.agent.tools["save_csv"].forward("note", [{"patient_id": 1, "dose": "1"}, {"patient_id": "2", "dose": "2"}])
+
+    def record(self: SingleAgentPipeline, task: Task, item: str, rows: list[dict]) -> None:
+        recorded[item] = rows
+
+    monkeypatch.setattr(Task, "run", run)
+    monkeypatch.setattr(SingleAgentPipeline, "_record", record)
+    results = pipeline(tmp_path, pack_tokens=10_000).run(documents)
+
+    # the patient ids of the documents and of the rows match regardless of their type and whitespace
+    assert results["note"]["patient_id"].tolist() == ["1", "2"]
+    assert recorded == {
+        documents[0].content: [{"patient_id": 1, "dose": "1"}],
+        documents[1].content: [{"patient_id": "2", "dose": "2"}],
+    }
+
+
+def test_merge_shards_keeps_raw_values(tmp_path: Path) -> None:
+    shards_dir = tmp_path / "session" / "shards"
+    for shard, rows in enumerate(["1,1/2\n", "2,0.5\n3,\n"]):
+        (shards_dir / str(shard)).mkdir(parents=True)
+        (shards_dir / str(shard) / "note.csv").write_text(f"patient_id,dose\n{rows}")
+
+    ShardedPipeline([NoteTask], {}, base_dir=tmp_path, session_id="session")._merge_shards(shards_dir)
+
+    # values that don't parse as their dtype are only missing when the results are read
+    assert (tmp_path / "session" / "note.csv").read_text() == "patient_id,dose\n1,1/2\n2,0.5\n3,\n"
+    assert not shards_dir.exists()
+
+
+async def test_async_pipeline_processes_documents_concurrently(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def process(self: Task, data: str, patient_ids: Iterable[str] | None = None) -> list[dict]:
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+        return [{"patient_id": data}]
+
+    monkeypatch.setattr(Task, "process", process)
+    pipe = AsyncPipeline([NoteTask], Model(model_id="stub"), base_dir=tmp_path, session_id="session", max_workers=4)
+
+    results = [result async for result in pipe.astream(["a", "b", "c", "d"])]
+
+    assert sorted(results) == [
+        (0, "note", [{"patient_id": "a"}]),
+        (1, "note", [{"patient_id": "b"}]),
+        (2, "note", [{"patient_id": "c"}]),
+        (3, "note", [{"patient_id": "d"}]),
+    ]
+    assert running[1] > 1
+
+
+def test_rows_of_crashed_document_are_not_written(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    crashed: list[str] = []
+
+    def run(self: Task, data: str) -> None:
+        self.agent.tools["save_csv"].forward("note", [{"patient_id": data, "dose": "1"}])
+        if data == "c" and not crashed:
+            crashed.append(data)
+            raise RuntimeError("crashed")
+
+    monkeypatch.setattr(Task, "run", run)
+    with pytest.raises(RuntimeError):
+        pipeline(tmp_path).run(["a", "b", "c"])
+
+    # the rows of the crashed document are neither in the results nor written twice by the resumed run
+    results = pipeline(tmp_path).run(["a", "b", "c", "d"], resume=True)
+    assert results["note"]["patient_id"].tolist() == ["a", "b", "c", "d"]
+
+
+def test_shards_split_the_rate_limits(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("OAI_TOKENS_PER_MINUTE", "90000")
+    pipe = ShardedPipeline([NoteTask], {"oai_requests_per_minute": "300"}, base_dir=tmp_path, processes=3)
+
+    assert pipe._shard_model_settings(3) == {"oai_requests_per_minute": "100.0", "oai_tokens_per_minute": "30000.0"}
+    assert pipe.model_settings == {"oai_requests_per_minute": "300"}
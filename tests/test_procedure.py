@@ -0,0 +1,40 @@
+from itertools import combinations, islice
+
+import pytest
+
+from medminer.tools.procedure import DEFAULT_PARALLEL_QUERIES, MAX_TERM_FILTERS, SNOMEDTool
+
+
+def test_term_filters_keep_every_level() -> None:
+    words = ["computed", "tomography", "of", "the", "head", "with", "contrast"]
+    term = " ".join(words)
+
+    queries = list(SNOMEDTool()._build_term_filters(term, {}, []))
+
+    assert queries[0] == [(term,)]
+    # all combination levels from 6 of 7 down to 2 of 7 words are kept, each with its first combinations
+    levels = queries[1:6]
+    assert [len(filters) for filters in levels] == [7] + [MAX_TERM_FILTERS] * 4
+    for size, filters in zip(range(6, 1, -1), levels):
+        assert filters == [(" ".join(comp),) for comp in islice(combinations(words, size), MAX_TERM_FILTERS)]
+
+    assert queries[6] == [tuple(words)]
+
+
+def test_term_filters_of_short_term() -> None:
+    queries = list(SNOMEDTool()._build_term_filters("head scan", {"head": "cranial"}, ["CT"]))
+
+    assert queries == [
+        [("head scan",)],
+        [("head", "cranial"), ("scan",)],
+        [("head", "scan")],
+        [("head", "scan", "CT")],
+    ]
+
+
+def test_parallel_queries_setting() -> None:
+    assert SNOMEDTool()._parallel_queries == DEFAULT_PARALLEL_QUERIES
+    assert SNOMEDTool(snowstorm_parallel_queries=2)._parallel_queries == 2
+
+    with pytest.raises(TypeError):
+        SNOMEDTool(snowstorm_parallel_queries="2")
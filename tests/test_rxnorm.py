@@ -0,0 +1,108 @@
+from pathlib import Path
+
+import pytest
+
+from medminer.utils.rxnorm import RxNormStore
+
+
+def conso(
+    rxcui: str, rxaui: str, sab: str, tty: str, code: str, string: str, lat: str = "ENG", suppress: str = "N"
+) -> str:
+    return "|".join([rxcui, lat, "", "", "", "", "", rxaui, "", "", "", sab, tty, code, string, "", suppress, "", ""])
+
+
+def rel(rxcui1: str, rela: str, rxcui2: str) -> str:
+    return "|".join([rxcui1, "", "CUI", "RO", rxcui2, "", "CUI", rela, "", "", "RXNORM", "", "", "", "", "", ""])
+
+
+def sat(rxcui: str, atn: str, atv: str) -> str:
+    return "|".join([rxcui, "", "", "", "CUI", "", "", "", atn, "VANDF", atv, "N", "", ""])
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> RxNormStore:
+    rrf_dir = tmp_path / "release" / "rrf"
+    rrf_dir.mkdir(parents=True)
+    (rrf_dir / "RXNCONSO.RRF").write_text(
+        "\n".join(
+            [
+                conso("1191", "A1", "RXNORM", "IN", "1191", "Aspirin"),
+                conso("1191", "A2", "MTHSPL", "SU", "R16CO5Y76E", "ASPIRIN"),
+                conso("1191", "A3", "ATC", "IN", "B01AC06", "acetylsalicylic acid"),
+                conso("1191", "A4", "MMSL", "IN", "d00170", "aspirina", lat="SPA"),
+                conso("243670", "A5", "RXNORM", "SCD", "243670", "aspirin 81 MG Oral Tablet"),
+                conso("198467", "A9", "RXNORM", "SCD", "198467", "aspirin 325 MG Oral Tablet"),
+                conso("5640", "A6", "RXNORM", "IN", "5640", "Ibuprofen"),
+                conso("5640", "A7", "RXNORM", "SY", "5640", "Ibuprofenum", suppress="O"),
+                conso("C1", "A8", "ATC", "PT", "B01AC", "Platelet aggregation inhibitors excl. heparin"),
+            ]
+        )
+        + "\n"
+    )
+    (rrf_dir / "RXNREL.RRF").write_text(rel("1191", "has_ingredient", "243670") + "\n")
+    (rrf_dir / "RXNSAT.RRF").write_text(
+        "\n".join([sat("243670", "VA_CLASS_NAME", "[CN103] NON-OPIOID ANALGESICS"), sat("243670", "NDC", "1")]) + "\n"
+    )
+
+    return RxNormStore.build(tmp_path / "release", tmp_path / "rxnorm.sqlite")
+
+
+def test_exact_match(store: RxNormStore) -> None:
+    candidates = store.approximate_term("  ASPIRIN ")["approximateGroup"]["candidate"]
+
+    assert [(candidate["rxcui"], candidate["source"]) for candidate in candidates] == [
+        ("1191", "RXNORM"),
+        ("1191", "MTHSPL"),
+    ]
+    assert {(candidate["rank"], candidate["score"]) for candidate in candidates} == {("1", "100.0")}
+
+
+def test_approximate_ranking(store: RxNormStore) -> None:
+    candidates = store.approximate_term("asprin 81 mg oral tablet")["approximateGroup"]["candidate"]
+
+    assert [candidate["rxcui"] for candidate in candidates][:2] == ["243670", "198467"]
+    assert [candidate["rank"] for candidate in candidates][:2] == ["1", "2"]
+    assert float(candidates[0]["score"]) > float(candidates[1]["score"])
+
+
+def test_skips_suppressed_and_foreign_atoms(store: RxNormStore) -> None:
+    rxauis = {
+        candidate["rxaui"]
+        for term in ("ibuprofenum", "aspirina")
+        for candidate in store.approximate_term(term)["approximateGroup"]["candidate"]
+    }
+
+    assert "A7" not in rxauis
+    assert "A4" not in rxauis
+
+
+def test_empty_term(store: RxNormStore) -> None:
+    assert store.approximate_term(" - ")["approximateGroup"]["candidate"] == []
+
+
+def test_classes_of_ingredient(store: RxNormStore) -> None:
+    infos = store.rxclass_by_rxcui("1191")["rxclassDrugInfoList"]["rxclassDrugInfo"]
+    classes = {(info["minConcept"]["rxcui"], info["rxclassMinConceptItem"]["classId"]) for info in infos}
+
+    # the ATC class of the ingredient itself, the VA class of its product
+    assert classes == {("1191", "B01AC"), ("243670", "CN103")}
+    atc = next(info for info in infos if info["relaSource"] == "ATC")
+    assert atc["rxclassMinConceptItem"]["className"] == "Platelet aggregation inhibitors excl. heparin"
+
+
+def test_classes_of_product(store: RxNormStore) -> None:
+    infos = store.rxclass_by_rxcui("243670")["rxclassDrugInfoList"]["rxclassDrugInfo"]
+
+    assert {(info["minConcept"]["rxcui"], info["rxclassMinConceptItem"]["classId"]) for info in infos} == {
+        ("243670", "CN103"),
+        ("1191", "B01AC"),
+    }
+
+
+def test_without_classes(store: RxNormStore) -> None:
+    assert store.rxclass_by_rxcui("5640") == {}
+
+
+def test_missing_rrf_file(tmp_path: Path) -> None:
+    with pytest.raises(FileNotFoundError, match="RXNCONSO.RRF"):
+        RxNormStore.build(tmp_path, tmp_path / "rxnorm.sqlite")
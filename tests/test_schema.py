@@ -0,0 +1,68 @@
+from pathlib import Path
+
+import pandas as pd
+
+from medminer.utils.schema import Column, apply_schema, read_csv
+
+COLUMNS = [
+    Column("patient_id"),
+    Column("atc_id", "category", code=True),
+    Column("dose", "Float64"),
+    Column("month", "Int64"),
+    Column("ongoing", "boolean"),
+]
+
+
+def test_apply_schema() -> None:
+    df = pd.DataFrame(
+        {
+            "note": ["x", "y", "z"],
+            "month": ["7.0", "0.5", ""],
+            "dose": ["1.5", "1/2", " 2 "],
+            "ongoing": ["True", "0", "maybe"],
+            "atc_id": ["B01AC", "B01AC", ""],
+            "patient_id": [1, 2, 3],
+        }
+    )
+
+    result = apply_schema(df, COLUMNS)
+
+    assert list(result.columns) == ["patient_id", "atc_id", "dose", "month", "ongoing", "note"]
+    assert result.dtypes.astype(str).tolist()[:5] == ["string", "category", "Float64", "Int64", "boolean"]
+    assert result["note"].tolist() == ["x", "y", "z"]
+    assert result["patient_id"].tolist() == ["1", "2", "3"]
+    assert result["atc_id"].cat.categories.tolist() == ["B01AC"]
+    assert result["dose"].tolist()[0] == 1.5
+    assert result["dose"].isna().tolist() == [False, True, False]
+    assert result["month"].tolist()[0] == 7
+    assert result["month"].isna().tolist() == [False, True, True]
+    assert result["ongoing"].tolist()[:2] == [True, False]
+    assert result["ongoing"].isna().tolist() == [False, False, True]
+
+
+def test_apply_schema_adds_missing_columns() -> None:
+    result = apply_schema(pd.DataFrame({"patient_id": ["1"]}), COLUMNS)
+
+    assert list(result.columns) == ["patient_id", "atc_id", "dose", "month", "ongoing"]
+    assert result.iloc[0, 1:].isna().all()
+
+
+def test_apply_schema_without_columns() -> None:
+    df = pd.DataFrame({"value": ["1"]})
+
+    assert apply_schema(df, []) is df
+
+
+def test_read_csv(tmp_path: Path) -> None:
+    path = tmp_path / "medication.csv"
+    path.write_text("patient_id,atc_id,dose,month,ongoing\n007,N02BE,500,3,false\n008,,,,\n")
+
+    result = read_csv(path, COLUMNS)
+
+    # the ids are never inferred as numbers
+    assert result["patient_id"].tolist() == ["007", "008"]
+    assert result["atc_id"].tolist()[0] == "N02BE"
+    assert result["dose"].tolist()[0] == 500.0
+    assert result["month"].tolist()[0] == 3
+    assert not result["ongoing"].tolist()[0]
+    assert result.iloc[1, 1:].isna().all()
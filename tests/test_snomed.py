@@ -0,0 +1,111 @@
+from pathlib import Path
+
+import pytest
+
+from medminer.utils.snomed import FSN_TYPE_ID, FULLY_DEFINED_ID, IS_A_ID, PROCEDURE_ID, SNOMEDIndex
+
+CT_ID = "77477000"
+CT_HEAD_ID = "303653007"
+HEAD_ID = "69536005"
+SYNONYM_TYPE_ID = "900000000000013009"
+PRIMITIVE_ID = "900000000000074008"
+
+
+def write_rf2(path: Path, header: list[str], rows: list[list[str]]) -> None:
+    path.write_text("\n".join("\t".join(row) for row in [header, *rows]) + "\n")
+
+
+@pytest.fixture
+def rf2_dir(tmp_path: Path) -> Path:
+    terminology = tmp_path / "Snapshot" / "Terminology"
+    terminology.mkdir(parents=True)
+    write_rf2(
+        terminology / "sct2_Relationship_Snapshot_INT_20240101.txt",
+        ["id", "effectiveTime", "active", "moduleId", "sourceId", "destinationId", "relationshipGroup", "typeId"],
+        [
+            ["1", "20240101", "1", "0", CT_ID, PROCEDURE_ID, "0", IS_A_ID],
+            ["2", "20240101", "1", "0", CT_HEAD_ID, CT_ID, "0", IS_A_ID],
+            # an inactive IS-A relationship does not make the body structure a procedure
+            ["3", "20240101", "0", "0", HEAD_ID, CT_ID, "0", IS_A_ID],
+            ["4", "20240101", "1", "0", CT_HEAD_ID, HEAD_ID, "0", "405813007"],
+        ],
+    )
+    write_rf2(
+        terminology / "sct2_Concept_Snapshot_INT_20240101.txt",
+        ["id", "effectiveTime", "active", "moduleId", "definitionStatusId"],
+        [
+            [PROCEDURE_ID, "20240101", "1", "0", PRIMITIVE_ID],
+            [CT_ID, "20240101", "1", "0", FULLY_DEFINED_ID],
+            [CT_HEAD_ID, "20240101", "1", "0", PRIMITIVE_ID],
+            [HEAD_ID, "20240101", "1", "0", PRIMITIVE_ID],
+        ],
+    )
+    write_rf2(
+        terminology / "sct2_Description_Snapshot-en_INT_20240101.txt",
+        ["id", "effectiveTime", "active", "moduleId", "conceptId", "languageCode", "typeId", "term"],
+        [
+            ["10", "20240101", "1", "0", PROCEDURE_ID, "en", FSN_TYPE_ID, "Procedure (procedure)"],
+            ["11", "20240101", "1", "0", CT_ID, "en", FSN_TYPE_ID, "Computed tomography (procedure)"],
+            ["12", "20240101", "1", "0", CT_ID, "en", SYNONYM_TYPE_ID, "CT scan"],
+            ["13", "20240101", "1", "0", CT_HEAD_ID, "en", FSN_TYPE_ID, "Computed tomography of head (procedure)"],
+            ["14", "20240101", "0", "0", CT_HEAD_ID, "en", SYNONYM_TYPE_ID, "Cranial scan"],
+            ["15", "20240101", "1", "0", HEAD_ID, "en", FSN_TYPE_ID, "Head structure (body structure)"],
+        ],
+    )
+
+    return tmp_path
+
+
+def concept_ids(results: list[dict]) -> list[str]:
+    return [result["conceptId"] for result in results]
+
+
+def test_closure(rf2_dir: Path) -> None:
+    index = SNOMEDIndex(rf2_dir)
+
+    assert index.descendants == {CT_ID, CT_HEAD_ID}
+
+
+def test_closure_of_other_root(rf2_dir: Path) -> None:
+    assert SNOMEDIndex(rf2_dir, root_id=CT_ID).descendants == {CT_HEAD_ID}
+
+
+def test_prefix_matching(rf2_dir: Path) -> None:
+    index = SNOMEDIndex(rf2_dir)
+
+    assert concept_ids(index.search([("comput tomo",)])) == sorted([CT_ID, CT_HEAD_ID])
+    # the words of a term match in any order
+    assert concept_ids(index.search([("head tomography",)])) == [CT_HEAD_ID]
+    assert concept_ids(index.search([("ct",)])) == [CT_ID]
+    assert index.search([("omputed",)]) == []
+
+
+def test_filters(rf2_dir: Path) -> None:
+    index = SNOMEDIndex(rf2_dir)
+
+    # one term of every filter has to match the same description
+    assert concept_ids(index.search([("ct", "head"), ("computed",)])) == [CT_HEAD_ID]
+    assert concept_ids(index.search([("ct", "head"), ("scan",)])) == [CT_ID]
+    assert concept_ids(index.search([("computed",)], limit=1)) == sorted([CT_ID, CT_HEAD_ID])[:1]
+    assert index.search([("computed",), ("structure",)]) == []
+
+
+def test_skips_inactive_and_other_concepts(rf2_dir: Path) -> None:
+    index = SNOMEDIndex(rf2_dir)
+
+    assert index.search([("cranial",)]) == []
+    assert index.search([("structure",)]) == []
+    assert index.search([("procedure",)]) == index.search([("tomography",)])
+
+
+def test_concept_shape(rf2_dir: Path) -> None:
+    results = SNOMEDIndex(rf2_dir).search([("scan",)])
+
+    assert results == [
+        {"conceptId": CT_ID, "fsn": {"term": "Computed tomography (procedure)"}, "definitionStatus": "FULLY_DEFINED"}
+    ]
+
+
+def test_missing_files(tmp_path: Path) -> None:
+    with pytest.raises(FileNotFoundError, match="sct2_Relationship_Snapshot"):
+        SNOMEDIndex(tmp_path)
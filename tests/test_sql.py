@@ -0,0 +1,117 @@
+import sqlite3
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from medminer.utils import sql
+from medminer.utils.data import Document
+from medminer.utils.sql import iter_sql_documents
+
+QUERY = "SELECT patient_id, text FROM notes ORDER BY patient_id"
+
+
+class ChunkCursor(sqlite3.Cursor):
+    """Cursor recording the number of rows of every fetch."""
+
+    fetched: list[int] = []
+
+    def fetchmany(self, size: int | None = 1) -> list[Any]:
+        rows = super().fetchmany(size)
+        self.fetched.append(len(rows))
+        return rows
+
+
+class ChunkConnection(sqlite3.Connection):
+    """Connection without named cursors, like most DB-API drivers."""
+
+    def cursor(self, *args: Any, **kwargs: Any) -> sqlite3.Cursor:  # type: ignore[override]
+        if kwargs:
+            raise TypeError("cursor() got an unexpected keyword argument")
+
+        return super().cursor(ChunkCursor)
+
+
+@pytest.fixture
+def database(tmp_path: Path) -> Path:
+    path = tmp_path / "notes.sqlite"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE notes (patient_id INTEGER, text TEXT)")
+    conn.executemany(
+        "INSERT INTO notes VALUES (?, ?)",
+        [(i, f"note {i}") for i in range(1, 8)] + [(8, None), (9, "   ")],
+    )
+    conn.commit()
+    conn.close()
+
+    return path
+
+
+def test_fetches_rows_in_chunks(database: Path) -> None:
+    ChunkCursor.fetched = []
+    conn = sqlite3.connect(database, factory=ChunkConnection)
+
+    documents = list(iter_sql_documents(conn, QUERY, chunk_size=3))
+    conn.close()
+
+    assert [document.patient_id for document in documents] == [str(i) for i in range(1, 8)]
+    assert ChunkCursor.fetched == [3, 3, 3, 0]
+
+
+def test_skips_rows_without_text(database: Path) -> None:
+    conn = sqlite3.connect(database)
+
+    documents = list(iter_sql_documents(conn, QUERY))
+    conn.close()
+
+    assert len(documents) == 7
+    assert documents[0] == Document(patient_id="1", text="note 1")
+    assert "8" not in [document.patient_id for document in documents]
+    assert "9" not in [document.patient_id for document in documents]
+
+
+def test_missing_column(database: Path) -> None:
+    conn = sqlite3.connect(database)
+
+    with pytest.raises(ValueError, match="Column note not found"):
+        list(iter_sql_documents(conn, QUERY, text_column="note"))
+
+    conn.close()
+
+
+def test_empty_result(database: Path) -> None:
+    conn = sqlite3.connect(database)
+
+    assert list(iter_sql_documents(conn, "SELECT patient_id, text FROM notes WHERE patient_id > ?", params=(99,))) == []
+
+    conn.close()
+
+
+def test_sqlite_url_without_sqlalchemy(database: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sql, "imported_sqlalchemy", False)
+
+    documents = list(iter_sql_documents(f"sqlite:///{database}", QUERY, chunk_size=2))
+
+    assert [document.text for document in documents] == [f"note {i}" for i in range(1, 8)]
+
+
+def test_other_url_without_sqlalchemy(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sql, "imported_sqlalchemy", False)
+
+    with pytest.raises(ImportError):
+        list(iter_sql_documents("postgresql://localhost/notes", QUERY))
+
+
+def test_url_with_sqlalchemy(database: Path) -> None:
+    pytest.importorskip("sqlalchemy")
+
+    documents = list(
+        iter_sql_documents(
+            f"sqlite:///{database}",
+            "SELECT patient_id, text FROM notes WHERE patient_id <= :max_id ORDER BY patient_id",
+            params={"max_id": 3},
+            chunk_size=2,
+        )
+    )
+
+    assert [document.patient_id for document in documents] == ["1", "2", "3"]
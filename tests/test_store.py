@@ -0,0 +1,87 @@
+import time
+from pathlib import Path
+
+import pytest
+
+from medminer.utils.store import ResultStore
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> ResultStore:
+    return ResultStore(tmp_path / "results.sqlite")
+
+
+def add_codes(store: ResultStore, *codes: str) -> None:
+    store.add("session", "medication", [{"patient_id": code, "atc_id": code} for code in codes], ["atc_id"])
+
+
+def patients(store: ResultStore, code: str, prefix: bool = False, code_column: str | None = None) -> list[str]:
+    results = store.query(code=code, code_column=code_column, prefix=prefix)
+    return sorted(results["patient_id"]) if len(results) else []
+
+
+def test_exact_code(store: ResultStore) -> None:
+    add_codes(store, "J01", "J01CA04", "J02")
+
+    assert patients(store, "J01") == ["J01"]
+    assert patients(store, "J01C") == []
+
+
+@pytest.mark.parametrize(
+    ("prefix", "matching", "other"),
+    [
+        ("J01", ["J01", "J019", "J01CA04"], ["J0", "J02", "J1", "J10", "K01"]),
+        ("J09", ["J09", "J099", "J09Z"], ["J0", "J0A", "J1", "J10"]),
+        ("AZ", ["AZ", "AZ9", "AZZ"], ["A", "AY9", "B", "B0"]),
+    ],
+)
+def test_prefix_range_boundaries(store: ResultStore, prefix: str, matching: list[str], other: list[str]) -> None:
+    add_codes(store, *matching, *other)
+
+    assert patients(store, prefix, prefix=True) == sorted(matching)
+
+
+def test_code_column(store: ResultStore) -> None:
+    store.add(
+        "session",
+        "medication",
+        [{"patient_id": "1", "atc_id": "J01", "rxnorm_id": "723"}, {"patient_id": "2", "atc_id": "723"}],
+        ["atc_id", "rxnorm_id"],
+    )
+
+    assert patients(store, "723") == ["1", "2"]
+    assert patients(store, "723", code_column="atc_id") == ["2"]
+    assert patients(store, "723", code_column="rxnorm_id") == ["1"]
+
+
+def test_rows_of_document_are_replaced(store: ResultStore) -> None:
+    rows = [{"patient_id": "1", "atc_id": "J01"}, {"patient_id": "1", "atc_id": "N02"}]
+    store.add("session", "medication", rows, ["atc_id"], document="hash")
+    store.add("session", "medication", rows, ["atc_id"], document="hash")
+    store.add("other", "medication", rows, ["atc_id"], document="hash")
+
+    assert len(store) == 4
+    assert len(store.query(session_id="session")) == 2
+    assert len(store.query(session_id="session", code="J01")) == 1
+
+
+def test_since_until(store: ResultStore, monkeypatch: pytest.MonkeyPatch) -> None:
+    for timestamp, patient_id in [(100.0, "1"), (200.0, "2"), (300.0, "3")]:
+        monkeypatch.setattr(time, "time", lambda timestamp=timestamp: timestamp)
+        store.add("session", "medication", [{"patient_id": patient_id}])
+    monkeypatch.undo()
+
+    assert store.query(since=200)["patient_id"].tolist() == ["2", "3"]
+    assert store.query(until=200)["patient_id"].tolist() == ["1"]
+    assert store.query(since=100, until=300)["patient_id"].tolist() == ["1", "2"]
+
+
+def test_delete_session(store: ResultStore) -> None:
+    store.add("first", "medication", [{"patient_id": "1", "atc_id": "J01"}], ["atc_id"])
+    store.add("second", "medication", [{"patient_id": "2", "atc_id": "J01"}], ["atc_id"])
+    assert sorted(store.sessions()) == ["first", "second"]
+
+    store.delete_session("first")
+
+    assert store.sessions() == ["second"]
+    assert patients(store, "J01") == ["2"]
@@ -0,0 +1,102 @@
+import csv
+import threading
+from pathlib import Path
+
+from medminer.utils import writer as writer_module
+from medminer.utils.writer import SessionWriter, checkpoint, close_writers, get_writer
+
+
+def read_rows(path: Path) -> list[list[str]]:
+    with open(path, newline="") as f:
+        return list(csv.reader(f))
+
+
+def test_header_is_written_once(tmp_path: Path) -> None:
+    path = tmp_path / "medication.csv"
+    # e.g. two processes appending to the same file
+    first, second = SessionWriter(path), SessionWriter(path)
+
+    first.write(["patient_id", "dose"], [{"patient_id": "1", "dose": "5"}])
+    first.flush()
+    second.write(["dose", "patient_id", "note"], [{"dose": "10", "patient_id": "2", "note": "x"}])
+    second.flush()
+    first.write(["patient_id", "dose"], [{"patient_id": "3", "dose": "15"}])
+    first.close()
+    second.close()
+
+    # the rows are written in the columns of the existing header
+    assert read_rows(path) == [["patient_id", "dose"], ["1", "5"], ["2", "10"], ["3", "15"]]
+
+
+def test_header_has_columns_of_all_buffered_rows(tmp_path: Path) -> None:
+    path = tmp_path / "medication.csv"
+    writer = SessionWriter(path)
+
+    writer.write(["patient_id"], [{"patient_id": "1"}])
+    writer.write(["patient_id", "dose"], [{"patient_id": "2", "dose": "5"}])
+    writer.close()
+
+    assert read_rows(path) == [["patient_id", "dose"], ["1", ""], ["2", "5"]]
+
+
+def test_concurrent_append(tmp_path: Path) -> None:
+    path = tmp_path / "medication.csv"
+    writers = [SessionWriter(path, batch_size=7), SessionWriter(path, batch_size=5)]
+
+    def write(thread: int) -> None:
+        for call in range(20):
+            rows = [{"patient_id": f"{thread}-{call}", "row": str(row)} for row in range(3)]
+            writers[thread % 2].write(["patient_id", "row"], rows)
+
+    threads = [threading.Thread(target=write, args=(thread,)) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for writer in writers:
+        writer.close()
+
+    header, *rows = read_rows(path)
+    assert header == ["patient_id", "row"]
+    assert len(rows) == 8 * 20 * 3
+    # the rows of a write call stay together
+    for i in range(0, len(rows), 3):
+        assert {row[0] for row in rows[i : i + 3]} == {rows[i][0]}
+        assert [row[1] for row in rows[i : i + 3]] == ["0", "1", "2"]
+
+
+def test_deferred_callback_runs_after_flush(tmp_path: Path) -> None:
+    path = tmp_path / "medication.csv"
+    writer = SessionWriter(path)
+    called: list[int] = []
+
+    writer.write(["patient_id"], [{"patient_id": "1"}], [lambda: called.append(len(read_rows(path)))])
+    writer.defer(lambda: called.append(0))
+    assert called == []
+
+    writer.flush()
+    assert called == [2, 0]
+
+    # nothing is buffered, the callback is called right away
+    writer.defer(lambda: called.append(3))
+    assert called == [2, 0, 3]
+
+
+def test_close_writers_releases_writers(tmp_path: Path) -> None:
+    session = tmp_path / "session"
+    path = session / "medication.csv"
+    other = get_writer(tmp_path / "other" / "medication.csv")
+    writer = get_writer(path)
+    assert get_writer(path) is writer
+
+    writer.write(["patient_id"], [{"patient_id": "1"}])
+    checkpoint(session)
+    assert read_rows(path) == [["patient_id"], ["1"]]
+
+    close_writers(session)
+    assert path.resolve() not in writer_module._writers
+    assert get_writer(path) is not writer
+    assert get_writer(tmp_path / "other" / "medication.csv") is other
+
+    close_writers(tmp_path)
+    assert not any(key.is_relative_to(tmp_path.resolve()) for key in writer_module._writers)